@@ -1,21 +1,880 @@
+import bisect
+import contextlib
+import hashlib
+import io
+import math
+import mmap
 import os
+import shutil
+import subprocess
+import sys
 import tempfile
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
+from typing import Callable
 
-from mp3stego import Steganography
+import mp3stego.decoder.Frame
+import mp3stego.encoder.MP3_Encoder
+import mp3stego.encoder.util
+import numpy as np
+from mp3stego import Encoder, Steganography
+from mp3stego.decoder.MP3_Parser import MP3Parser
+from numba.core.dispatcher import Dispatcher
+from profiling import span, timed
+from pydub import AudioSegment
+from pydub.utils import mediainfo_json
 
+PCM_MAGIC = b"HPCM"
+PCM_HEADER_BITS = (len(PCM_MAGIC) + 4) * 8
+PCM_CHUNK_SIZE = 1 << 20
+PCM_SUFFIXES = (".wav", ".flac")
+AUDIO_SUFFIXES = (".mp3", *PCM_SUFFIXES)
 
-def embed_message(audio_path, message, output_path):
-    """Embed a secret message into a mp3."""
+# segmented mp3s end with a header segment holding the magic, the number of
+# payload segments (u8) and their length in frames (u24)
+MP3_MAGIC = b"HMP3"
+MP3_HEADER_SIZE = len(MP3_MAGIC) + 4
+MP3_MIN_SEGMENT_SIZE = 32
+# mp3stego hides up to 3 bits in every granule of a channel, sizes estimate 2
+MP3_BITS_PER_GRANULE = 2
+MP3_MAX_BITS_PER_GRANULE = 3
+# samples the mp3stego encoder and decoder delay a track by
+MP3_CODEC_DELAY = 1057
+# main_data_begin reaches at most 511 bytes back into the previous frames
+MP3_MAX_RESERVOIR = 511
+MP3_BITRATES = {
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+MP3_SAMPLE_RATES = {
+    3: (44100, 48000, 32000),
+    2: (22050, 24000, 16000),
+    0: (11025, 12000, 8000),
+}
+
+
+def embed_message(
+    audio_path,
+    message,
+    output_path,
+    key: str | None = None,
+    workers: int = 1,
+    progress: Callable[[int, int, float], None] | None = None,
+):
+    """
+    Embed a secret message into a mp3, wav or flac. wav and flac use the
+    fast PCM LSB engine, `key` spreads their payload over the track. mp3s are
+    split into segments, see `embed_mp3` for `workers` and `progress`.
+    """
+    if str(audio_path).lower().endswith(PCM_SUFFIXES):
+        embed_pcm(audio_path, message, output_path, key)
+        return
+
+    embed_mp3(audio_path, message, output_path, workers, progress)
+
+
+def extract_message(
+    stego_audio_path,
+    key: str | None = None,
+    workers: int = 1,
+    progress: Callable[[int, int, float], None] | None = None,
+):
+    """Extract a secret message from a mp3, wav or flac."""
+    if str(stego_audio_path).lower().endswith(PCM_SUFFIXES):
+        return extract_pcm(stego_audio_path, key).decode()
+
+    return extract_mp3(stego_audio_path, workers, progress).decode()
+
+
+def _permute(indices: np.ndarray, size: int, key: str) -> np.ndarray:
+    """
+    Keyed pseudo random permutation of range(size) applied to `indices`: a
+    four round Feistel network on the next even power of two, walking cycles
+    until the values fall into the range. It spreads the payload over the
+    track, the payload itself has to be encrypted to be secret.
+    """
+    bits = max(2, (size - 1).bit_length())
+    half = (bits + 1) // 2
+    mask = np.uint64((1 << half) - 1)
+    round_keys = np.frombuffer(
+        hashlib.sha256(b"hider-pcm-permutation:" + key.encode()).digest(), np.uint64
+    )
+
+    def rounds(values: np.ndarray) -> np.ndarray:
+        left, right = values >> np.uint64(half), values & mask
+        for round_key in round_keys:
+            mixed = (right + round_key) * np.uint64(0x9E3779B97F4A7C15)
+            mixed ^= mixed >> np.uint64(31)
+            mixed *= np.uint64(0xBF58476D1CE4E5B9)
+            mixed ^= mixed >> np.uint64(29)
+            left, right = right, left ^ (mixed & mask)
+        return (left << np.uint64(half)) | right
+
+    result = indices.astype(np.uint64)
+    pending = np.arange(len(result))
+    values = result.copy()
+    while len(pending):
+        values = rounds(values)
+        inside = values < np.uint64(size)
+        result[pending[inside]] = values[inside]
+        pending, values = pending[~inside], values[~inside]
+
+    return result.astype(np.int64)
+
+
+def _sample_positions(start: int, stop: int, samples: int, key: str | None):
+    """Sample indices which carry the payload bits start to stop."""
+    indices = np.arange(start, stop, dtype=np.int64)
+    return _permute(indices, samples, key) if key else indices
+
+
+class _PcmLayout:
+    """Where the samples of a track are and which byte holds their LSB."""
+
+    def __init__(self, samples: int, sample_width: int, lsb_offset: int):
+        self.samples = samples
+        self.sample_width = sample_width
+        self.lsb_offset = lsb_offset
+
+    def byte_positions(self, positions: np.ndarray) -> np.ndarray:
+        return positions * self.sample_width + self.lsb_offset
+
+
+def _wav_layout(buffer) -> tuple[_PcmLayout, int]:
+    """Parses the RIFF chunks of a PCM wav, returns its layout and data offset."""
+    if buffer[:4] != b"RIFF" or buffer[8:12] != b"WAVE":
+        raise ValueError("Not a WAV file")
+
+    offset, fmt = 12, None
+    while offset + 8 <= len(buffer):
+        chunk_id = buffer[offset : offset + 4]
+        size = int.from_bytes(buffer[offset + 4 : offset + 8], "little")
+        if chunk_id == b"fmt ":
+            fmt = buffer[offset + 8 : offset + 8 + size]
+        elif chunk_id == b"data":
+            break
+        offset += 8 + size + size % 2
+    else:
+        raise ValueError("WAV file has no data")
+
+    if fmt is None:
+        raise ValueError("WAV file has no format")
+
+    format_tag = int.from_bytes(fmt[0:2], "little")
+    if format_tag == 0xFFFE and len(fmt) >= 26:
+        # WAVE_FORMAT_EXTENSIBLE, the sub format starts with the format tag
+        format_tag = int.from_bytes(fmt[24:26], "little")
+    if format_tag != 1:
+        raise ValueError("Only integer PCM WAV files are supported")
+
+    sample_width = -(-int.from_bytes(fmt[14:16], "little") // 8)
+    data_offset = offset + 8
+    data_size = min(size, len(buffer) - data_offset)
+    return _PcmLayout(data_size // sample_width, sample_width, 0), data_offset
+
+
+def _flac_layout(flac_path) -> tuple[_PcmLayout, list[str], list[str]]:
+    """
+    Probes a flac, returns its layout, the ffmpeg pcm format options and the
+    options keeping its tags.
+    """
+    info = mediainfo_json(str(flac_path))
+    streams = [
+        stream
+        for stream in info.get("streams", [])
+        if stream.get("codec_type") == "audio"
+    ]
+    if not streams or streams[0].get("codec_name") != "flac":
+        raise ValueError("Not a FLAC file")
+
+    stream = streams[0]
+    bits = int(stream.get("bits_per_raw_sample") or 16)
+    if bits not in (16, 24):
+        raise ValueError("Only 16 and 24 bit FLAC files are supported")
+
+    rate, channels = int(stream["sample_rate"]), int(stream["channels"])
+    frames = stream.get("duration_ts") or round(float(stream["duration"]) * rate)
+    samples = int(frames) * channels
+    options = ["-ar", str(rate), "-ac", str(channels)]
+    tags = [
+        option
+        for name, value in info.get("format", {}).get("tags", {}).items()
+        for option in ("-metadata", f"{name}={value}")
+    ]
+    if bits == 16:
+        return _PcmLayout(samples, 2, 0), ["-f", "s16le", *options], tags
+
+    # 24 bit samples are decoded into the upper bits of 32 bit samples
+    return _PcmLayout(samples, 4, 1), ["-f", "s32le", *options], tags
+
+
+def _payload_bits(message) -> np.ndarray:
+    if isinstance(message, str):
+        message = message.encode("utf-8")
+
+    data = PCM_MAGIC + len(message).to_bytes(4, "little") + bytes(message)
+    return np.unpackbits(np.frombuffer(data, np.uint8))
+
+
+def _set_bits(data: np.ndarray, positions: np.ndarray, bits: np.ndarray):
+    data[positions] = (data[positions] & 0xFE) | bits
+
+
+def _check_capacity(layout: _PcmLayout, bits: np.ndarray):
+    if len(bits) > layout.samples:
+        raise ValueError("audio is too small to hold the requested payload")
+
+
+def _embed_wav(wav_path, bits: np.ndarray, output_path, key: str | None):
+    directory = os.path.dirname(os.path.abspath(output_path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    os.close(fd)
+    try:
+        # the kernel copies the track, only the pages holding payload bits
+        # are touched afterwards
+        shutil.copyfile(wav_path, temp_path)
+        with open(temp_path, "r+b") as f, mmap.mmap(f.fileno(), 0) as buffer:
+            layout, data_offset = _wav_layout(buffer)
+            _check_capacity(layout, bits)
+
+            positions = _sample_positions(0, len(bits), layout.samples, key)
+            data = np.frombuffer(buffer, np.uint8, offset=data_offset)
+            _set_bits(data, layout.byte_positions(positions), bits)
+            del data
+            buffer.flush()
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+
+
+def _read_wav_bits(wav_path, start: int, stop: int, key: str | None) -> np.ndarray:
+    with open(wav_path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            layout, data_offset = _wav_layout(buffer)
+            if stop > layout.samples:
+                raise ValueError("Hidden message is truncated")
+
+            positions = _sample_positions(start, stop, layout.samples, key)
+            data = np.frombuffer(buffer, np.uint8, offset=data_offset)
+            bits = data[layout.byte_positions(positions)] & 1
+            del data
+            return bits
+
+
+def _stream_pcm(flac_path, pcm_options: list[str], function) -> int:
+    """
+    Decodes a flac to pcm and calls `function(chunk, offset)` for every
+    chunk, until it returns True. Returns the number of bytes decoded.
+    """
+    command = [
+        AudioSegment.converter,
+        *("-loglevel", "error", "-i", str(flac_path), "-vn"),
+        *pcm_options,
+        "-",
+    ]
+
+    buffer = bytearray(PCM_CHUNK_SIZE)
+    offset = 0
+    with tempfile.TemporaryFile() as stderr:
+        try:
+            # ffmpeg reads keys from stdin, which belongs to the caller
+            process = subprocess.Popen(
+                command,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=stderr,
+                bufsize=0,
+            )
+        except OSError as e:
+            raise ValueError(f"Error opening FLAC file: {e}")
+
+        stopped = False
+        with process:
+            while read := process.stdout.readinto(buffer):
+                chunk = np.frombuffer(buffer, np.uint8, count=read)
+                if function(chunk, offset):
+                    stopped = True
+                    process.kill()
+                    break
+                offset += read
+
+        if not stopped and process.returncode != 0:
+            stderr.seek(0)
+            message = stderr.read().decode(errors="ignore")
+            raise ValueError(f"Error opening FLAC file: {message}")
+
+    return offset
+
+
+def _embed_flac(flac_path, bits: np.ndarray, output_path, key: str | None):
+    layout, pcm_options, tags = _flac_layout(flac_path)
+    _check_capacity(layout, bits)
+
+    positions = layout.byte_positions(
+        _sample_positions(0, len(bits), layout.samples, key)
+    )
+    order = np.argsort(positions)
+    positions, bits = positions[order], bits[order]
+
+    directory = os.path.dirname(os.path.abspath(output_path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".flac")
+    os.close(fd)
+
+    # the modified pcm is piped straight into the encoder. Tags are passed as
+    # options, a second input for -map_metadata stalls the pipe
+    encode = [
+        AudioSegment.converter,
+        *("-loglevel", "error", "-y", *pcm_options, "-i", "-", *tags),
+        *(["-bits_per_raw_sample", "24"] if layout.sample_width == 4 else []),
+        *("-c:a", "flac", temp_path),
+    ]
+
+    try:
+        with tempfile.TemporaryFile() as stderr:
+            encoder = subprocess.Popen(encode, stdin=subprocess.PIPE, stderr=stderr)
+
+            def embed(chunk: np.ndarray, offset: int) -> bool:
+                start = np.searchsorted(positions, offset)
+                stop = np.searchsorted(positions, offset + len(chunk))
+                if stop > start:
+                    chunk = chunk.copy()
+                    _set_bits(chunk, positions[start:stop] - offset, bits[start:stop])
+                encoder.stdin.write(chunk)
+                return False
+
+            try:
+                streamed = _stream_pcm(flac_path, pcm_options, embed)
+            finally:
+                encoder.stdin.close()
+                encoder.wait()
+
+            if encoder.returncode != 0:
+                stderr.seek(0)
+                message = stderr.read().decode(errors="ignore")
+                raise ValueError(f"Error writing FLAC file: {message}")
+
+        # the sample count is estimated from the duration, bits beyond the
+        # decoded samples would be lost
+        if len(positions) and streamed <= positions[-1]:
+            raise ValueError("audio is too small to hold the requested payload")
+
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+
+
+def _read_flac_bits(flac_path, start: int, stop: int, key: str | None) -> np.ndarray:
+    layout, pcm_options, _ = _flac_layout(flac_path)
+    if stop > layout.samples:
+        raise ValueError("Hidden message is truncated")
+
+    positions = layout.byte_positions(
+        _sample_positions(start, stop, layout.samples, key)
+    )
+    order = np.argsort(positions)
+    sorted_positions = positions[order]
+    bits = np.zeros(len(positions), dtype=np.uint8)
+    index = 0
+
+    def read(chunk: np.ndarray, offset: int) -> bool:
+        nonlocal index
+        end = np.searchsorted(sorted_positions, offset + len(chunk))
+        picked = order[index:end]
+        bits[picked] = chunk[sorted_positions[index:end] - offset] & 1
+        index = end
+        return index == len(positions)
+
+    _stream_pcm(flac_path, pcm_options, read)
+    if index < len(positions):
+        raise ValueError("Hidden message is truncated")
+
+    return bits
+
+
+def embed_pcm(audio_path, message, output_path, key: str | None = None):
+    """
+    Hides a message in the least significant bits of the samples of a wav or
+    flac. wav files are memory mapped, flac files are decoded and encoded in
+    chunks through ffmpeg pipes, so memory is bounded by the payload.
+
+    :param audio_path: Carrier wav or flac.
+    :param message: Text or bytes to hide.
+    :param output_path: Path of the stego file, same format as the carrier.
+    :param key: Optional key of a permutation spreading the payload bits.
+    """
+    bits = _payload_bits(message)
+    with span("audio.hide.pcm", len(bits) // 8):
+        if str(audio_path).lower().endswith(".flac"):
+            _embed_flac(audio_path, bits, output_path, key)
+        else:
+            _embed_wav(audio_path, bits, output_path, key)
+
+
+@timed("audio.reveal.pcm")
+def extract_pcm(stego_audio_path, key: str | None = None) -> bytes:
+    """Reveals the bytes hidden by `embed_pcm`."""
+    if str(stego_audio_path).lower().endswith(".flac"):
+        read_bits = _read_flac_bits
+    else:
+        read_bits = _read_wav_bits
+
+    header = np.packbits(read_bits(stego_audio_path, 0, PCM_HEADER_BITS, key))
+    header = header.tobytes()
+    if not header.startswith(PCM_MAGIC):
+        raise ValueError("No hidden message found")
+
+    size = int.from_bytes(header[len(PCM_MAGIC) :], "little")
+    stop = PCM_HEADER_BITS + size * 8
+    return np.packbits(
+        read_bits(stego_audio_path, PCM_HEADER_BITS, stop, key)
+    ).tobytes()
+
+
+def _mp3_frames(data: bytes) -> tuple[list[int], int, int]:
+    """
+    Returns the offsets of the layer III frames of a mp3, the offset where
+    they end and the number of granules of all channels in a frame.
+    """
+    offset = 0
+    if data[:3] == b"ID3":
+        offset = 10 + sum(byte << (7 * (3 - i)) for i, byte in enumerate(data[6:10]))
+        offset += 10 if data[5] & 0x10 else 0
+
+    offsets: list[int] = []
+    granules = 0
+    while offset + 4 <= len(data):
+        header = int.from_bytes(data[offset : offset + 4], "big")
+        version, layer = (header >> 19) & 3, (header >> 17) & 3
+        bitrate, sample_rate = (header >> 12) & 15, (header >> 10) & 3
+        if header >> 21 != 0x7FF or version == 1 or layer != 1:
+            break
+        if bitrate in (0, 15) or sample_rate == 3:
+            break
+
+        mpeg1 = version == 3
+        bitrate = MP3_BITRATES[1 if mpeg1 else 2][bitrate] * 1000
+        sample_rate = MP3_SAMPLE_RATES[version][sample_rate]
+        size = (144 if mpeg1 else 72) * bitrate // sample_rate + ((header >> 9) & 1)
+        if offset + size > len(data):
+            break
+
+        if not offsets:
+            channels = 1 if (header >> 6) & 3 == 3 else 2
+            granules = (2 if mpeg1 else 1) * channels
+        offsets.append(offset)
+        offset += size
+
+    return offsets, offset, granules
+
+
+def _warmup_start(offsets: list[int], index: int) -> int:
+    """
+    Returns the first frame to decode so frame `index` decodes like it does
+    in the whole file: the frame before it needs its bit reservoir and the
+    frame before it fills the overlap of the MDCT.
+    """
+    if index == 0:
+        return 0
+
+    start = index - 1
+    while start > 0 and offsets[index - 1] - offsets[start] < MP3_MAX_RESERVOIR:
+        start -= 1
+    return start
+
+
+def _bit_string(data: bytes, priming: int) -> str:
+    """
+    Returns the bits mp3stego hides for `data`, led by `priming` ones and a
+    zero which the dropped priming frame consumes a part of.
+    """
+    bits = "".join(map(str, np.unpackbits(np.frombuffer(data, np.uint8))))
+    return "1" * priming + "0" + bits
+
+
+def _hide_mp3_segment(
+    data: bytes, skip: int, count: int, bits: str
+) -> tuple[bytes | None, float]:
+    """
+    Re-encodes `count` frames with mp3stego hiding `bits`. The `skip` frames
+    before them only warm the decoder up and a frame after them, when there
+    is one, supplies the samples shifted in by the codec delay. Returns None
+    when the bits do not fit.
+    """
+    start = time.perf_counter()
+    # mp3stego reports its progress on stderr, which interleaves across workers
+    with (
+        tempfile.TemporaryDirectory() as temp_dir,
+        contextlib.redirect_stderr(io.StringIO()),
+    ):
+        wav_path = os.path.join(temp_dir, "segment.wav")
+        mp3_path = os.path.join(temp_dir, "segment.mp3")
+
+        parser = MP3Parser(list(data), 0, wav_path)
+        frames = parser.parse_file()
+        parser.write_to_wav()
+        with wave.open(wav_path, "rb") as wav:
+            params = wav.getparams()
+            pcm = wav.readframes(params.nframes)
+
+        # the frame before the run is encoded too so the encoder does not start
+        # cold on the first frame of the run, it is dropped afterwards
+        samples_per_frame = params.nframes // frames
+        width = params.nchannels * params.sampwidth
+        begin = (samples_per_frame * (skip - 1) + MP3_CODEC_DELAY) * width
+        size = samples_per_frame * (count + 1) * width
+        samples = bytes(max(-begin, 0)) + pcm[max(begin, 0) : begin + size]
+        with wave.open(wav_path, "wb") as wav:
+            wav.setparams(params)
+            wav.writeframes(samples.ljust(size, b"\0"))
+
+        # mp3stego only reports a missing bit from the second to last one on
+        encoder = Encoder(
+            wav_path, mp3_path, parser.get_bitrate() // 1000, hide_str=bits + "0"
+        )
+        too_long = encoder.encode()
+        # the encoder can leave the last frame a byte short, zeros complete it
+        encoded = Path(mp3_path).read_bytes() + bytes(8)
+
+    offsets, end, _ = _mp3_frames(encoded)
+    if too_long or len(offsets) != count + 1:
+        return None, time.perf_counter() - start
+    return encoded[offsets[1] : end], time.perf_counter() - start
+
+
+def _reveal_mp3_segment(data: bytes) -> tuple[bytes, float]:
+    """Decodes a run of frames and returns the bytes mp3stego hid in them."""
+    start = time.perf_counter()
+    with contextlib.redirect_stderr(io.StringIO()):
+        parser = MP3Parser(list(data), 0, "")
+        parser.parse_file()
+
+    # skip what is left of the ones the dropped priming frame hid
+    bits = parser.output_bits
+    bits = np.frombuffer(bits[bits.find("0") + 1 :].encode(), np.uint8) - ord("0")
+    bits = bits[: len(bits) // 8 * 8]
+    return np.packbits(bits).tobytes(), time.perf_counter() - start
+
+
+_mp3stego_warm = False
+
+
+def _warm_mp3stego():
+    """
+    Compiles the numba functions of mp3stego by encoding and decoding a few
+    frames of silence, so the first segment of a process does not pay for
+    it. Workers forked from a warm process inherit the compiled code, others
+    load it from numba's cache on disk.
+    """
+    global _mp3stego_warm
+    if _mp3stego_warm:
+        return
+
+    # mp3stego compiles without the cache, every process would take seconds.
+    # The cache needs the source files, which the frozen executable lacks
+    if not getattr(sys, "frozen", False):
+        for module in (
+            mp3stego.decoder.Frame,
+            mp3stego.encoder.MP3_Encoder,
+            mp3stego.encoder.util,
+        ):
+            for function in vars(module).values():
+                if isinstance(function, Dispatcher):
+                    function.enable_caching()
+
+    with (
+        span("audio.mp3stego.warm"),
+        tempfile.TemporaryDirectory() as temp_dir,
+        contextlib.redirect_stderr(io.StringIO()),
+    ):
+        wav_path = os.path.join(temp_dir, "silence.wav")
+        mp3_path = os.path.join(temp_dir, "silence.mp3")
+        with wave.open(wav_path, "wb") as wav:
+            wav.setparams((2, 2, 44100, 0, "NONE", "not compressed"))
+            wav.writeframes(bytes(4 * 1152 * 4))
+
+        Encoder(wav_path, mp3_path, 128, hide_str="10").encode()
+        MP3Parser(list(Path(mp3_path).read_bytes()), 0, "").parse_file()
+    _mp3stego_warm = True
+
+
+_segment_pool: ProcessPoolExecutor | None = None
+
+
+def enable_segment_pool(workers: int = 0) -> ProcessPoolExecutor:
+    """
+    Keeps a process pool for the mp3 segments alive between calls, so a long
+    running process pays for starting the workers and warming mp3stego up
+    once. Calls with more than one worker use this pool instead of starting
+    their own.
+
+    :param workers: Number of processes, 0 uses all cpus.
+    """
+    global _segment_pool
+    disable_segment_pool()
+    _warm_mp3stego()
+    _segment_pool = ProcessPoolExecutor(
+        workers or os.cpu_count() or 1, initializer=_warm_mp3stego
+    )
+    return _segment_pool
+
+
+def disable_segment_pool():
+    global _segment_pool
+    if _segment_pool:
+        _segment_pool.shutdown(cancel_futures=True)
+    _segment_pool = None
+
+
+def _run_segments(
+    function,
+    jobs: list[tuple],
+    workers: int,
+    progress: Callable[[int, int, float], None] | None,
+) -> list:
+    """
+    Runs `function` over the segment jobs in a process pool and reports every
+    finished segment with the number done, the total and its seconds.
+    """
+    results = [None] * len(jobs)
+    workers = min(workers or os.cpu_count() or 1, len(jobs))
+
+    def report(index: int, result: tuple):
+        results[index] = result
+        if progress:
+            progress(sum(r is not None for r in results), len(jobs), result[-1])
+
+    def run(executor: ProcessPoolExecutor) -> list:
+        futures = {executor.submit(function, *job): i for i, job in enumerate(jobs)}
+        for future in as_completed(futures):
+            report(futures[future], future.result())
+        return results
+
+    # warm before the pool starts, so forked workers do not compile each
+    _warm_mp3stego()
+    with span(f"audio.segments.{function.__name__.strip('_')}"):
+        if workers == 1:
+            for index, job in enumerate(jobs):
+                report(index, function(*job))
+            return results
+
+        if _segment_pool is not None:
+            return run(_segment_pool)
+
+        with ProcessPoolExecutor(workers, initializer=_warm_mp3stego) as executor:
+            return run(executor)
+
+
+def _mp3_run_frames(size: int, granules: int) -> int:
+    """Returns the number of frames to hide `size` bytes and the priming bits."""
+    bits = MP3_MAX_BITS_PER_GRANULE * granules + 1 + size * 8
+    return math.ceil(bits / (MP3_BITS_PER_GRANULE * granules))
+
+
+def _mp3_segments(
+    frames: int, granules: int, size: int, workers: int
+) -> tuple[int, int] | None:
+    """
+    Returns how many segments of how many frames hide `size` bytes in a mp3
+    of `frames` frames, one per worker for large payloads and fewer when the
+    track is too short for their overhead. None when one does not fit.
+    """
+    segments = math.ceil(size / MP3_MIN_SEGMENT_SIZE)
+    segments = max(1, min(workers or os.cpu_count() or 1, segments, 255))
+    header_frames = _mp3_run_frames(MP3_HEADER_SIZE, granules)
+    for count in range(segments, 0, -1):
+        segment_frames = _mp3_run_frames(4 + math.ceil(size / count), granules)
+        if header_frames + count * segment_frames <= frames:
+            return count, segment_frames
+    return None
+
+
+def _mp3_capacity(frames: int, granules: int) -> int:
+    """Returns the largest payload `_mp3_segments` fits in a single segment."""
+    sizes = range(frames * MP3_MAX_BITS_PER_GRANULE * granules // 8 + 1)
+    fits = bisect.bisect_left(
+        sizes, True, key=lambda size: _mp3_segments(frames, granules, size, 1) is None
+    )
+    return max(fits - 1, 0)
+
+
+def _embed_mp3_segments(
+    data: bytes, payload: bytes, workers: int, progress
+) -> bytes | None:
+    offsets, end, granules = _mp3_frames(data)
+    if not offsets:
+        return None
+
+    plan = _mp3_segments(len(offsets), granules, len(payload), workers)
+    if plan is None:
+        return None
+
+    segments, segment_frames = plan
+    size = math.ceil(len(payload) / segments)
+    chunks = [payload[i * size : (i + 1) * size] for i in range(segments)]
+    header_frames = _mp3_run_frames(MP3_HEADER_SIZE, granules)
+    first = len(offsets) - header_frames - segments * segment_frames
+
+    header = MP3_MAGIC + bytes([segments]) + segment_frames.to_bytes(3, "little")
+    # payload segments fill the end of the track, so no frame passed through
+    # unchanged refers to the bit reservoir of a re-encoded one
+    runs = [(first + i * segment_frames, segment_frames) for i in range(segments)]
+    runs.append((len(offsets) - header_frames, header_frames))
+    hidden = [len(chunk).to_bytes(4, "little") + chunk for chunk in chunks]
+    hidden.append(header)
+
+    offsets.append(end)
+    jobs = []
+    for (index, count), segment in zip(runs, hidden):
+        start = _warmup_start(offsets, index)
+        stop = offsets[min(index + count + 1, len(offsets) - 1)]
+        bits = _bit_string(segment, MP3_MAX_BITS_PER_GRANULE * granules)
+        jobs.append((data[offsets[start] : stop], index - start, count, bits))
+
+    encoded = _run_segments(_hide_mp3_segment, jobs, workers, progress)
+    if any(segment is None for segment, _ in encoded):
+        return None
+
+    return b"".join(
+        [data[: offsets[first]], *(segment for segment, _ in encoded), data[end:]]
+    )
+
+
+def _extract_mp3_segments(data: bytes, workers: int, progress) -> bytes | None:
+    offsets, end, granules = _mp3_frames(data)
+    if not offsets:
+        return None
+
+    header_frames = _mp3_run_frames(MP3_HEADER_SIZE, granules)
+    if header_frames > len(offsets):
+        return None
+
+    header, _ = _reveal_mp3_segment(data[offsets[-header_frames] : end])
+    if not header.startswith(MP3_MAGIC):
+        return None
+
+    segments = header[len(MP3_MAGIC)]
+    segment_frames = int.from_bytes(
+        header[len(MP3_MAGIC) + 1 : MP3_HEADER_SIZE], "little"
+    )
+    first = len(offsets) - header_frames - segments * segment_frames
+    if first < 0:
+        raise ValueError("Hidden message is truncated")
+
+    bounds = [offsets[first + i * segment_frames] for i in range(segments + 1)]
+    jobs = [(data[start:stop],) for start, stop in zip(bounds, bounds[1:])]
+
+    payload = []
+    for chunk, _ in _run_segments(_reveal_mp3_segment, jobs, workers, progress):
+        size = int.from_bytes(chunk[:4], "little")
+        if 4 + size > len(chunk):
+            raise ValueError("Hidden message is truncated")
+        payload.append(chunk[4 : 4 + size])
+    return b"".join(payload)
+
+
+def embed_mp3(
+    audio_path,
+    message,
+    output_path,
+    workers: int = 1,
+    progress: Callable[[int, int, float], None] | None = None,
+):
+    """
+    Hides a message in a mp3 with mp3stego. Only the frames at the end of the
+    track that carry the payload are decoded and re-encoded, in segments
+    handled by a pool of processes, every other frame is copied unchanged.
+    When a segment holds fewer bits than estimated the whole track is
+    re-encoded in one pass like mp3stego does. Raises ValueError when the
+    message is larger than `capacity`.
+
+    :param audio_path: Carrier mp3.
+    :param message: Text or bytes to hide.
+    :param output_path: Path of the stego mp3.
+    :param workers: Number of processes, 0 uses all cpus.
+    :param progress: Called with the number of finished segments, the number
+        of segments and the seconds the last one took.
+    """
+    if isinstance(message, str):
+        message = message.encode("utf-8")
+
+    data = Path(audio_path).read_bytes()
+    offsets, _, granules = _mp3_frames(data)
+    if not offsets:
+        raise ValueError(f"{audio_path} is not a mp3")
+    # mp3stego silently cuts off what does not fit the track
+    if len(message) > _mp3_capacity(len(offsets), granules):
+        raise ValueError("audio is too small to hold the requested payload")
+
+    with span("audio.hide.mp3", len(message)):
+        encoded = _embed_mp3_segments(data, bytes(message), workers, progress)
+    if encoded is not None:
+        Path(output_path).write_bytes(encoded)
+        return
+
+    start = time.perf_counter()
     stego = Steganography(quiet=True)
-    stego.hide_message(audio_path, output_path, message)
+    with span("audio.hide.mp3stego", len(message)):
+        too_long = stego.hide_message(
+            audio_path, output_path, bytes(message).decode("utf-8")
+        )
+    if too_long:
+        Path(output_path).unlink(missing_ok=True)
+        raise ValueError("audio is too small to hold the requested payload")
+    if progress:
+        progress(1, 1, time.perf_counter() - start)
 
 
-def extract_message(stego_audio_path):
-    """Extract a secret message from a mp3."""
+def extract_mp3(
+    stego_audio_path,
+    workers: int = 1,
+    progress: Callable[[int, int, float], None] | None = None,
+) -> bytes:
+    """
+    Reveals the bytes hidden by `embed_mp3`, segments are decoded in a pool
+    of processes. mp3s written in one pass are decoded whole.
+    """
+    with span("audio.reveal.mp3"):
+        payload = _extract_mp3_segments(
+            Path(stego_audio_path).read_bytes(), workers, progress
+        )
+    if payload is not None:
+        return payload
+
+    start = time.perf_counter()
     stego = Steganography(quiet=True)
-    with tempfile.TemporaryDirectory() as temp_dir:
+    with span("audio.reveal.mp3stego"), tempfile.TemporaryDirectory() as temp_dir:
         out_file = os.path.join(temp_dir, "message.txt")
 
-        stego.reveal_massage(stego_audio_path, out_file)
-        return Path(out_file).read_text()
+        stego.reveal_massage(str(stego_audio_path), out_file)
+        payload = Path(out_file).read_bytes()
+    if progress:
+        progress(1, 1, time.perf_counter() - start)
+    return payload
+
+
+def capacity(audio_path) -> int:
+    """
+    Returns how many bytes can be hidden in a mp3, wav or flac without
+    embedding. wav and flac are counted from their headers. mp3s are planned
+    like `embed_mp3` splits them, the largest payload whose segment fits at
+    the estimated bits per frame, so the real capacity is usually a bit higher.
+    """
+    if str(audio_path).lower().endswith(".flac"):
+        layout = _flac_layout(audio_path)[0]
+        return max(layout.samples // 8 - PCM_HEADER_BITS // 8, 0)
+
+    if str(audio_path).lower().endswith(".wav"):
+        with open(audio_path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                layout = _wav_layout(buffer)[0]
+        return max(layout.samples // 8 - PCM_HEADER_BITS // 8, 0)
+
+    offsets, _, granules = _mp3_frames(Path(audio_path).read_bytes())
+    if not offsets:
+        raise ValueError(f"{audio_path} is not a mp3, wav or flac")
+
+    return _mp3_capacity(len(offsets), granules)
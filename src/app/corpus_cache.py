@@ -0,0 +1,189 @@
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+from pathlib import Path
+
+import fitz
+import numpy as np
+from encryption_by_text import Corpus, get_corpus
+
+MAGIC = b"HIDERCRP"
+FORMAT_VERSION = 1
+DEFAULT_MAX_SIZE = 1 << 30
+SUFFIX = ".corpus"
+
+
+def extraction_settings() -> dict:
+    """Everything besides the pdf itself which changes the extracted corpus."""
+    return {"format": FORMAT_VERSION, "pymupdf": fitz.VersionBind}
+
+
+def _file_digest(file: str) -> str:
+    digest = hashlib.sha256()
+    with open(file, "rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def write_corpus(path: str, corpus: Corpus):
+    """
+    Writes a corpus into a single binary file: a magic, the length of a json
+    header describing the arrays, the header and the 8 byte aligned arrays.
+    """
+    arrays = {
+        "text": np.frombuffer(corpus.text.encode("utf-8"), dtype=np.uint8),
+        "starts": np.ascontiguousarray(corpus.starts),
+        "positions": np.ascontiguousarray(corpus.positions),
+        "suffixes": np.ascontiguousarray(corpus.suffixes),
+    }
+
+    header, offset = {}, 0
+    for name, array in arrays.items():
+        header[name] = [array.dtype.str, list(array.shape), offset]
+        offset += -(-array.nbytes // 8) * 8
+
+    header = json.dumps(header).encode()
+    header += b" " * (-(len(MAGIC) + 4 + len(header)) % 8)
+
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(4, "little"))
+        f.write(header)
+        for array in arrays.values():
+            f.write(memoryview(array).cast("B"))
+            f.write(b"\0" * (-array.nbytes % 8))
+
+
+def read_corpus(path: str) -> Corpus:
+    """
+    Memory maps a file written by `write_corpus`. Only the text is decoded,
+    the arrays are used straight from the mapping.
+    """
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if buffer[: len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a corpus file")
+
+    size = int.from_bytes(buffer[len(MAGIC) : len(MAGIC) + 4], "little")
+    start = len(MAGIC) + 4 + size
+    header = json.loads(buffer[len(MAGIC) + 4 : start])
+
+    arrays = {}
+    for name, (dtype, shape, offset) in header.items():
+        dtype = np.dtype(dtype)
+        count = int(np.prod(shape))
+        array = np.frombuffer(buffer, dtype, count, start + offset)
+        arrays[name] = array.reshape(shape)
+
+    return Corpus(
+        arrays.pop("text").tobytes().decode("utf-8"),
+        **arrays,
+    )
+
+
+class CorpusCache:
+    """
+    On disk cache of extracted and indexed pdf corpora. Entries are keyed by
+    the content hash of the pdf and the extraction settings and are evicted
+    least recently used first once the cache grows above `max_size` bytes.
+    """
+
+    def __init__(self, directory: str, max_size: int = DEFAULT_MAX_SIZE):
+        self.directory = Path(directory)
+        self.max_size = max_size
+
+    def path(self, file: str, digest: str | None = None) -> Path:
+        """
+        Path of the entry of a pdf, `digest` of a `_file_digest` call skips
+        hashing the pdf again.
+        """
+        digest = digest or _file_digest(file)
+        settings = json.dumps(extraction_settings(), sort_keys=True)
+        key = hashlib.sha256(f"{digest}:{settings}".encode())
+        return self.directory / f"{key.hexdigest()}{SUFFIX}"
+
+    def entries(self) -> list[Path]:
+        if not self.directory.is_dir():
+            return []
+
+        return sorted(
+            self.directory.glob(f"*{SUFFIX}"), key=lambda p: p.stat().st_mtime
+        )
+
+    def load(self, file: str, digest: str | None = None) -> Corpus | None:
+        path = self.path(file, digest)
+        try:
+            corpus = read_corpus(path)
+        except (OSError, ValueError):
+            return None
+
+        # mark as recently used for the eviction
+        os.utime(path)
+        return corpus
+
+    def store(
+        self,
+        file: str,
+        corpus: Corpus | None = None,
+        workers: int = 1,
+        digest: str | None = None,
+    ) -> Path:
+        corpus = corpus or get_corpus(file, workers)
+        path = self.path(file, digest)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        # write to a temp file first so readers never see partial entries
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            write_corpus(temp_path, corpus)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+
+        self.evict(keep=path)
+        return path
+
+    def get(self, file: str, workers: int = 1) -> Corpus:
+        # the pdf is hashed once for the lookup and the store on a miss
+        digest = _file_digest(file)
+        corpus = self.load(file, digest)
+        if corpus is None:
+            corpus = get_corpus(file, workers)
+            self.store(file, corpus, digest=digest)
+
+        return corpus
+
+    def evict(self, keep: Path | None = None):
+        entries = self.entries()
+        total = sum(p.stat().st_size for p in entries)
+        for path in entries:
+            if total <= self.max_size:
+                break
+            if path == keep:
+                continue
+
+            size = path.stat().st_size
+            try:
+                path.unlink()
+                total -= size
+            except OSError:
+                # still mapped by another process (windows)
+                pass
+
+    def clear(self) -> int:
+        removed = 0
+        for path in self.entries():
+            try:
+                path.unlink()
+                removed += 1
+            except OSError:
+                pass
+
+        return removed
@@ -1,6 +1,22 @@
+import os
 import secrets
+from typing import BinaryIO, Iterable, Iterator
 
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from profiling import span
+from utils import map_bounded
+
+STREAM_MAGIC = b"HSE1"
+CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+NONCE_SIZE = 12
+NONCE_PREFIX_SIZE = 7
+TAG_SIZE = 16
+
+# encrypt_into/decrypt_into are only available in newer cryptography releases
+_HAS_INTO = hasattr(AESGCM, "encrypt_into")
 
 
 def encrypt_with_key(plaintext: str, key: str) -> str:
@@ -23,9 +39,9 @@ def encrypt_with_key(plaintext: str, key: str) -> str:
     aesgcm = AESGCM(key)
 
     # Encrypt and get ciphertext + authentication tag
-    ciphertext = aesgcm.encrypt(
-        nonce=nonce, data=plaintext.encode("utf-8"), associated_data=None
-    )
+    data = plaintext.encode("utf-8")
+    with span("crypto.encrypt", len(data)):
+        ciphertext = aesgcm.encrypt(nonce=nonce, data=data, associated_data=None)
 
     # Combine nonce + ciphertext + tag
     return nonce + ciphertext
@@ -52,6 +68,237 @@ def decrypt_with_key(encrypted_data: bytes, key: bytes) -> str:
     aesgcm = AESGCM(key)
 
     # Decrypt and verify integrity
-    plaintext = aesgcm.decrypt(nonce=nonce, data=ciphertext, associated_data=None)
+    with span("crypto.decrypt", len(ciphertext)):
+        plaintext = aesgcm.decrypt(nonce=nonce, data=ciphertext, associated_data=None)
 
     return plaintext.decode("utf-8")
+
+
+def _key_bytes(key: str | bytes) -> bytes:
+    if len(key) == 64:
+        key = bytes.fromhex(key.decode() if isinstance(key, bytes) else key)
+    if len(key) != 32:
+        raise ValueError(f"Key must be exactly 32 bytes long {len(key)}")
+
+    return key
+
+
+class CipherContext:
+    """
+    AES-256-GCM with a key parsed and validated once, for sealing many
+    messages. Messages use the format of encrypt_with_key(): nonce +
+    ciphertext + tag.
+    """
+
+    def __init__(self, key: str | bytes):
+        self._aesgcm = AESGCM(_key_bytes(key))
+
+    def encrypt_into(self, plaintext: str | bytes, buffer: memoryview) -> int:
+        """
+        Encrypts into a preallocated buffer of at least len(plaintext) + 28
+        bytes and returns the number of bytes written.
+        """
+        if isinstance(plaintext, str):
+            plaintext = plaintext.encode("utf-8")
+
+        size = NONCE_SIZE + len(plaintext) + TAG_SIZE
+        buffer = memoryview(buffer)[:size]
+        buffer[:NONCE_SIZE] = nonce = secrets.token_bytes(NONCE_SIZE)
+        if _HAS_INTO:
+            self._aesgcm.encrypt_into(nonce, plaintext, None, buffer[NONCE_SIZE:])
+        else:
+            buffer[NONCE_SIZE:] = self._aesgcm.encrypt(nonce, plaintext, None)
+
+        return size
+
+    def decrypt_into(self, encrypted_data: bytes, buffer: memoryview) -> int:
+        """
+        Decrypts into a preallocated buffer of at least len(encrypted_data) - 28
+        bytes and returns the number of bytes written.
+        """
+        encrypted_data = memoryview(encrypted_data)
+        size = len(encrypted_data) - NONCE_SIZE - TAG_SIZE
+        if size < 0:
+            raise ValueError("Encrypted data is too short")
+
+        nonce, ciphertext = encrypted_data[:NONCE_SIZE], encrypted_data[NONCE_SIZE:]
+        buffer = memoryview(buffer)[:size]
+        if _HAS_INTO:
+            self._aesgcm.decrypt_into(nonce, ciphertext, None, buffer)
+        else:
+            buffer[:] = self._aesgcm.decrypt(bytes(nonce), bytes(ciphertext), None)
+
+        return size
+
+    def encrypt(self, plaintext: str | bytes) -> bytearray:
+        if isinstance(plaintext, str):
+            plaintext = plaintext.encode("utf-8")
+
+        buffer = bytearray(NONCE_SIZE + len(plaintext) + TAG_SIZE)
+        self.encrypt_into(plaintext, buffer)
+        return buffer
+
+    def decrypt(self, encrypted_data: bytes) -> bytearray:
+        buffer = bytearray(max(0, len(encrypted_data) - NONCE_SIZE - TAG_SIZE))
+        self.decrypt_into(encrypted_data, buffer)
+        return buffer
+
+    def encrypt_many(
+        self, plaintexts: Iterable[str | bytes], workers: int = 1
+    ) -> Iterator[bytearray]:
+        """Encrypts many messages in order, optionally in a thread pool."""
+        return map_bounded(self.encrypt, plaintexts, workers)
+
+    def decrypt_many(
+        self, encrypted_data: Iterable[bytes], workers: int = 1
+    ) -> Iterator[bytearray]:
+        """Decrypts many messages in order, optionally in a thread pool."""
+        return map_bounded(self.decrypt, encrypted_data, workers)
+
+
+def _chunk_nonce(prefix: bytes, counter: int, last: bool) -> bytes:
+    # 7 byte random prefix, 4 byte chunk counter and a final chunk flag
+    if counter >= 2**32:
+        raise ValueError("Too many chunks, use a larger chunk size")
+
+    return prefix + counter.to_bytes(4, "big") + (b"\x01" if last else b"\x00")
+
+
+def _read_into(source: BinaryIO, buffer: bytearray) -> int:
+    """Fills the buffer unless the stream ends, pipes may return short reads."""
+    view, size = memoryview(buffer), 0
+    while size < len(buffer):
+        read = source.readinto(view[size:])
+        if not read:
+            break
+        size += read
+
+    return size
+
+
+def encrypt_stream(
+    source: BinaryIO, target: BinaryIO, key: str | bytes, chunk_size: int = CHUNK_SIZE
+):
+    """
+    Encrypts a binary stream in chunks with AES-256-GCM using constant memory.
+
+    The output starts with a header (magic, chunk size, nonce prefix) followed
+    by the chunks, each one ciphertext + tag. Chunk nonces are derived from the
+    prefix, a counter and a flag marking the final chunk, and the header is
+    authenticated with every chunk, so reordering, truncation and appending are
+    detected on decryption.
+
+    :param source: Readable binary stream with the plaintext.
+    :param target: Writable binary stream for the encrypted data.
+    :param key: 32-byte encryption key or its hex representation.
+    :param chunk_size: Size of the plaintext chunks.
+    """
+    key = _key_bytes(key)
+    if not 0 < chunk_size <= MAX_CHUNK_SIZE:
+        raise ValueError(f"Chunk size must be between 1 and {MAX_CHUNK_SIZE}")
+
+    prefix = secrets.token_bytes(NONCE_PREFIX_SIZE)
+    header = STREAM_MAGIC + chunk_size.to_bytes(4, "big") + prefix
+    target.write(header)
+
+    current, ahead = bytearray(chunk_size), bytearray(chunk_size)
+    output = memoryview(bytearray(chunk_size + 15))
+    size, counter = _read_into(source, current), 0
+
+    with span("crypto.encrypt_stream") as encrypting:
+        while True:
+            # read ahead to know if the current chunk is the final one
+            ahead_size = _read_into(source, ahead) if size == chunk_size else 0
+            last = ahead_size == 0
+
+            nonce = _chunk_nonce(prefix, counter, last)
+            encryptor = Cipher(algorithms.AES(key), modes.GCM(nonce)).encryptor()
+            encryptor.authenticate_additional_data(header)
+            written = encryptor.update_into(memoryview(current)[:size], output)
+            encryptor.finalize()
+            target.write(output[:written])
+            target.write(encryptor.tag)
+            encrypting.add_bytes(size)
+
+            if last:
+                break
+
+            current, ahead, size = ahead, current, ahead_size
+            counter += 1
+
+
+def decrypt_stream(source: BinaryIO, target: BinaryIO, key: str | bytes):
+    """
+    Decrypts a stream written by encrypt_stream(). Every chunk is verified
+    before it is written, on an error the output written so far has to be
+    discarded.
+
+    :param source: Readable binary stream with the encrypted data.
+    :param target: Writable binary stream for the plaintext.
+    :param key: 32-byte encryption key or its hex representation.
+    """
+    key = _key_bytes(key)
+    header = source.read(len(STREAM_MAGIC) + 4 + NONCE_PREFIX_SIZE)
+    if len(header) < len(STREAM_MAGIC) + 4 or not header.startswith(STREAM_MAGIC):
+        raise ValueError("Not an encrypted stream")
+
+    chunk_size = int.from_bytes(
+        header[len(STREAM_MAGIC) : len(STREAM_MAGIC) + 4], "big"
+    )
+    prefix = header[len(STREAM_MAGIC) + 4 :]
+    if not 0 < chunk_size <= MAX_CHUNK_SIZE or len(prefix) != NONCE_PREFIX_SIZE:
+        raise ValueError("Invalid encrypted stream header")
+
+    record_size = chunk_size + TAG_SIZE
+    current, ahead = bytearray(record_size), bytearray(record_size)
+    output = memoryview(bytearray(chunk_size + 15))
+    size, counter = _read_into(source, current), 0
+
+    with span("crypto.decrypt_stream") as decrypting:
+        while True:
+            if size < TAG_SIZE:
+                raise ValueError("Encrypted stream is truncated")
+
+            ahead_size = _read_into(source, ahead) if size == record_size else 0
+            last = ahead_size == 0
+
+            chunk = memoryview(current)
+            nonce = _chunk_nonce(prefix, counter, last)
+            tag = bytes(chunk[size - TAG_SIZE : size])
+            decryptor = Cipher(algorithms.AES(key), modes.GCM(nonce, tag)).decryptor()
+            decryptor.authenticate_additional_data(header)
+            written = decryptor.update_into(chunk[: size - TAG_SIZE], output)
+            try:
+                decryptor.finalize()
+            except InvalidTag:
+                raise ValueError(
+                    f"Chunk {counter} could not be authenticated, "
+                    "the stream is corrupted or truncated"
+                )
+            target.write(output[:written])
+            decrypting.add_bytes(written)
+
+            if last:
+                break
+
+            current, ahead, size = ahead, current, ahead_size
+            counter += 1
+
+
+def encrypt_file(
+    in_path: str, out_path: str, key: str | bytes, chunk_size: int = CHUNK_SIZE
+):
+    """Encrypts a file of any size with encrypt_stream()."""
+    with open(in_path, "rb") as source, open(out_path, "wb") as target:
+        encrypt_stream(source, target, key, chunk_size)
+
+
+def decrypt_file(in_path: str, out_path: str, key: str | bytes):
+    """Decrypts a file written by encrypt_file(), removes the output on errors."""
+    try:
+        with open(in_path, "rb") as source, open(out_path, "wb") as target:
+            decrypt_stream(source, target, key)
+    except Exception:
+        if os.path.exists(out_path):
+            os.unlink(out_path)
+        raise
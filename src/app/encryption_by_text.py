@@ -1,101 +1,388 @@
+import os
 import re
 import secrets
-from typing import Iterator
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator
 
 import fitz
+import numpy as np
+from profiling import span
+
+# fragments whose occurrences a process keeps while generating many keys
+LOOKUP_SIZE = 4096
 
 # TODO:
 #  add text staganbography i.e.
 #
 # - very fancy ML based steganography https://github.com/mickeysjm/StegaText/blob/master/run_single_end2end.py
-# - whitespace stego based on java https://darkside.com.au/snow/
 # - using typos as stego based on nodejs https://github.com/mjethani/typo
 #
 
 
-def get_text(file: str) -> list[list[list[str]]]:
-    def extract_text(page: fitz.Page, num: int) -> list[str]:
-        # Detect column boundaries (ignore footer and text over images)
-        # bboxes = column_boxes(page, footer_margin=50, no_image_text=True)
+def _extract_text(page: fitz.Page) -> list[list[list[str]]]:
+    # Detect column boundaries (ignore footer and text over images)
+    # bboxes = column_boxes(page, footer_margin=50, no_image_text=True)
+
+    # Extract text from each column
+    # from multi_column import column_boxes
+    #   Download utility: https://github.com/pymupdf/PyMuPDF-Utilities
+    # columns_text = [page.get_text(clip=rect, sort=True) for rect in bboxes]
+    #
+    # for i, text in enumerate(columns_text):
+    #     print(f"Column {i + 1}:\n{text}\n")
+    return [[re.split(r"\s+", l) for l in re.split(r"\n|\r\n|\r", page.get_text())]]
+
+
+def _extract_pages(file: str, start: int, stop: int) -> list[list[list[list[str]]]]:
+    # every worker process needs its own document handle
+    with fitz.open(file) as doc:
+        return [_extract_text(doc[num]) for num in range(start, stop)]
+
+
+def get_text(file: str, workers: int = 1) -> list[list[list[str]]]:
+    """
+    Extracts the words of a pdf as pages of columns of lines of words.
+
+    :param file: Path to the PDF file.
+    :param workers: Number of processes extracting pages, 0 uses all cpus.
+    :return: The words of the pdf.
+    """
+    file = str(file)
+    workers = workers or os.cpu_count() or 1
+    with span("text.extract") as extracting:
+        if workers == 1:
+            with fitz.open(file) as doc:
+                extracting.add_bytes(os.path.getsize(file))
+                return [_extract_text(page) for page in doc]
+
+        with fitz.open(file) as doc:
+            extracting.add_bytes(os.path.getsize(file))
+            page_count = doc.page_count
+
+        # several small ranges per worker balance pages of uneven size
+        step = max(1, -(-page_count // (workers * 4)))
+        starts = range(0, page_count, step)
+        stops = [min(start + step, page_count) for start in starts]
+
+        with ProcessPoolExecutor(workers) as executor:
+            chunks = executor.map(_extract_pages, [file] * len(starts), starts, stops)
+            return [page for chunk in chunks for page in chunk]
+
+
+def _suffix_array(codes: np.ndarray, depth: int) -> np.ndarray:
+    """
+    Sorts all suffixes of `codes` by their first `depth` characters using
+    prefix doubling. Suffixes sharing those characters keep an arbitrary order,
+    which is fine as long as no search is longer than `depth`.
+    """
+    n = len(codes)
+    rank = codes.astype(np.int64)
+    suffixes = np.argsort(rank, kind="stable")
+
+    k = 1
+    while k < depth and n > 1:
+        second = np.full(n, -1, dtype=np.int64)
+        second[:-k] = rank[k:]
+        suffixes = np.lexsort((second, rank))
+
+        first, second = rank[suffixes], second[suffixes]
+        changed = np.empty(n, dtype=bool)
+        changed[0] = True
+        changed[1:] = (first[1:] != first[:-1]) | (second[1:] != second[:-1])
+        rank = np.empty(n, dtype=np.int64)
+        rank[suffixes] = np.cumsum(changed) - 1
+
+        if rank[suffixes[-1]] == n - 1:
+            break
+        k *= 2
+
+    return suffixes.astype(np.int32 if n < 2**31 else np.int64)
+
+
+class Corpus:
+    """
+    Compact representation of a text returned by `get_text`.
+
+    All non empty words are stored in one string separated by new lines. For
+    every word the start offset and its page, column, line and word number are
+    kept in arrays, and a suffix array over the string allows to find all
+    occurrences of a fragment with a binary search.
+    """
+
+    def __init__(
+        self,
+        text: str,
+        starts: np.ndarray,
+        positions: np.ndarray,
+        suffixes: np.ndarray,
+    ):
+        self.text = text
+        self.starts = starts
+        self.positions = positions
+        self.suffixes = suffixes
+
+    @classmethod
+    def from_text(cls, text: list[list[list[str]]]) -> "Corpus":
+        words, positions = [], []
+        for page_num, page in enumerate(text):
+            for column_num, column in enumerate(page):
+                for line_num, line in enumerate(column):
+                    for word_num, word in enumerate(line):
+                        if word:
+                            words.append(word)
+                            positions.append(
+                                (
+                                    page_num + 1,
+                                    column_num + 1,
+                                    line_num + 1,
+                                    word_num + 1,
+                                )
+                            )
+
+        lengths = np.fromiter((len(w) + 1 for w in words), np.int64, len(words))
+        starts = np.zeros(len(words), dtype=np.int64)
+        np.cumsum(lengths[:-1], out=starts[1:])
+
+        flat = "\n".join(words)
+        codes = np.frombuffer(flat.encode("utf-32-le"), dtype=np.uint32)
+        depth = int(lengths.max()) if len(words) else 1
+
+        return cls(
+            flat,
+            starts,
+            np.array(positions, dtype=np.int32).reshape(-1, 4),
+            _suffix_array(codes, depth),
+        )
+
+    def occurrences(self, search: str) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Finds every word containing `search`. Like a scan over all words only the
+        first occurrence within a word is reported.
+
+        :param search: Fragment to search for, can not contain white spaces.
+        :return: Indices of the matching words and the 0-based offsets of
+            `search` within them, ordered by word.
+        """
+        empty = np.empty(0, dtype=np.int64)
+        if not search or re.search(r"\s", search):
+            return empty, empty
+
+        size = len(search)
+
+        def prefix(i):
+            return self.text[i : i + size]
+
+        lower = bisect_left(self.suffixes, search, key=prefix)
+        upper = bisect_right(self.suffixes, search, lo=lower, key=prefix)
+        if lower == upper:
+            return empty, empty
+
+        offsets = np.sort(self.suffixes[lower:upper])
+        words = np.searchsorted(self.starts, offsets, side="right") - 1
+        words, first = np.unique(words, return_index=True)
+
+        return words, offsets[first] - self.starts[words]
+
+    def contains(self, search: str) -> bool:
+        """Checks if any word contains `search`."""
+        if not search or re.search(r"\s", search):
+            return False
+
+        size = len(search)
+        lower = bisect_left(
+            self.suffixes, search, key=lambda i: self.text[i : i + size]
+        )
+        if lower == len(self.suffixes):
+            return False
+
+        start = self.suffixes[lower]
+        return self.text[start : start + size] == search
 
-        # Extract text from each column
-        # from multi_column import column_boxes
-        #   Download utility: https://github.com/pymupdf/PyMuPDF-Utilities
-        # columns_text = [page.get_text(clip=rect, sort=True) for rect in bboxes]
-        #
-        # for i, text in enumerate(columns_text):
-        #     print(f"Column {i + 1}:\n{text}\n")
-        return [[re.split(r"\s+", l) for l in re.split(r"\n|\r\n|\r", page.get_text())]]
+    def location(
+        self, word: int, offset: int, size: int
+    ) -> tuple[int, int, int, int, int, int]:
+        """Returns the 1-based (page, column, line, word, offset, length)."""
+        return (*map(int, self.positions[word]), int(offset) + 1, size)
 
-    doc = fitz.open(str(file))
-    return [extract_text(page, num) for num, page in enumerate(doc)]
+    def find(self, search: str) -> list[tuple[int, int, int, int, int, int]]:
+        words, offsets = self.occurrences(search)
+        return [self.location(w, o, len(search)) for w, o in zip(words, offsets)]
+
+
+def _as_corpus(text: Corpus | list[list[list[str]]]) -> Corpus:
+    return text if isinstance(text, Corpus) else Corpus.from_text(text)
+
+
+def get_corpus(file: str, workers: int = 1) -> Corpus:
+    text = get_text(file, workers)
+    with span("text.index"):
+        return Corpus.from_text(text)
+
+
+class _Lookup:
+    """
+    Occurrences of the most recently searched fragments, they repeat a lot
+    when encoding many secrets against one corpus.
+    """
+
+    def __init__(self, max_entries: int = LOOKUP_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def occurrences(self, search: str, text: Corpus) -> tuple[np.ndarray, np.ndarray]:
+        if search in self._entries:
+            self._entries.move_to_end(search)
+            return self._entries[search]
+
+        found = self._entries[search] = text.occurrences(search)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return found
+
+    def __len__(self):
+        return len(self._entries)
 
 
 def _find_word(
-    search: str, text: list[list[list[str]]]
+    search: str, text: Corpus, lookup: _Lookup | None = None
 ) -> tuple[int, int, int, int, int] | None:
     search = search.strip()
     assert search, "Can not searh for empty word"
-    found = []
-
-    for page_num, page in enumerate(text):
-        for column_num, column in enumerate(page):
-            for line_num, line in enumerate(column):
-                for word_num, word in enumerate(line):
-                    if search in word:
-                        found.append(
-                            (
-                                page_num + 1,
-                                column_num + 1,
-                                line_num + 1,
-                                word_num + 1,
-                                word.index(search) + 1,
-                                len(search),
-                            )
-                        )
+    if lookup is None:
+        words, offsets = text.occurrences(search)
+    else:
+        words, offsets = lookup.occurrences(search, text)
 
-    if not found:
+    if not len(words):
         return None
 
-    return secrets.choice(found)
+    found = secrets.randbelow(len(words))
+    return text.location(words[found], offsets[found], len(search))
 
 
-def find_word(
-    search: str, text: list[list[list[str]]]
-) -> list[tuple[int, int, int, int, int]]:
-    search_words = [search]
-    found = []
+def _segment(search: str, text: Corpus) -> list[str]:
+    """
+    Splits `search` into the fewest fragments which all occur in the corpus.
+    Among splits with equally few fragments the longest leading fragments win.
+    """
+    size = len(search)
 
-    while search_words:
-        search_word = search_words.pop(0)
-        res = None
+    # end of the longest fragment starting at i. A fragment of a fragment is
+    # found as well, so the end never moves left while i moves right
+    ends, end = [], 0
+    for i in range(size):
+        end = max(end, i)
+        while end < size and text.contains(search[i : end + 1]):
+            end += 1
+        if end == i:
+            raise ValueError(f"'{search[i]}' of '{search}' could not be found!")
+        ends.append(end)
 
-        for i in range(len(search_word)):
-            res = _find_word(search_word[:-i] if i > 0 else search_word, text)
-            if res:
-                if i > 0:
-                    search_words.append(search_word[-i:])
-                found.append(res)
-                break
+    # fewest fragments needed to cover search[i:] and where the first one ends
+    counts, splits = [0] * (size + 1), [size] * (size + 1)
+    for i in range(size - 1, -1, -1):
+        splits[i] = min(range(i + 1, ends[i] + 1), key=lambda j: (counts[j], -j))
+        counts[i] = counts[splits[i]] + 1
 
-        if not res:
-            raise ValueError(
-                f"'{search_word[: -i + 1]}' of '{search}' could not be found!"
-            )
+    fragments, i = [], 0
+    while i < size:
+        fragments.append(search[i : splits[i]])
+        i = splits[i]
 
-    return found
+    return fragments
+
+
+def find_word(
+    search: str, text: Corpus | list[list[list[str]]], lookup: _Lookup | None = None
+) -> list[tuple[int, int, int, int, int]]:
+    with span("text.search", len(search)):
+        text = _as_corpus(text)
+        return [_find_word(f, text, lookup) for f in _segment(search, text)]
 
 
 def gen_key_for_text(
-    search: str, text: list[list[list[str]]]
+    search: str, text: Corpus | list[list[list[str]]]
 ) -> Iterator[tuple[int, int, int, int, int]]:
+    text = _as_corpus(text)
     words = re.split(r"\s+", search)
     for word in words:
         yield find_word(word, text)
 
 
-def gen_key_for_pdf(search: str, file: str) -> Iterator[tuple[int, int, int, int, int]]:
-    text = get_text(file)
+def gen_key_for_pdf(
+    search: str, file: str, workers: int = 1
+) -> Iterator[tuple[int, int, int, int, int]]:
+    text = get_corpus(file, workers)
     words = re.split(r"\s+", search)
     for word in words:
         yield find_word(word, text)
+
+
+_worker_corpus: Corpus | None = None
+_worker_lookup = _Lookup()
+
+
+def _init_worker(corpus: Corpus):
+    global _worker_corpus, _worker_lookup
+    _worker_corpus, _worker_lookup = corpus, _Lookup()
+
+
+def _gen_key(
+    search: str, text: Corpus, lookup: _Lookup
+) -> tuple[list[list[tuple[int, int, int, int, int]]] | None, str | None]:
+    if not search.strip():
+        return None, "Can not generate a key for an empty secret"
+
+    try:
+        words = re.split(r"\s+", search.strip())
+        return [find_word(word, text, lookup) for word in words], None
+    except ValueError as e:
+        return None, str(e)
+
+
+def _gen_key_in_worker(search: str):
+    return _gen_key(search, _worker_corpus, _worker_lookup)
+
+
+def gen_key_for_text_many(
+    searches: Iterable[str], text: Corpus | list[list[list[str]]], workers: int = 1
+) -> Iterator[tuple[list[list[tuple[int, int, int, int, int]]] | None, str | None]]:
+    """
+    Generates the keys of many secrets against one corpus. Fragments are only
+    searched once and shared by all secrets of a process.
+
+    :param searches: Secrets to generate keys for, consumed lazily.
+    :param text: Corpus or text of get_text.
+    :param workers: Number of processes searching secrets, 0 uses all cpus.
+    :return: For every secret in order its key, a list with the fragments of
+        every word, or the error why it could not be generated.
+    """
+    text = _as_corpus(text)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        lookup = _Lookup()
+        for search in searches:
+            yield _gen_key(search, text, lookup)
+        return
+
+    # keep a bounded number of secrets in flight to stream large inputs
+    pending = deque()
+    with ProcessPoolExecutor(
+        workers, initializer=_init_worker, initargs=(text,)
+    ) as executor:
+        for search in searches:
+            pending.append(executor.submit(_gen_key_in_worker, search))
+            if len(pending) >= workers * 16:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+
+def gen_key_for_pdf_many(
+    searches: Iterable[str], file: str, workers: int = 1
+) -> Iterator[tuple[list[list[tuple[int, int, int, int, int]]] | None, str | None]]:
+    text = get_corpus(file, workers)
+    yield from gen_key_for_text_many(searches, text, workers)
@@ -1,32 +1,245 @@
+import functools
+import io
 import os
 import tempfile
+from typing import Iterable, Iterator
 
-from utils import run_binary
+import numpy as np
+from jpeg_dct import quantization_table, read_jpeg, write_jpeg
+from PIL import Image
+from profiling import span
+from utils import map_bounded, run_binary_bytes
 
+ENGINES = ("jsteg", "native")
 
-def embed_message(image_path, message, output_path):
-    # Create temp file with manual deletion control
-    with tempfile.NamedTemporaryFile("w", delete=False) as temp_file:
-        temp_file.write(str(message))
-        temp_filename = temp_file.name  # Get filename before closing
+# jsteg prefixes the payload with a magic and its length as little endian u32
+JSTEG_MAGIC = b"jsteg"
+JSTEG_HEADER_SIZE = len(JSTEG_MAGIC) + 4
+# jsteg decodes the carrier and encodes it again at this quality
+JSTEG_QUALITY = 75
+# MCUs the native engine decodes first when revealing
+NATIVE_REVEAL_MCUS = 256
 
+
+def _payload(message: str | bytes) -> bytes:
+    if isinstance(message, (bytes, bytearray, memoryview)):
+        return bytes(message)
+
+    return str(message).encode("utf-8")
+
+
+def _write_atomic(output_path, data: bytes):
+    # write to a temp file first so a failed write leaves no partial image
+    directory = os.path.dirname(os.path.abspath(output_path))
+    fd, temp_filename = tempfile.mkstemp(dir=directory, suffix=".tmp")
     try:
-        # File is now closed - safe for external process access
-        std, err = run_binary("jsteg", "hide", image_path, temp_filename, output_path)
-        if err:
-            raise ValueError(f"\n{std}\n{err}")
+        with os.fdopen(fd, "wb") as temp_file:
+            temp_file.write(data)
+        os.replace(temp_filename, output_path)
     finally:
         # Ensure cleanup even if errors occur
         if os.path.exists(temp_filename):
-            try:
-                os.unlink(temp_filename)
-            except Exception:
-                pass
+            os.unlink(temp_filename)
+
+
+def _read_coefficients(image_path):
+    with open(image_path, "rb") as f:
+        data = f.read()
+
+    with span("image.decode", len(data)):
+        try:
+            return read_jpeg(data)
+        except ValueError:
+            # progressive jpegs and other images are saved as baseline jpeg
+            # first, jpegs keep their quantization tables
+            img = Image.open(io.BytesIO(data))
+            buffer = io.BytesIO()
+            if img.format == "JPEG":
+                img.save(buffer, "JPEG", quality="keep")
+            else:
+                img.convert("RGB").save(buffer, "JPEG", quality=75)
+            return read_jpeg(buffer.getvalue())
+
+
+def _luma_ac(coefficients) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the AC coefficients of the first component, where jsteg hides its
+    data, and the mask of the ones with a magnitude above 1.
+    """
+    luma = coefficients.blocks[coefficients.block_components == 0][:, 1:]
+    return luma, np.abs(luma) > 1
+
+
+def _embed_native(image_path, payload: bytes, output_path):
+    coefficients = _read_coefficients(image_path)
+    luma, usable = _luma_ac(coefficients)
+
+    data = JSTEG_MAGIC + len(payload).to_bytes(4, "little") + payload
+    bits = np.unpackbits(np.frombuffer(data, np.uint8), bitorder="little")
+    values = luma[usable]
+    if len(bits) > len(values):
+        raise ValueError("image is too small to hold the requested payload")
+
+    # the lowest bit of the magnitude carries the data, so no coefficient
+    # drops to 1 or -1 and the usable coefficients stay the same on reveal
+    head = values[: len(bits)]
+    values[: len(bits)] = np.sign(head) * ((np.abs(head) & ~1) | bits)
+    luma[usable] = values
+    coefficients.blocks[coefficients.block_components == 0, 1:] = luma
+
+    with span("image.encode"):
+        _write_atomic(output_path, write_jpeg(coefficients))
+
+
+def _extract_native(stego_image_path) -> bytes:
+    with open(stego_image_path, "rb") as f:
+        data = f.read()
+
+    # the payload sits in the first blocks, so the scan is decoded in growing
+    # parts until the payload is complete
+    mcus = NATIVE_REVEAL_MCUS
+    while True:
+        with span("image.decode", len(data)):
+            coefficients = read_jpeg(data, mcus)
+
+        luma, usable = _luma_ac(coefficients)
+        bits = (luma[usable] & 1).astype(np.uint8)
+        payload = np.packbits(bits, bitorder="little").tobytes()
+        if not payload.startswith(JSTEG_MAGIC[: len(payload)]):
+            raise ValueError("No hidden message found")
+
+        size = int.from_bytes(payload[len(JSTEG_MAGIC) : JSTEG_HEADER_SIZE], "little")
+        end = JSTEG_HEADER_SIZE + size
+        if len(payload) >= JSTEG_HEADER_SIZE and end <= len(payload):
+            return payload[JSTEG_HEADER_SIZE:end]
+        if len(coefficients.blocks) < mcus * coefficients.blocks_per_mcu:
+            # the whole scan is decoded
+            break
+        mcus *= 4
+
+    if len(payload) < JSTEG_HEADER_SIZE:
+        raise ValueError("No hidden message found")
+    raise ValueError("Hidden message is truncated")
+
+
+def embed_message(image_path, message, output_path, engine: str = "jsteg"):
+    """
+    Hides a message in a jpeg. The native engine embeds into the coefficients
+    of the image in process, the jsteg engine runs the jsteg binary which
+    re-encodes the image. Both write the same format.
+
+    :param image_path: Carrier image.
+    :param message: Text or bytes to hide.
+    :param output_path: Path of the stego image.
+    :param engine: "jsteg" or "native".
+    """
+    payload = _payload(message)
+    with span(f"image.hide.{engine}", len(payload)):
+        if engine == "native":
+            _embed_native(image_path, payload, output_path)
+            return
+
+        # jsteg reads the payload from stdin and writes the image to stdout
+        # when both files are left out, so nothing touches the disk before the
+        # output
+        std, err = run_binary_bytes("jsteg", "hide", str(image_path), stdin=payload)
+        if err:
+            raise ValueError(f"\n{err.decode()}")
+
+        _write_atomic(output_path, std)
+
+
+def extract_payload(stego_image_path, engine: str = "jsteg") -> bytes:
+    """Reveals the hidden bytes of a jpeg written by either engine."""
+    with span(f"image.reveal.{engine}") as revealing:
+        if engine == "native":
+            payload = _extract_native(stego_image_path)
+        else:
+            payload, err = run_binary_bytes("jsteg", "reveal", str(stego_image_path))
+            if err:
+                raise ValueError(
+                    f"\n{payload.decode(errors='replace')}\n{err.decode()}"
+                )
+
+        revealing.add_bytes(len(payload))
+        return payload
+
+
+def extract_message(stego_image_path, engine: str = "jsteg"):
+    return extract_payload(stego_image_path, engine).decode()
+
+
+@functools.cache
+def _jsteg_quantization() -> np.ndarray:
+    """Luma quantization table of the images jsteg writes."""
+    buffer = io.BytesIO()
+    Image.new("L", (8, 8)).save(buffer, "JPEG", quality=JSTEG_QUALITY)
+    return quantization_table(read_jpeg(buffer.getvalue()), 0)
+
+
+def capacity(image_path, engine: str = "jsteg") -> int:
+    """
+    Returns how many bytes can be hidden in an image without embedding, from
+    one decode of its coefficients. The native engine keeps the coefficients
+    of jpegs so its count is exact. jsteg re-encodes the image at quality 75,
+    its count requantizes the coefficients to that table, which matches the
+    re-encode up to the rounding of pixels.
+
+    :param image_path: Carrier image.
+    :param engine: "jsteg" or "native".
+    """
+    coefficients = _read_coefficients(image_path)
+    luma = coefficients.blocks[coefficients.block_components == 0][:, 1:]
+    threshold = np.full(63, 2)
+    if engine != "native":
+        # |round(c * q / q75)| > 1 holds from |c| >= 1.5 * q75 / q on
+        scale = _jsteg_quantization()[1:] / quantization_table(coefficients, 0)[1:]
+        threshold = 1.5 * scale
+
+    usable = int(np.count_nonzero(np.abs(luma) >= threshold))
+    return max(usable // 8 - JSTEG_HEADER_SIZE, 0)
+
+
+def _embed(item: tuple[str, str, str, str]) -> str | None:
+    try:
+        embed_message(*item)
+    except (OSError, ValueError) as e:
+        return str(e).strip()
+
+
+def _extract(item: tuple[str, str]) -> tuple[str | None, str | None]:
+    try:
+        return extract_message(*item), None
+    except (OSError, ValueError) as e:
+        return None, str(e).strip()
+
+
+def embed_messages(
+    items: Iterable[tuple[str, str, str]], workers: int = 1, engine: str = "jsteg"
+) -> Iterator[str | None]:
+    """
+    Hides many messages, every item is (image path, message, output path).
+    The jsteg processes or native embeddings run in a pool of threads.
+
+    :param items: Messages to hide, consumed lazily.
+    :param workers: Number of concurrent jsteg processes, 0 uses all cpus.
+    :param engine: "jsteg" or "native".
+    :return: For every item in order None or the error why it failed.
+    """
+    items = ((*item, engine) for item in items)
+    return map_bounded(_embed, items, workers or os.cpu_count() or 1)
 
 
-def extract_message(stego_image_path):
-    std, err = run_binary("jsteg", "reveal", stego_image_path)
-    if err:
-        raise ValueError(f"\n{std}\n{err}")
+def extract_messages(
+    paths: Iterable[str], workers: int = 1, engine: str = "jsteg"
+) -> Iterator[tuple[str | None, str | None]]:
+    """
+    Reveals the messages of many images in a pool of jsteg processes.
 
-    return std
+    :param paths: Images to reveal messages from, consumed lazily.
+    :param workers: Number of concurrent jsteg processes, 0 uses all cpus.
+    :param engine: "jsteg" or "native".
+    :return: For every image in order its message or the error.
+    """
+    items = ((path, engine) for path in paths)
+    return map_bounded(_extract, items, workers or os.cpu_count() or 1)
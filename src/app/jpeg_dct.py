@@ -0,0 +1,587 @@
+import re
+import sys
+
+import numpy as np
+from numba import njit
+
+SOI = b"\xff\xd8"
+EOI = b"\xff\xd9"
+
+# markers of frames which are not baseline or extended sequential huffman coded
+_UNSUPPORTED_FRAMES = {0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE}
+_SCAN_END = re.compile(rb"\xff[^\x00\xd0-\xd7]")
+_RESTART = re.compile(rb"\xff[\xd0-\xd7]")
+# numba caches next to the source files, which the frozen executable lacks
+_NUMBA_CACHE = not getattr(sys, "frozen", False)
+
+
+class JpegCoefficients:
+    """
+    Quantized DCT coefficients of a sequential huffman coded JPEG with a
+    single interleaved scan, the layout written by most encoders and jsteg.
+
+    `blocks` holds one row of 64 coefficients in zigzag order per block, the
+    rows in the order they are stored in the scan, and `block_components` the
+    index of the component of every row. All other segments besides the
+    huffman tables are kept verbatim, so writing the coefficients back only
+    changes the entropy coded data and the (re-optimized) huffman tables.
+    """
+
+    def __init__(
+        self,
+        segments: list[tuple[int, bytes]],
+        components: list[tuple[int, int, int]],
+        blocks: np.ndarray,
+        block_components: np.ndarray,
+        blocks_per_mcu: int,
+        restart_interval: int,
+    ):
+        self.segments = segments
+        self.components = components
+        self.blocks = blocks
+        self.block_components = block_components
+        self.blocks_per_mcu = blocks_per_mcu
+        self.restart_interval = restart_interval
+
+
+def quantization_table(coefficients: JpegCoefficients, component: int) -> np.ndarray:
+    """
+    Returns the quantization table of a component of the scan, 64 values in
+    zigzag order like the coefficients.
+    """
+    component_id = coefficients.components[component][0]
+    tables, selector = {}, None
+    for marker, payload in coefficients.segments:
+        if marker == 0xDB:
+            offset = 0
+            while offset < len(payload):
+                precision, table = payload[offset] >> 4, payload[offset] & 15
+                size = 128 if precision else 64
+                values = payload[offset + 1 : offset + 1 + size]
+                tables[table] = np.frombuffer(values, ">u2" if precision else "u1")
+                offset += 1 + size
+        elif marker in (0xC0, 0xC1):
+            for i in range(payload[5]):
+                if payload[6 + 3 * i] == component_id:
+                    selector = payload[8 + 3 * i]
+
+    if selector not in tables:
+        raise ValueError("JPEG component references a missing quantization table")
+    return tables[selector].astype(np.int64)
+
+
+def _huffman_codes(bits: list[int], values: bytes) -> list[tuple[int, int, int]]:
+    """Returns the canonical (code, length, symbol) of a huffman table."""
+    codes, code, index = [], 0, 0
+    for length in range(1, 17):
+        for _ in range(bits[length - 1]):
+            codes.append((code, length, values[index]))
+            code += 1
+            index += 1
+        code <<= 1
+
+    return codes
+
+
+def _lookup_table(
+    bits: list[int], values: bytes, lengths: np.ndarray, symbols: np.ndarray
+):
+    # every 16 bit prefix maps to the length and symbol of its code
+    for code, length, symbol in _huffman_codes(bits, values):
+        start = code << (16 - length)
+        stop = (code + 1) << (16 - length)
+        lengths[start:stop] = length
+        symbols[start:stop] = symbol
+
+
+@njit(cache=_NUMBA_CACHE)
+def _decode_interval(
+    data: np.ndarray,
+    mcu: np.ndarray,
+    mcus: int,
+    lengths: np.ndarray,
+    symbols: np.ndarray,
+    blocks: np.ndarray,
+    first: int,
+) -> int:
+    """
+    Decodes `mcus` MCUs of one restart interval into `blocks`. `mcu` holds
+    the component, DC table and AC table of every block of a MCU, tables
+    index `lengths` and `symbols`.
+
+    :return: The index of the next block, -1 for an invalid huffman code and
+        -2 for an invalid run length.
+    """
+    acc, nbits, pos, size = 0, 0, 0, len(data)
+    predictions = np.zeros(4, dtype=np.int64)
+    index = first
+
+    for _ in range(mcus):
+        for block in range(len(mcu)):
+            component, table, k = mcu[block, 0], mcu[block, 1], 0
+            while k < 64:
+                # a symbol and its extra bits never need more than 27 bits
+                while nbits < 32:
+                    byte = data[pos] if pos < size else 0
+                    acc = ((acc & ((1 << nbits) - 1)) << 8) | byte
+                    pos += 1
+                    nbits += 8
+
+                peek = (acc >> (nbits - 16)) & 0xFFFF
+                length = lengths[table, peek]
+                if length == 0:
+                    return -1
+                symbol = np.int64(symbols[table, peek])
+                nbits -= length
+
+                run, s = symbol >> 4, symbol & 15
+                if k == 0:
+                    value = 0
+                    if symbol:
+                        value = (acc >> (nbits - symbol)) & ((1 << symbol) - 1)
+                        nbits -= symbol
+                        if value < 1 << (symbol - 1):
+                            value -= (1 << symbol) - 1
+                    value += predictions[component]
+                    predictions[component] = value
+                    blocks[index, 0] = value
+                    table, k = mcu[block, 2], 1
+                elif s == 0:
+                    if run != 15:
+                        break
+                    k += 16
+                else:
+                    k += run
+                    if k > 63:
+                        return -2
+                    value = (acc >> (nbits - s)) & ((1 << s) - 1)
+                    nbits -= s
+                    if value < 1 << (s - 1):
+                        value -= (1 << s) - 1
+                    blocks[index, k] = value
+                    k += 1
+            index += 1
+
+    return index
+
+
+def read_jpeg(data: bytes, max_mcus: int | None = None) -> JpegCoefficients:
+    """
+    Reads the quantized DCT coefficients of a JPEG without decoding pixels.
+
+    :param data: The JPEG file.
+    :param max_mcus: Stop decoding after this many MCUs, the coefficients of
+        a partially decoded scan can not be written back.
+    :return: The coefficients and everything needed to write them back.
+    """
+    if not data.startswith(SOI):
+        raise ValueError("Not a JPEG file")
+
+    segments, tables, frame, restart_interval = [], {}, None, 0
+    pos = len(SOI)
+    while True:
+        if pos >= len(data) or data[pos] != 0xFF:
+            raise ValueError("Invalid JPEG marker")
+        while pos < len(data) and data[pos] == 0xFF:
+            pos += 1
+        if pos >= len(data) or data[pos] == EOI[1]:
+            raise ValueError("JPEG file has no scan")
+
+        marker = data[pos]
+        length = int.from_bytes(data[pos + 1 : pos + 3], "big")
+        payload = data[pos + 3 : pos + 1 + length]
+        pos += 1 + length
+
+        if marker == 0xC4:
+            offset = 0
+            while offset < len(payload):
+                bits = list(payload[offset + 1 : offset + 17])
+                values = payload[offset + 17 : offset + 17 + sum(bits)]
+                tables[payload[offset] >> 4, payload[offset] & 15] = bits, values
+                offset += 17 + sum(bits)
+        elif marker in (0xC0, 0xC1):
+            frame = payload
+            segments.append((marker, payload))
+        elif marker in _UNSUPPORTED_FRAMES:
+            raise ValueError("Only sequential huffman coded JPEGs are supported")
+        elif marker == 0xDD:
+            restart_interval = int.from_bytes(payload[:2], "big")
+            segments.append((marker, payload))
+        elif marker == 0xDA:
+            break
+        else:
+            segments.append((marker, payload))
+
+    if frame is None or frame[0] != 8:
+        raise ValueError("Only 8 bit JPEGs with a frame header are supported")
+
+    height = int.from_bytes(frame[1:3], "big")
+    width = int.from_bytes(frame[3:5], "big")
+    frame_components = [
+        (frame[6 + 3 * i], frame[7 + 3 * i] >> 4, frame[7 + 3 * i] & 15)
+        for i in range(frame[5])
+    ]
+    ids = [component_id for component_id, _, _ in frame_components]
+
+    count = payload[0]
+    scan = [(payload[1 + 2 * i], payload[2 + 2 * i]) for i in range(count)]
+    if (
+        count != len(frame_components)
+        or payload[1 + 2 * count :][:3] != b"\x00\x3f\x00"
+    ):
+        raise ValueError("Only JPEGs with a single sequential scan are supported")
+
+    components = []
+    for component_id, selectors in scan:
+        if component_id not in ids:
+            raise ValueError("JPEG scan references an unknown component")
+        components.append((component_id, selectors >> 4, selectors & 15))
+
+    if height == 0:
+        raise ValueError("JPEGs with a DNL marker are not supported")
+
+    h_max = max(h for _, h, _ in frame_components)
+    v_max = max(v for _, _, v in frame_components)
+    if count == 1:
+        # a single component is not interleaved, MCUs are single blocks
+        h, v = frame_components[0][1:]
+        columns = -(-width * h // h_max)
+        rows = -(-height * v // v_max)
+        mcus = -(-columns // 8) * -(-rows // 8)
+        layout = [0]
+    else:
+        mcus = -(-width // (8 * h_max)) * -(-height // (8 * v_max))
+        sampling = {c: (h, v) for c, h, v in frame_components}
+        layout = [
+            i
+            for i, (component_id, _, _) in enumerate(components)
+            for _ in range(sampling[component_id][0] * sampling[component_id][1])
+        ]
+
+    # DC tables are 0 to 3 and AC tables 4 to 7 like in write_jpeg
+    lengths = np.zeros((8, 1 << 16), dtype=np.uint8)
+    symbols = np.zeros((8, 1 << 16), dtype=np.uint8)
+    for (table_class, table), (bits, values) in tables.items():
+        if table < 4:
+            index = 4 * table_class + table
+            _lookup_table(bits, values, lengths[index], symbols[index])
+
+    mcu = np.zeros((len(layout), 3), dtype=np.int64)
+    for i, component in enumerate(layout):
+        _, dc_table, ac_table = components[component]
+        if (0, dc_table) not in tables or (1, ac_table) not in tables:
+            raise ValueError("JPEG scan references a missing huffman table")
+        mcu[i] = component, dc_table, 4 + ac_table
+
+    end = _SCAN_END.search(data, pos)
+    entropy = data[pos : end.start() if end else len(data)]
+    intervals = _RESTART.split(entropy) if restart_interval else [entropy]
+
+    if max_mcus is not None:
+        mcus = min(mcus, max_mcus)
+    blocks = np.zeros((mcus * len(layout), 64), dtype=np.int32)
+    index, remaining = 0, mcus
+    for interval in intervals:
+        if remaining <= 0:
+            break
+        size = min(remaining, restart_interval or remaining)
+        interval = np.frombuffer(interval.replace(b"\xff\x00", b"\xff"), np.uint8)
+        index = _decode_interval(interval, mcu, size, lengths, symbols, blocks, index)
+        if index == -1:
+            raise ValueError("Invalid huffman code in JPEG scan")
+        if index == -2:
+            raise ValueError("Invalid run length in JPEG scan")
+        remaining -= size
+
+    if remaining > 0:
+        raise ValueError("JPEG scan is truncated")
+
+    return JpegCoefficients(
+        segments,
+        components,
+        blocks,
+        np.tile(np.array(layout, dtype=np.uint8), mcus),
+        len(layout),
+        restart_interval,
+    )
+
+
+def _code_lengths(frequencies: np.ndarray) -> list[int]:
+    """
+    Huffman code lengths limited to 16 bits as in Annex K.2 of the JPEG
+    standard. A reserved symbol keeps any code from being all ones.
+    """
+    frequencies = [int(f) for f in frequencies] + [1]
+    sizes, others = [0] * 257, [-1] * 257
+
+    while True:
+        # the least frequent symbols, the higher symbol wins ties like libjpeg
+        first = second = -1
+        for symbol, frequency in enumerate(frequencies):
+            if frequency and (first < 0 or frequency <= frequencies[first]):
+                first = symbol
+        for symbol, frequency in enumerate(frequencies):
+            if (
+                frequency
+                and symbol != first
+                and (second < 0 or frequency <= frequencies[second])
+            ):
+                second = symbol
+        if second < 0:
+            break
+
+        frequencies[first] += frequencies[second]
+        frequencies[second] = 0
+        for symbol in (first, second):
+            sizes[symbol] += 1
+            while others[symbol] >= 0:
+                symbol = others[symbol]
+                sizes[symbol] += 1
+        while others[first] >= 0:
+            first = others[first]
+        others[first] = second
+
+    return sizes
+
+
+def _huffman_table(frequencies: np.ndarray) -> tuple[list[int], bytes]:
+    """Returns the bits and values of an optimal table for the frequencies."""
+    sizes = _code_lengths(frequencies)
+    bits = [0] * 33
+    for size in sizes:
+        if size:
+            bits[size] += 1
+
+    for length in range(32, 16, -1):
+        while bits[length] > 0:
+            shorter = length - 2
+            while bits[shorter] == 0:
+                shorter -= 1
+            bits[length] -= 2
+            bits[length - 1] += 1
+            bits[shorter + 1] += 2
+            bits[shorter] -= 1
+
+    # drop the reserved symbol, it has one of the longest codes
+    longest = 16
+    while bits[longest] == 0:
+        longest -= 1
+    bits[longest] -= 1
+
+    values = sorted(
+        (symbol for symbol in range(256) if sizes[symbol]),
+        key=lambda symbol: (sizes[symbol], symbol),
+    )
+    return bits[1:17], bytes(values)
+
+
+@njit(cache=_NUMBA_CACHE)
+def _category(value: int) -> tuple[int, int]:
+    """Returns the size category and the extra bits of a coefficient value."""
+    magnitude, size = abs(value), 0
+    while magnitude:
+        size += 1
+        magnitude >>= 1
+    return size, value + (1 << size) - 1 if value < 0 else value
+
+
+@njit(cache=_NUMBA_CACHE)
+def _count_symbols(
+    blocks: np.ndarray,
+    block_tables: np.ndarray,
+    blocks_per_mcu: int,
+    restart_interval: int,
+    frequencies: np.ndarray,
+) -> int:
+    """
+    Counts the huffman symbols of the scan per table into `frequencies`.
+    `block_tables` holds the component, DC table and AC table of every block.
+
+    :return: The number of extra bits following the symbols.
+    """
+    predictions = np.zeros(4, dtype=np.int64)
+    interval, extra = 0, 0
+    for index in range(len(blocks)):
+        # the DC prediction restarts with every restart interval
+        if restart_interval:
+            current = index // blocks_per_mcu // restart_interval
+            if current != interval:
+                interval = current
+                predictions[:] = 0
+
+        component = block_tables[index, 0]
+        value = np.int64(blocks[index, 0])
+        size, _ = _category(value - predictions[component])
+        predictions[component] = value
+        frequencies[block_tables[index, 1], size] += 1
+        extra += size
+
+        table, run = block_tables[index, 2], 0
+        for k in range(1, 64):
+            value = blocks[index, k]
+            if value == 0:
+                run += 1
+                continue
+            # runs longer than 15 zeros need ZRL symbols in between
+            while run > 15:
+                frequencies[table, 0xF0] += 1
+                run -= 16
+            size, _ = _category(value)
+            frequencies[table, run << 4 | size] += 1
+            extra += size
+            run = 0
+        if run:
+            frequencies[table, 0] += 1
+
+    return extra
+
+
+@njit(cache=_NUMBA_CACHE)
+def _put_bits(
+    output: np.ndarray, pos: int, acc: int, nbits: int, value: int, size: int
+) -> tuple[int, int, int]:
+    """Appends `size` bits of `value`, complete bytes are written stuffed."""
+    acc = (acc << size) | value
+    nbits += size
+    while nbits >= 8:
+        nbits -= 8
+        byte = (acc >> nbits) & 0xFF
+        output[pos] = byte
+        pos += 1
+        if byte == 0xFF:
+            output[pos] = 0
+            pos += 1
+    return pos, acc & ((1 << nbits) - 1), nbits
+
+
+@njit(cache=_NUMBA_CACHE)
+def _encode_scan(
+    blocks: np.ndarray,
+    block_tables: np.ndarray,
+    blocks_per_mcu: int,
+    restart_interval: int,
+    codes: np.ndarray,
+    lengths: np.ndarray,
+    output: np.ndarray,
+) -> int:
+    """
+    Writes the entropy coded data of the scan with its restart markers into
+    `output` and returns its size, see `_count_symbols`.
+    """
+    predictions = np.zeros(4, dtype=np.int64)
+    interval, pos, acc, nbits = 0, 0, 0, 0
+    for index in range(len(blocks)):
+        if restart_interval:
+            current = index // blocks_per_mcu // restart_interval
+            if current != interval:
+                # intervals are padded with one bits to whole bytes
+                if nbits:
+                    pad = 8 - nbits
+                    pos, acc, nbits = _put_bits(
+                        output, pos, acc, nbits, (1 << pad) - 1, pad
+                    )
+                output[pos] = 0xFF
+                output[pos + 1] = 0xD0 + interval % 8
+                pos += 2
+                interval = current
+                predictions[:] = 0
+
+        component = block_tables[index, 0]
+        value = np.int64(blocks[index, 0])
+        size, extra = _category(value - predictions[component])
+        predictions[component] = value
+        table = block_tables[index, 1]
+        pos, acc, nbits = _put_bits(
+            output, pos, acc, nbits, codes[table, size], lengths[table, size]
+        )
+        pos, acc, nbits = _put_bits(output, pos, acc, nbits, extra, size)
+
+        table, run = block_tables[index, 2], 0
+        for k in range(1, 64):
+            value = blocks[index, k]
+            if value == 0:
+                run += 1
+                continue
+            while run > 15:
+                pos, acc, nbits = _put_bits(
+                    output, pos, acc, nbits, codes[table, 0xF0], lengths[table, 0xF0]
+                )
+                run -= 16
+            size, extra = _category(value)
+            symbol = run << 4 | size
+            pos, acc, nbits = _put_bits(
+                output, pos, acc, nbits, codes[table, symbol], lengths[table, symbol]
+            )
+            pos, acc, nbits = _put_bits(output, pos, acc, nbits, extra, size)
+            run = 0
+        if run:
+            pos, acc, nbits = _put_bits(
+                output, pos, acc, nbits, codes[table, 0], lengths[table, 0]
+            )
+
+    if nbits:
+        pad = 8 - nbits
+        pos, acc, nbits = _put_bits(output, pos, acc, nbits, (1 << pad) - 1, pad)
+
+    return pos
+
+
+def write_jpeg(coefficients: JpegCoefficients) -> bytes:
+    """
+    Writes coefficients read by `read_jpeg` back into a JPEG file with
+    huffman tables optimized for them.
+    """
+    # DC tables are 0 to 3 and AC tables 4 to 7
+    component_tables = np.array(
+        [(i, dc, 4 + ac) for i, (_, dc, ac) in enumerate(coefficients.components)],
+        dtype=np.int64,
+    )
+    block_tables = component_tables[coefficients.block_components]
+    blocks_per_mcu = coefficients.blocks_per_mcu
+    restart_interval = coefficients.restart_interval
+
+    # one optimal table per DC and AC table id used by the scan
+    frequencies = np.zeros((8, 256), dtype=np.int64)
+    extra = _count_symbols(
+        coefficients.blocks, block_tables, blocks_per_mcu, restart_interval, frequencies
+    )
+    codes = np.zeros((8, 256), dtype=np.int64)
+    lengths = np.zeros((8, 256), dtype=np.int64)
+    huffman = bytearray()
+    for table in np.unique(component_tables[:, 1:]):
+        bits, values = _huffman_table(frequencies[table])
+        for code, length, symbol in _huffman_codes(bits, values):
+            codes[table, symbol] = code
+            lengths[table, symbol] = length
+        huffman += bytes([(table >= 4) << 4 | table % 4, *bits]) + values
+
+    # every byte may be stuffed, every interval adds padding and a marker
+    size = (int((frequencies * lengths).sum()) + extra) // 8
+    intervals = 1
+    if restart_interval:
+        intervals += len(coefficients.blocks) // blocks_per_mcu // restart_interval
+    scan = np.empty(2 * (size + intervals) + 2 * intervals, dtype=np.uint8)
+    size = _encode_scan(
+        coefficients.blocks,
+        block_tables,
+        blocks_per_mcu,
+        restart_interval,
+        codes,
+        lengths,
+        scan,
+    )
+
+    output = bytearray(SOI)
+    for marker, payload in coefficients.segments:
+        output += bytes([0xFF, marker]) + (len(payload) + 2).to_bytes(2, "big")
+        output += payload
+    output += b"\xff\xc4" + (len(huffman) + 2).to_bytes(2, "big") + huffman
+
+    header = bytes([len(coefficients.components)])
+    for component_id, dc_table, ac_table in coefficients.components:
+        header += bytes([component_id, dc_table << 4 | ac_table])
+    header += b"\x00\x3f\x00"
+    output += b"\xff\xda" + (len(header) + 2).to_bytes(2, "big") + header
+    output += scan[:size].tobytes() + EOI
+
+    return bytes(output)
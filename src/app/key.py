@@ -1,12 +1,437 @@
+import atexit
 import hashlib
+import hmac
+import os
 import random
+import secrets
+import subprocess
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
+from pathlib import Path
 from typing import Iterable
 
+import numpy as np
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 from PIL import Image
+from profiling import span, timed
 from pydub import AudioSegment
+from pydub.utils import mediainfo_json
+
+# pydub decodes mp3 files to 16 bit pcm, keys are derived from those bytes
+MP3_SAMPLE_WIDTH = 2
+PCM_CHUNK_SIZE = 1 << 20
+ITERATIONS = 100_000
+
+
+class KeyCache:
+    """
+    In memory LRU cache of derived keys, it never writes to disk.
+
+    Entries are keyed by a HMAC with a per process secret over the sampled
+    material, the salt, the iteration count and the key length, so the cache
+    holds no material. Keys are kept in bytearrays which are overwritten when
+    they are evicted or the cache is cleared. Copies handed out as hex strings
+    can not be wiped.
+    """
+
+    def __init__(self, max_entries: int = 128):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._secret = secrets.token_bytes(32)
+        self._entries: OrderedDict[bytes, bytearray] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _digest(self, material: bytes, salt: bytes, iterations: int, length: int):
+        digest = hmac.new(self._secret, digestmod=hashlib.sha256)
+        for part in (material, salt):
+            digest.update(len(part).to_bytes(8, "big"))
+            digest.update(part)
+        digest.update(iterations.to_bytes(8, "big") + length.to_bytes(8, "big"))
+        return digest.digest()
+
+    def derive(
+        self, material: bytes, salt: bytes, iterations: int, length: int
+    ) -> bytes:
+        digest = self._digest(material, salt, iterations, length)
+        with self._lock:
+            if digest in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(digest)
+                return bytes(self._entries[digest])
+
+        key = _pbkdf2(material, salt, iterations, length)
+        with self._lock:
+            self.misses += 1
+            self._entries[digest] = bytearray(key)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                evicted[:] = bytes(len(evicted))
+
+        return key
+
+    def clear(self):
+        """Overwrites and drops all cached keys."""
+        with self._lock:
+            for key in self._entries.values():
+                key[:] = bytes(len(key))
+            self._entries.clear()
+
+
+_key_cache: KeyCache | None = None
+
+
+def enable_key_cache(max_entries: int = 128) -> KeyCache:
+    """
+    Caches derived keys of this process in memory, the cache is cleared when
+    the process exits.
+    """
+    global _key_cache
+    disable_key_cache()
+    _key_cache = KeyCache(max_entries)
+    return _key_cache
+
+
+def disable_key_cache():
+    global _key_cache
+    if _key_cache:
+        _key_cache.clear()
+    _key_cache = None
+
+
+atexit.register(disable_key_cache)
+
+
+def _pbkdf2(material: bytes, salt: bytes, iterations: int, length: int) -> bytes:
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=length,
+        salt=salt,
+        iterations=iterations,
+        backend=default_backend(),
+    )
+    return kdf.derive(material)
+
+
+def _derive_key(material: bytes, salt: bytes, length: int) -> bytes:
+    """Derive a key using PBKDF2-HMAC-SHA256, through the key cache if enabled."""
+    material = bytes(material)
+    with span("key.pbkdf2", len(material)):
+        if _key_cache is None:
+            return _pbkdf2(material, salt, ITERATIONS, length)
+
+        return _key_cache.derive(material, salt, ITERATIONS, length)
+
+
+@timed("key.sample.gif")
+def _sample_gif_pixels(
+    gif: Image.Image,
+    rng: random.Random,
+    num_pixels: int,
+    frames: dict[int, np.ndarray] | None = None,
+) -> bytes:
+    """
+    Draws `num_pixels` random (frame, x, y) coordinates from `rng` and returns
+    the RGB values of those pixels in draw order.
+
+    The coordinates are drawn exactly like a per pixel seek would draw them,
+    but each needed frame is decoded only once, in ascending frame order, and
+    all of its pixels are gathered in one vectorized lookup.
+
+    :param gif: Opened animated GIF.
+    :param rng: Seeded random generator of the key.
+    :param num_pixels: Number of pixels to sample.
+    :param frames: Optional cache of converted frames shared between calls.
+    :return: Concatenated RGB bytes of the sampled pixels.
+    """
+    frame_count = gif.n_frames
+    width, height = gif.size
+
+    coordinates = np.empty((num_pixels, 3), dtype=np.int64)
+    for i in range(num_pixels):
+        frame_index = rng.randint(0, frame_count - 1)
+        x = rng.randint(0, width - 1)
+        y = rng.randint(0, height - 1)
+        coordinates[i] = frame_index, x, y
+
+    indices, xs, ys = coordinates.T
+    pixels = np.empty((num_pixels, 3), dtype=np.uint8)
+
+    # group the samples by frame so every frame is seeked and converted once
+    order = np.argsort(indices, kind="stable")
+    boundaries = np.flatnonzero(np.diff(indices[order])) + 1
+    for samples in np.split(order, boundaries):
+        if len(samples) == 0:
+            continue
+
+        index = int(indices[samples[0]])
+        frame = frames.get(index) if frames is not None else None
+        if frame is None:
+            gif.seek(index)
+            frame = np.asarray(gif.convert("RGB"))
+            if frames is not None:
+                frames[index] = frame
+
+        pixels[samples] = frame[ys[samples], xs[samples]]
+
+    return pixels.tobytes()
+
+
+def _load_jpeg_rows(img: Image.Image, rows: int):
+    """
+    Loads only the leading MCU rows of a JPEG which cover the first `rows`
+    pixel rows. A sequential JPEG can not skip the rows in front of a sample,
+    but everything below the last sampled MCU row is never decoded.
+
+    :param img: Opened, not yet loaded JPEG image.
+    :param rows: Number of pixel rows needed from the top of the image.
+    """
+    width, height = img.size
+    if img.format != "JPEG" or len(img.tile) != 1:
+        img.load()
+        return
+
+    mcu_height = 8 * max(v for _, _, v, _ in img.layer)
+    rows = min(height, -(-rows // mcu_height) * mcu_height)
+    if rows >= height:
+        img.load()
+        return
+
+    name, _, offset, args = img.tile[0]
+    img.tile = [(name, (0, 0, width, rows), offset, args)]
+    img._size = (width, rows)
+    try:
+        img.load()
+    except OSError:
+        # libjpeg reports the scanlines we deliberately left unread
+        pass
+
+
+def _draw_pixel_coordinates(
+    rng: random.Random, width: int, height: int, num_pixels: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Draws `num_pixels` random (x, y) coordinates from `rng`."""
+    coordinates = np.empty((num_pixels, 2), dtype=np.int64)
+    for i in range(num_pixels):
+        x = rng.randint(0, width - 1)
+        y = rng.randint(0, height - 1)
+        coordinates[i] = x, y
+
+    return coordinates[:, 0], coordinates[:, 1]
+
+
+def _gather_rgb_pixels(
+    mode: str, pixels: np.ndarray, xs: np.ndarray, ys: np.ndarray
+) -> bytes:
+    """Returns the RGB values of the given pixels of an image array."""
+    samples = pixels[ys, xs]
+    if mode != "RGB" and len(samples):
+        # convert only the sampled pixels instead of a full image copy
+        samples = Image.frombytes(mode, (len(samples), 1), samples.tobytes())
+        samples = np.asarray(samples.convert("RGB"))
+
+    return samples.tobytes()
+
+
+@timed("key.sample.jpeg")
+def _sample_jpeg_pixels(
+    img: Image.Image, rng: random.Random, num_pixels: int, partial_decode: bool
+) -> bytes:
+    """
+    Draws `num_pixels` random (x, y) coordinates from `rng` and returns the RGB
+    values of those pixels in draw order.
+
+    :param img: Opened image.
+    :param rng: Seeded random generator of the key.
+    :param num_pixels: Number of pixels to sample.
+    :param partial_decode: Only decode the MCU rows up to the lowest sample.
+    :return: Concatenated RGB bytes of the sampled pixels.
+    """
+    xs, ys = _draw_pixel_coordinates(rng, *img.size, num_pixels)
+    if num_pixels == 0:
+        return b""
+
+    if partial_decode:
+        _load_jpeg_rows(img, int(ys.max()) + 1)
+
+    if img.mode in ("P", "PA"):
+        # palette indices are meaningless without the palette of the image
+        img = img.convert("RGB")
+
+    return _gather_rgb_pixels(img.mode, np.asarray(img), xs, ys)
+
+
+def _mp3_gapless_info(mp3_path) -> tuple[int, int]:
+    """
+    Reads the encoder delay and padding (in samples) from the LAME/Info tag in
+    the first frame of a mp3. ffmpeg trims both from the decoded audio.
+
+    :param mp3_path: Path to the MP3 file.
+    :return: Tuple of delay and padding, (0, 0) if the file has no such tag.
+    """
+    with open(mp3_path, "rb") as f:
+        offset = 0
+        head = f.read(10)
+        if head[:3] == b"ID3":
+            size = sum((b & 0x7F) << (7 * (3 - i)) for i, b in enumerate(head[6:10]))
+            offset = 10 + size + (10 if head[5] & 0x10 else 0)
+
+        f.seek(offset)
+        frame = f.read(512)
+
+    if len(frame) < 4 or frame[0] != 0xFF or frame[1] & 0xE0 != 0xE0:
+        return 0, 0
+
+    mpeg1 = (frame[1] >> 3) & 3 == 3
+    mono = frame[3] >> 6 == 3
+    xing = 4 + ((17 if mono else 32) if mpeg1 else (9 if mono else 17))
+    if frame[xing : xing + 4] not in (b"Xing", b"Info"):
+        return 0, 0
+
+    flags = int.from_bytes(frame[xing + 4 : xing + 8], "big")
+    # optional frame count, byte count, toc and quality fields
+    fields = ((1, 4), (2, 4), (4, 100), (8, 4))
+    lame = xing + 8 + sum(size for bit, size in fields if flags & bit)
+    if frame[lame : lame + 4] not in (b"LAME", b"Lavf", b"Lavc"):
+        return 0, 0
+
+    delay_padding = int.from_bytes(frame[lame + 21 : lame + 24], "big")
+    return delay_padding >> 12, delay_padding & 0xFFF
+
+
+def _estimate_mp3_pcm_length(mp3_path) -> int | None:
+    """
+    Estimates the number of decoded pcm bytes of a mp3 from its headers
+    without decoding it. Returns None if ffprobe does not report a duration.
+    """
+    try:
+        info = mediainfo_json(str(mp3_path))
+        stream = next(s for s in info["streams"] if s["codec_type"] == "audio")
+        samples = round(
+            int(stream["duration_ts"])
+            * Fraction(stream["time_base"])
+            * int(stream["sample_rate"])
+        )
+        samples -= sum(_mp3_gapless_info(mp3_path))
+        return samples * int(stream["channels"]) * MP3_SAMPLE_WIDTH
+    except Exception:
+        return None
+
+
+def _read_mp3_pcm_bytes(
+    mp3_path, positions: np.ndarray, stop_early: bool = False
+) -> tuple[bytes, int]:
+    """
+    Streams the decoded pcm data of a mp3 through a fixed size buffer and
+    picks the bytes at the given positions. Only the chunk being read is held
+    in memory.
+
+    :param mp3_path: Path to the MP3 file.
+    :param positions: Byte positions into the decoded pcm data.
+    :param stop_early: Stop decoding once the last position has been read.
+    :return: The picked bytes in the order of positions and the number of pcm
+        bytes decoded.
+    """
+    order = np.argsort(positions, kind="stable")
+    sorted_positions = positions[order]
+    values = np.zeros(len(positions), dtype=np.uint8)
+
+    command = [
+        AudioSegment.converter,
+        *("-loglevel", "error", "-f", "mp3", "-i", str(mp3_path)),
+        *("-acodec", "pcm_s16le", "-vn", "-f", "s16le", "-"),
+    ]
+
+    buffer = bytearray(PCM_CHUNK_SIZE)
+    offset = index = 0
+    with span("key.decode.mp3") as decoding, tempfile.TemporaryFile() as stderr:
+        try:
+            # ffmpeg reads keys from stdin, which belongs to the caller
+            process = subprocess.Popen(
+                command,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=stderr,
+                bufsize=0,
+            )
+        except OSError as e:
+            raise ValueError(f"Error opening MP3 file: {e}")
+
+        with process:
+            while read := process.stdout.readinto(buffer):
+                end = offset + read
+                stop = np.searchsorted(sorted_positions, end)
+                if stop > index:
+                    chunk = np.frombuffer(buffer, dtype=np.uint8, count=read)
+                    picked = order[index:stop]
+                    values[picked] = chunk[sorted_positions[index:stop] - offset]
+                    index = stop
+
+                offset = end
+                decoding.add_bytes(read)
+                if stop_early and index == len(positions):
+                    process.kill()
+                    break
+
+        if not stop_early or index < len(positions):
+            if process.returncode != 0 or offset == 0:
+                stderr.seek(0)
+                message = stderr.read().decode(errors="ignore")
+                raise ValueError(f"Error opening MP3 file: {message}")
+
+    return values.tobytes(), offset
+
+
+@timed("key.sample.mp3")
+def _sample_mp3_bytes(mp3_path, draws: list[tuple[object, int]]) -> list[bytes]:
+    """
+    Draws random byte positions of the decoded pcm data for every (seed,
+    number of samples) pair and returns the bytes at those positions. The
+    positions of all draws are read in one pass over the stream.
+
+    The positions depend on the pcm length, which is estimated from the mp3
+    header so the stream is usually decoded once. If the decoded length turns
+    out to differ, the positions are drawn again for the exact length and a
+    second pass stops decoding after the last position.
+    """
+
+    def draw_positions(audio_length: int) -> np.ndarray:
+        positions = []
+        for seed, num_samples in draws:
+            rng = random.Random(seed)
+            positions += [rng.randint(0, audio_length - 1) for _ in range(num_samples)]
+
+        return np.array(positions, dtype=np.int64)
+
+    def split(sample_data: bytes) -> list[bytes]:
+        ends = np.cumsum([num_samples for _, num_samples in draws])
+        return [sample_data[end - n : end] for (_, n), end in zip(draws, ends)]
+
+    estimate = _estimate_mp3_pcm_length(mp3_path)
+    if estimate:
+        positions = draw_positions(estimate)
+        sample_data, audio_length = _read_mp3_pcm_bytes(mp3_path, positions)
+        if audio_length == estimate:
+            return split(sample_data)
+    else:
+        _, audio_length = _read_mp3_pcm_bytes(mp3_path, np.empty(0, np.int64))
+
+    positions = draw_positions(audio_length)
+    sample_data, _ = _read_mp3_pcm_bytes(mp3_path, positions, stop_early=True)
+    return split(sample_data)
+
+
+def _key_from_samples(sample_data: bytes, length: int) -> str:
+    # Derive a secure encryption key using PBKDF2-HMAC-SHA256
+    salt = hashlib.sha256(sample_data).digest()[:16]  # Use hash of samples as salt
+    return _derive_key(sample_data, salt, length).hex()
 
 
 def extract_key_from_gif_deterministic(gif_path, seed, num_pixels=100, key_length=32):
@@ -30,44 +455,23 @@ def extract_key_from_gif_deterministic(gif_path, seed, num_pixels=100, key_lengt
         raise ValueError("The provided file is not an animated GIF.")
 
     # Collect pixel data from randomly selected frames and pixels
-    random.seed(seed)
-    pixel_data = bytearray()
-    frame_count = gif.n_frames
-
-    for _ in range(num_pixels):
-        # Randomly select a frame
-        frame_index = random.randint(0, frame_count - 1)
-        gif.seek(frame_index)  # Move to the selected frame
-
-        # Convert frame to RGB mode (to handle palettes or grayscale)
-        frame = gif.convert("RGB")
-        width, height = frame.size
-
-        # Randomly select a pixel from this frame
-        x = random.randint(0, width - 1)
-        y = random.randint(0, height - 1)
-
-        # Get the RGB value of the pixel and add it to pixel_data
-        r, g, b = frame.getpixel((x, y))
-        pixel_data.extend([r, g, b])
+    rng = random.Random(seed)
+    pixel_data = _sample_gif_pixels(gif, rng, num_pixels)
 
     # Derive a secure encryption key using PBKDF2-HMAC-SHA256
     salt = hashlib.sha256(pixel_data).digest()[:16]  # Use hash of pixel data as salt
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=key_length,
-        salt=salt,
-        iterations=100000,
-        backend=default_backend(),
-    )
-    key = kdf.derive(pixel_data)
+    key = _derive_key(pixel_data, salt, key_length)
     gif.close()
 
     return key.hex()
 
 
 def generate_key_from_jpeg(
-    jpeg_path, seed, num_pixels: int = 100, length: int = 32
+    jpeg_path,
+    seed,
+    num_pixels: int = 100,
+    length: int = 32,
+    partial_decode: bool = False,
 ) -> str:
     """
     Generates a 32-byte encryption key from a JPEG file using a deterministic
@@ -76,6 +480,7 @@ def generate_key_from_jpeg(
     :param jpeg_path: Path to the JPEG file.
     :param seed: Seed for the random number generator (ensures determinism).
     :param num_pixels: Number of pixels to select for key derivation.
+    :param partial_decode: Stop decoding after the last MCU row holding a sample.
     :return: Derived 32-byte encryption key.
     """
     try:
@@ -83,36 +488,15 @@ def generate_key_from_jpeg(
     except Exception as e:
         raise ValueError(f"Error opening JPEG file: {e}")
 
-    # Ensure it's a valid image
-    if not img.mode == "RGB":
-        img = img.convert("RGB")
-
     # Initialize random generator with the given seed for determinism
-    random.seed(seed)
+    rng = random.Random(seed)
 
     # Collect pixel data from randomly selected pixels
-    pixel_data = bytearray()
-    width, height = img.size
-
-    for _ in range(num_pixels):
-        # Randomly select a pixel
-        x = random.randint(0, width - 1)
-        y = random.randint(0, height - 1)
-
-        # Get the RGB value of the pixel and add it to pixel_data
-        r, g, b = img.getpixel((x, y))
-        pixel_data.extend([r, g, b])
+    pixel_data = _sample_jpeg_pixels(img, rng, num_pixels, partial_decode)
 
     # Derive a secure encryption key using PBKDF2-HMAC-SHA256
     salt = hashlib.sha256(pixel_data).digest()[:16]  # Use hash of pixel data as salt
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=length,
-        salt=salt,
-        iterations=100000,
-        backend=default_backend(),
-    )
-    key = kdf.derive(pixel_data)
+    key = _derive_key(pixel_data, salt, length)
 
     return key.hex()
 
@@ -120,11 +504,11 @@ def generate_key_from_jpeg(
 def get_random_string_from_book(
     seed: int, pages: int, words: int = 250, characters: int = 5, length: int = 42
 ) -> Iterable[tuple[int, int, int]]:
-    random.seed(seed)
+    rng = random.Random(seed)
     for _ in range(length):
-        page = random.randint(1, pages)
-        word = random.randint(1, words)
-        character = random.randint(1, characters)
+        page = rng.randint(1, pages)
+        word = rng.randint(1, words)
+        character = rng.randint(1, characters)
         yield page, word, character
 
 
@@ -136,15 +520,13 @@ def generate_deterministic_key(text: str, seed: int, length: int = 32) -> str:
     :param seed: The seed for deterministic randomness.
     :return: A 32-byte encryption key.
     """
-    random.seed(seed)
+    rng = random.Random(seed)
 
     # Generate a deterministic salt using the seed
-    salt = "".join(
-        random.choices("abcdefghijklmnopqrstuvwxyz0123456789", k=16)
-    ).encode()
+    salt = "".join(rng.choices("abcdefghijklmnopqrstuvwxyz0123456789", k=16)).encode()
 
     # Use PBKDF2-HMAC-SHA256 to derive the key
-    key = hashlib.pbkdf2_hmac("sha256", text.encode(), salt, 100_000, dklen=length)
+    key = _derive_key(text.encode(), salt, length)
 
     return key.hex()
 
@@ -158,37 +540,178 @@ def generate_key_from_mp3(mp3_path, seed, num_samples=1000, length: int = 32) ->
     :param num_samples: Number of audio samples to select for key derivation.
     :return: Derived 32-byte encryption key.
     """
-    try:
-        audio = AudioSegment.from_mp3(mp3_path)
-    except Exception as e:
-        raise ValueError(f"Error opening MP3 file: {e}")
+    # Collect audio sample data from randomly selected positions
+    sample_data = _sample_mp3_bytes(mp3_path, [(seed, num_samples)])[0]
 
-    # Convert audio to raw bytes
-    raw_audio = audio.raw_data
+    # Derive a secure encryption key using PBKDF2-HMAC-SHA256
+    salt = hashlib.sha256(sample_data).digest()[:16]  # Use hash of sample data as salt
+    key = _derive_key(sample_data, salt, length)
 
-    # Initialize random generator with the given seed for determinism
-    random.seed(seed)
+    return key.hex()
 
-    # Collect audio sample data from randomly selected positions
-    sample_data = bytearray()
-    audio_length = len(raw_audio)
 
-    for _ in range(num_samples):
-        # Randomly select a sample position
-        position = random.randint(0, audio_length - 1)
+def key_fingerprint(key: str) -> str:
+    """Short fingerprint of a hex key, safe to store in place of the key."""
+    return hashlib.sha256(bytes.fromhex(key)).hexdigest()[:16]
 
-        # Get the byte at the selected position and add it to sample_data
-        sample_data.append(raw_audio[position])
 
-    # Derive a secure encryption key using PBKDF2-HMAC-SHA256
-    salt = hashlib.sha256(sample_data).digest()[:16]  # Use hash of sample data as salt
-    kdf = PBKDF2HMAC(
-        algorithm=hashes.SHA256(),
-        length=length,
-        salt=salt,
-        iterations=100000,
-        backend=default_backend(),
-    )
-    key = kdf.derive(sample_data)
+def _carrier_type(path: str) -> str:
+    name = str(path).lower()
+    if name.endswith(".gif"):
+        return "gif"
+    if name.endswith((".jpg", ".jpeg")):
+        return "jpeg"
+    if name.endswith(".mp3"):
+        return "mp3"
+    return "text"
 
-    return key.hex()
+
+def generate_key_from_file(
+    path, seed, num_samples: int = 100, length: int = 32, partial_decode: bool = False
+) -> str:
+    """
+    Derives a key from a gif, jpeg or mp3 carrier, any other file is read as
+    text. The carrier type is taken from the file name.
+
+    :param path: Path to the carrier.
+    :param seed: Seed for the random number generator (ensures determinism).
+    :param num_samples: Number of pixels or audio samples to select.
+    :param length: Length of the key in bytes.
+    :param partial_decode: jpeg only, see `generate_key_from_jpeg`.
+    :return: Derived key as hex.
+    """
+    carrier = _carrier_type(path)
+    if carrier == "gif":
+        return extract_key_from_gif_deterministic(path, seed, num_samples, length)
+    if carrier == "jpeg":
+        return generate_key_from_jpeg(path, seed, num_samples, length, partial_decode)
+    if carrier == "mp3":
+        return generate_key_from_mp3(path, seed, num_samples, length)
+
+    return generate_deterministic_key(Path(path).read_text().strip(), seed, length)
+
+
+def _derive_carrier_keys(
+    path: str, params: list[tuple[str, int, int]]
+) -> tuple[list[tuple[str | None, str | None, float]], float]:
+    """
+    Derives the keys of all (seed, number of samples, length) of one carrier.
+    The carrier is decoded once and every seed samples the decoded data.
+
+    :return: (key, error, seconds) for every parameter set in order and the
+        seconds spent opening the carrier. GIF frames are decoded lazily, the
+        first seed needing a frame pays for it.
+    """
+    carrier = _carrier_type(path)
+    start = time.perf_counter()
+    try:
+        with span(f"key.decode.{carrier}"):
+            if carrier == "gif":
+                gif = Image.open(path)
+                if not gif.is_animated:
+                    raise ValueError("The provided file is not an animated GIF.")
+                frames = {}
+            elif carrier == "jpeg":
+                img = Image.open(path)
+                if img.mode in ("P", "PA"):
+                    img = img.convert("RGB")
+                pixels = np.asarray(img)
+            elif carrier == "mp3":
+                samples = _sample_mp3_bytes(
+                    path, [(seed, num) for seed, num, _ in params]
+                )
+            else:
+                text = Path(path).read_text().strip()
+    except Exception as e:
+        error = f"Error opening {path}: {e}"
+        return [(None, error, 0.0)] * len(params), time.perf_counter() - start
+
+    decode_seconds = time.perf_counter() - start
+    results = []
+    for i, (seed, num_samples, length) in enumerate(params):
+        start = time.perf_counter()
+        try:
+            if carrier == "gif":
+                key = _key_from_samples(
+                    _sample_gif_pixels(gif, random.Random(seed), num_samples, frames),
+                    length,
+                )
+            elif carrier == "jpeg":
+                rng = random.Random(seed)
+                xs, ys = _draw_pixel_coordinates(rng, *img.size, num_samples)
+                key = _key_from_samples(
+                    _gather_rgb_pixels(img.mode, pixels, xs, ys), length
+                )
+            elif carrier == "mp3":
+                key = _key_from_samples(samples[i], length)
+            else:
+                key = generate_deterministic_key(text, seed, length)
+            results.append((key, None, time.perf_counter() - start))
+        except Exception as e:
+            results.append((None, str(e), time.perf_counter() - start))
+
+    if carrier == "gif":
+        gif.close()
+
+    return results, decode_seconds
+
+
+def _split_carriers(
+    carriers: dict[str, list[int]], workers: int
+) -> list[tuple[str, list[int]]]:
+    """
+    Splits the item indices of every carrier into parts for the workers.
+    With fewer carriers than workers the seeds of a carrier are spread over
+    several parts, every part decodes the carrier once.
+    """
+    parts = max(1, workers // max(len(carriers), 1))
+    tasks = []
+    for path, indices in carriers.items():
+        size = -(-len(indices) // min(parts, len(indices)))
+        tasks += [(path, indices[i : i + size]) for i in range(0, len(indices), size)]
+    return tasks
+
+
+def derive_keys_bulk(
+    items: Iterable[tuple[str, str, int, int]], workers: int = 1
+) -> list[dict]:
+    """
+    Regenerates the keys of many (path, seed, number of samples, length) items.
+    Items are grouped by carrier so every carrier is opened and decoded once
+    per worker, and carriers are handled in parallel by a process pool. The
+    seeds of carriers fewer than the workers are spread over the pool.
+
+    Seeds are used as strings, like the seeds of `crypto generate-key`.
+
+    :param items: Items to derive keys for.
+    :param workers: Number of processes, 0 uses all cpus.
+    :return: For every item in order a dict with the `key` or the `error`, the
+        `seconds` spent on the key and the `decode_seconds` of its carrier.
+    """
+    items = list(items)
+    carriers: dict[str, list[int]] = {}
+    for index, (path, *_) in enumerate(items):
+        carriers.setdefault(str(path), []).append(index)
+
+    workers = workers or os.cpu_count() or 1
+    tasks = _split_carriers(carriers, workers)
+    paths = [path for path, _ in tasks]
+    params = [
+        [(str(items[i][1]), int(items[i][2]), int(items[i][3])) for i in indices]
+        for _, indices in tasks
+    ]
+
+    if workers == 1 or len(tasks) <= 1:
+        derived = map(_derive_carrier_keys, paths, params)
+    else:
+        with ProcessPoolExecutor(min(workers, len(tasks))) as executor:
+            derived = list(executor.map(_derive_carrier_keys, paths, params))
+
+    results: list[dict] = [{}] * len(items)
+    for (_, indices), (keys, decode_seconds) in zip(tasks, derived):
+        for index, (key, error, seconds) in zip(indices, keys):
+            result = {"key": key} if key else {"error": error}
+            result.update(seconds=seconds, decode_seconds=decode_seconds)
+            results[index] = result
+
+    return results
@@ -1,45 +1,79 @@
 import base64
+import csv
+import json
+import multiprocessing
 import os
 from pathlib import Path
 
-import audio_steganogra
 import click
-import image_steganogra
-from encrypt import decrypt_with_key, encrypt_with_key
-from encryption_by_text import gen_key_for_pdf
-from key import (
-    extract_key_from_gif_deterministic,
-    generate_deterministic_key,
-    generate_key_from_jpeg,
-    get_random_string_from_book,
-)
-from seed import (
-    generate_secure_random_float,
-    generate_secure_random_integer,
-    generate_secure_random_lat_long,
-)
-from word_substitution import create_key, recover_word
+
+# the subsystems are imported by the commands using them, numba, PyMuPDF,
+# Pillow and cryptography take longer to import than most commands to run
+
+# kept in sync with image_steganogra.ENGINES without importing it
+IMAGE_ENGINES = ("jsteg", "native")
+# kept in sync with word_substitution.MAX_BLOCK_SIZE
+MAX_SUBSTITUTION_BLOCK_SIZE = 64 * 1024 * 1024
+# kept in sync with encrypt.MAX_CHUNK_SIZE
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
 
 
 @click.group()
-def cli():
+@click.option(
+    "--profile",
+    type=click.Path(dir_okay=False, writable=True),
+    help="write a JSON trace of the time, bytes and memory of every stage",
+)
+@click.option(
+    "--cprofile",
+    type=click.Path(dir_okay=False, writable=True),
+    help="write cProfile stats, read them with python -m pstats",
+)
+@click.pass_context
+def cli(ctx: click.Context, profile: str | None, cprofile: str | None):
     """
     Hider! Small utility to encrypt a message and hide it in a file like an
     audio, image or video.
     """
+    if profile:
+        import sys
 
-    pass
+        import profiling
+
+        profiling.enable()
+        ctx.call_on_close(lambda: profiling.write_trace(profile, sys.argv))
+
+    if cprofile:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+        def dump_stats():
+            profiler.disable()
+            profiler.dump_stats(cprofile)
+
+        ctx.call_on_close(dump_stats)
 
 
 @cli.group()
-def crypto():
+@click.option(
+    "--key-cache",
+    default=0,
+    type=click.IntRange(min=0),
+    help="keep up to this many derived keys in memory, 0 disables the cache",
+)
+def crypto(key_cache: int):
     """Generate keys and seeds"""
-    pass
+    if key_cache:
+        from key import enable_key_cache
+
+        enable_key_cache(key_cache)
 
 
 @cli.group()
 def audio():
-    """mp3 steganography WARNING this is very sloooow"""
+    """mp3, wav and flac steganography WARNING mp3 is very sloooow"""
     pass
 
 
@@ -50,8 +84,54 @@ def image():
 
 
 @cli.group()
-def text():
+def video():
+    """video steganography, writes lossless ffv1 mkv files"""
+    pass
+
+
+@cli.group()
+@click.option(
+    "--cache-dir",
+    envvar="HIDER_CACHE_DIR",
+    type=click.Path(file_okay=False),
+    help="cache extracted pdf corpora in this directory",
+)
+@click.option(
+    "--cache-size",
+    envvar="HIDER_CACHE_SIZE",
+    type=int,
+    help="evict the least recently used corpora above this many bytes",
+)
+@click.option(
+    "-w",
+    "--workers",
+    default=1,
+    type=click.IntRange(min=0),
+    help="processes extracting pdf pages or searching secrets, 0 uses all cpus",
+)
+@click.pass_context
+def text(
+    ctx: click.Context, cache_dir: str | None, cache_size: int | None, workers: int
+):
     """generate key for secret from text and text steganography"""
+    ctx.obj = {"cache": None, "workers": workers}
+    if cache_dir:
+        from corpus_cache import DEFAULT_MAX_SIZE, CorpusCache
+
+        size = DEFAULT_MAX_SIZE if cache_size is None else cache_size
+        ctx.obj["cache"] = CorpusCache(cache_dir, size)
+
+
+def _corpus_cache(settings: dict):
+    if not settings["cache"]:
+        raise click.UsageError("--cache-dir or HIDER_CACHE_DIR is required")
+
+    return settings["cache"]
+
+
+@text.group()
+def cache():
+    """prebuild or clear cached pdf corpora"""
     pass
 
 
@@ -64,6 +144,12 @@ def text():
 @click.option("-l", "--lower", type=int, default=14)
 @click.option("-u", "--upper", type=int, default=100000)
 def generate_seed(type: str, lower: float, upper: float):
+    from seed import (
+        generate_secure_random_float,
+        generate_secure_random_integer,
+        generate_secure_random_lat_long,
+    )
+
     if type == "int":
         print(generate_secure_random_integer(lower, upper))
     elif type == "float":
@@ -79,18 +165,118 @@ def generate_seed(type: str, lower: float, upper: float):
 @click.option("-s", "--seed", default="42", type=str)
 @click.option("-l", "--length", default=32, type=int)
 @click.option("-p", "--pixel-entropy", default=100, type=int)
+@click.option(
+    "--partial-decode",
+    is_flag=True,
+    default=False,
+    help="jpeg only: stop decoding after the last sampled MCU row",
+)
+@click.option(
+    "--fingerprint",
+    is_flag=True,
+    default=False,
+    help="print a fingerprint of the key for a verify-keys manifest instead",
+)
 @click.argument("filename", nargs=1)
-def generate_key(seed: str, length: int, pixel_entropy: int, filename: str):
-    if filename.endswith(".gif"):
-        print(extract_key_from_gif_deterministic(filename, seed, pixel_entropy, length))
-    elif filename.lower().endswith((".jpg", ".jpeg")):
-        print(generate_key_from_jpeg(filename, seed, pixel_entropy, length))
-    else:
+def generate_key(
+    seed: str,
+    length: int,
+    pixel_entropy: int,
+    partial_decode: bool,
+    fingerprint: bool,
+    filename: str,
+):
+    from key import generate_key_from_file, key_fingerprint
+
+    output = key_fingerprint if fingerprint else str
+    if not filename.lower().endswith((".gif", ".jpg", ".jpeg", ".mp3")):
         print(f"reading {filename} as a text file!")
+
+    key = generate_key_from_file(filename, seed, pixel_entropy, length, partial_decode)
+    print(output(key))
+
+
+def _read_manifest(
+    manifest: str, columns: tuple[str, ...], integers: tuple[str, ...] = ()
+) -> list[dict]:
+    """
+    Reads the rows of a csv manifest. Every row needs a value in `columns`
+    and the values of `integers` have to be numbers, the first row missing
+    them fails the command with its line.
+    """
+    with open(manifest, newline="") as f:
+        reader = csv.DictReader(f)
+        rows = []
+        for row in reader:
+            missing = [
+                column for column in columns if not (row.get(column) or "").strip()
+            ]
+            if missing:
+                raise click.ClickException(
+                    f"{manifest} line {reader.line_num}: missing {', '.join(missing)}"
+                )
+            for column in integers:
+                if row.get(column) and not row[column].strip().isdigit():
+                    raise click.ClickException(
+                        f"{manifest} line {reader.line_num}: {column} is not a number"
+                    )
+            rows.append(row)
+
+    return rows
+
+
+@crypto.command()
+@click.option(
+    "-w",
+    "--workers",
+    default=1,
+    type=click.IntRange(min=0),
+    help="processes deriving keys of different carriers, 0 uses all cpus",
+)
+@click.argument("manifest", type=click.Path(exists=True, dir_okay=False))
+def verify_keys(workers: int, manifest: str):
+    """
+    Regenerate the keys of a csv MANIFEST with the columns file, seed,
+    pixel_entropy, length and fingerprint and check them against the
+    fingerprints of `generate-key --fingerprint`. Relative files are resolved
+    against the directory of the manifest.
+    """
+    from key import derive_keys_bulk, key_fingerprint
+
+    base = Path(manifest).parent
+    rows = _read_manifest(
+        manifest, ("file", "seed", "fingerprint"), ("pixel_entropy", "length")
+    )
+
+    items = [
+        (
+            base / row["file"],
+            row["seed"],
+            int(row.get("pixel_entropy") or 100),
+            int(row.get("length") or 32),
+        )
+        for row in rows
+    ]
+
+    failed = 0
+    for row, result in zip(rows, derive_keys_bulk(items, workers)):
+        if "key" not in result:
+            status = f"ERROR {result['error']}"
+        elif key_fingerprint(result["key"]) != row["fingerprint"].strip():
+            status = "MISMATCH"
+        else:
+            status = "ok"
+        failed += status != "ok"
+
         print(
-            generate_deterministic_key(Path(filename).read_text().strip(), seed, length)
+            f"{row['file']} seed={row['seed']}: {status} "
+            f"({result['seconds']:.3f}s, decode {result['decode_seconds']:.3f}s)"
         )
 
+    print(f"{len(rows) - failed}/{len(rows)} keys verified")
+    if failed:
+        raise SystemExit(1)
+
 
 @crypto.command()
 @click.option("-s", "--seed", default=42, type=int)
@@ -99,15 +285,85 @@ def generate_key(seed: str, length: int, pixel_entropy: int, filename: str):
 @click.option("-c", "--chars", default=5, type=int)
 @click.option("-l", "--length", default=42, type=int)
 def generate_source(seed: int, pages: int, words: int, chars: int, length: int):
+    from key import get_random_string_from_book
+
     for t in get_random_string_from_book(seed, pages, words, chars, length):
         print(t)
 
 
+def _check_stream_options(in_path: str | None, out_path: str | None):
+    if bool(in_path) != bool(out_path):
+        raise click.UsageError("--in and --out have to be used together")
+
+
+def _run_batch(
+    convert, in_path: str | None, out_path: str | None, decode, encode, workers: int
+):
+    # one message per line, stdin and stdout unless files are given
+    with (
+        click.open_file(in_path or "-", "rb") as source,
+        click.open_file(out_path or "-", "wb") as target,
+    ):
+        lines = (decode(line.rstrip(b"\r\n")) for line in source)
+        for result in convert(lines, workers):
+            target.write(encode(result) + b"\n")
+
+
 @crypto.command()
 @click.option("--base64", "base", is_flag=True, default=False)
 @click.option("-k", "--key", type=str)
-@click.option("-m", "--message", prompt=True, hide_input=True)
-def encrypt(key: str, message: str, base: bool):
+@click.option("-m", "--message", hide_input=True)
+@click.option(
+    "--in",
+    "in_path",
+    type=click.Path(exists=True, dir_okay=False),
+    help="stream a file of any size instead of a message",
+)
+@click.option("--out", "out_path", type=click.Path(dir_okay=False))
+@click.option(
+    "--chunk-size",
+    type=click.IntRange(1, MAX_CHUNK_SIZE),
+    help="bytes per chunk of a streamed file",
+)
+@click.option(
+    "--batch",
+    is_flag=True,
+    default=False,
+    help="encrypt every line of --in or stdin into a base64 line",
+)
+@click.option("-w", "--workers", default=1, type=click.IntRange(min=1))
+def encrypt(
+    key: str,
+    message: str | None,
+    base: bool,
+    in_path: str | None,
+    out_path: str | None,
+    chunk_size: int | None,
+    batch: bool,
+    workers: int,
+):
+    from encrypt import CHUNK_SIZE, CipherContext, encrypt_file, encrypt_with_key
+
+    if batch:
+        context = CipherContext(key)
+        _run_batch(
+            context.encrypt_many, in_path, out_path, bytes, base64.b64encode, workers
+        )
+        return
+
+    _check_stream_options(in_path, out_path)
+    if in_path:
+        if chunk_size is None:
+            chunk_size = CHUNK_SIZE
+        try:
+            encrypt_file(in_path, out_path, key, chunk_size)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        return
+
+    if message is None:
+        message = click.prompt("Message", hide_input=True)
+
     message = encrypt_with_key(message, key)
     if base:
         message = base64.b64encode(message.encode("utf-8")).decode("utf-8")
@@ -118,66 +374,437 @@ def encrypt(key: str, message: str, base: bool):
 @crypto.command()
 @click.option("--base64", "base", is_flag=True, default=False)
 @click.option("-k", "--key", type=str)
-@click.option("-m", "--message", prompt=True, hide_input=True)
-def decrypt(key: str, message: str, base: bool):
+@click.option("-m", "--message", hide_input=True)
+@click.option(
+    "--in",
+    "in_path",
+    type=click.Path(exists=True, dir_okay=False),
+    help="stream a file of any size instead of a message",
+)
+@click.option("--out", "out_path", type=click.Path(dir_okay=False))
+@click.option(
+    "--batch",
+    is_flag=True,
+    default=False,
+    help="decrypt every base64 line of --in or stdin",
+)
+@click.option("-w", "--workers", default=1, type=click.IntRange(min=1))
+def decrypt(
+    key: str,
+    message: str | None,
+    base: bool,
+    in_path: str | None,
+    out_path: str | None,
+    batch: bool,
+    workers: int,
+):
+    from encrypt import CipherContext, decrypt_file, decrypt_with_key
+
+    if batch:
+        context = CipherContext(key)
+        _run_batch(
+            context.decrypt_many, in_path, out_path, base64.b64decode, bytes, workers
+        )
+        return
+
+    _check_stream_options(in_path, out_path)
+    if in_path:
+        decrypt_file(in_path, out_path, key)
+        return
+
+    if message is None:
+        message = click.prompt("Message", hide_input=True)
+
     if base:
         message = base64.b64decode(message.encode("utf-8")).decode("utf-8")
 
     print(decrypt_with_key(message.encode("utf-8"), key.encode("utf-8")))
 
 
+def _pcm_key_option(function):
+    return click.option(
+        "--key",
+        hide_input=True,
+        envvar="__PCM_KEY__",
+        help="wav and flac only: spread the secret over the samples with this key",
+    )(function)
+
+
+def _mp3_workers_option(function):
+    return click.option(
+        "-w",
+        "--workers",
+        default=1,
+        type=click.IntRange(min=0),
+        help="mp3 only: processes handling the segments, 0 uses all cpus",
+    )(function)
+
+
+def _segment_progress(done: int, total: int, seconds: float):
+    click.echo(f"segment {done}/{total} done in {seconds:.1f}s", err=True)
+
+
 @audio.command(name="hide")
 @click.option(
     "-o", "--out-dir", default="/tmp", type=click.Path(exists=True, file_okay=False)
 )
 @click.option("--secret", prompt=True, hide_input=True, envvar="__SECRET__")
+@_pcm_key_option
+@_mp3_workers_option
 @click.argument("filename", nargs=1)
-def hide_in_mp3(out_dir: str, secret: str, filename: str):
+def hide_in_mp3(
+    out_dir: str, secret: str, key: str | None, workers: int, filename: str
+):
+    import audio_steganogra
+
     print(f"'*****' '{filename}' '{out_dir}'")
     audio_steganogra.embed_message(
-        filename, secret, os.path.join(out_dir, os.path.basename(filename))
+        filename,
+        secret,
+        os.path.join(out_dir, os.path.basename(filename)),
+        key,
+        workers,
+        _segment_progress,
     )
 
 
 @audio.command(name="reveil")
+@_pcm_key_option
+@_mp3_workers_option
 @click.argument("filename", nargs=1)
-def reveil_from_mp3(filename: str):
-    print(audio_steganogra.extract_message(filename))
+def reveil_from_mp3(key: str | None, workers: int, filename: str):
+    import audio_steganogra
+
+    print(audio_steganogra.extract_message(filename, key, workers, _segment_progress))
+
+
+def _engine_option(function):
+    return click.option(
+        "--engine",
+        default="jsteg",
+        type=click.Choice(IMAGE_ENGINES),
+        help="jsteg binary or in process coefficient embedding",
+    )(function)
 
 
 @image.command(name="hide")
 @click.option(
     "-o", "--out-dir", default="/tmp", type=click.Path(exists=True, file_okay=False)
 )
-@click.option("--secret", prompt=True, hide_input=True, envvar="__SECRET__")
+@click.option("--secret", hide_input=True, envvar="__SECRET__")
+@click.option(
+    "--secret-file",
+    type=click.File("rb"),
+    help="hide the bytes of a file, native engine or jsteg",
+)
+@_engine_option
 @click.argument("filename", nargs=1)
-def hide_in_jpg(out_dir: str, secret: str, filename: str):
+def hide_in_jpg(
+    out_dir: str, secret: str | None, secret_file, engine: str, filename: str
+):
+    import image_steganogra
+
+    if secret_file:
+        secret = secret_file.read()
+    elif secret is None:
+        secret = click.prompt("Secret", hide_input=True)
+
     print(f"'*****' '{filename}' '{out_dir}'")
     print(
         image_steganogra.embed_message(
-            filename, secret, os.path.join(out_dir, os.path.basename(filename))
+            filename, secret, os.path.join(out_dir, os.path.basename(filename)), engine
         )
     )
 
 
 @image.command(name="reveil")
+@click.option(
+    "-o",
+    "--out-file",
+    type=click.File("wb"),
+    help="write the hidden bytes to a file instead of printing them",
+)
+@_engine_option
+@click.argument("filename", nargs=1)
+def reveil_from_jpg(out_file, engine: str, filename: str):
+    import image_steganogra
+
+    if out_file:
+        out_file.write(image_steganogra.extract_payload(filename, engine))
+    else:
+        print(image_steganogra.extract_message(filename, engine))
+
+
+@image.command(name="hide-batch")
+@click.option(
+    "-o", "--out-dir", default="/tmp", type=click.Path(exists=True, file_okay=False)
+)
+@click.option(
+    "-w",
+    "--workers",
+    default=1,
+    type=click.IntRange(min=0),
+    help="concurrent jsteg processes, 0 uses all cpus",
+)
+@_engine_option
+@click.argument("manifest", type=click.Path(exists=True, dir_okay=False))
+def hide_in_jpgs(out_dir: str, workers: int, engine: str, manifest: str):
+    """
+    Hide the secrets of a csv MANIFEST with the columns file, secret and the
+    optional out. Relative paths are resolved against the directory of the
+    manifest, outputs default to the file name in --out-dir.
+    """
+    import image_steganogra
+
+    base = Path(manifest).parent
+    rows = _read_manifest(manifest, ("file", "secret"))
+
+    items = [
+        (
+            base / row["file"],
+            row["secret"],
+            base / row["out"]
+            if row.get("out")
+            else os.path.join(out_dir, os.path.basename(row["file"])),
+        )
+        for row in rows
+    ]
+
+    # rows run concurrently, two of them writing one file would race
+    targets = {}
+    for line, (_, _, out) in enumerate(items, 1):
+        target = os.path.abspath(out)
+        if target in targets:
+            raise click.ClickException(
+                f"{manifest}: rows {targets[target]} and {line} both write {target}"
+            )
+        targets[target] = line
+
+    failed = 0
+    for line, ((_, _, out), error) in enumerate(
+        zip(items, image_steganogra.embed_messages(items, workers, engine)), 1
+    ):
+        if error:
+            failed += 1
+            result = {"line": line, "error": error}
+        else:
+            result = {"line": line, "out": str(out)}
+        click.echo(json.dumps(result))
+
+    if failed:
+        raise SystemExit(1)
+
+
+@image.command(name="reveil-batch")
+@click.option("-w", "--workers", default=1, type=click.IntRange(min=0))
+@_engine_option
+@click.argument("filenames", nargs=-1, type=click.Path(exists=True, dir_okay=False))
+def reveil_from_jpgs(workers: int, engine: str, filenames: tuple[str, ...]):
+    """Reveal the messages of many images and print them as JSON lines"""
+    import image_steganogra
+
+    for filename, (message, error) in zip(
+        filenames, image_steganogra.extract_messages(filenames, workers, engine)
+    ):
+        if error:
+            click.echo(json.dumps({"file": filename, "error": error}))
+        else:
+            click.echo(json.dumps({"file": filename, "message": message}))
+
+
+@video.command(name="hide")
+@click.option(
+    "-o", "--out-dir", default="/tmp", type=click.Path(exists=True, file_okay=False)
+)
+@click.option("--secret", prompt=True, hide_input=True, envvar="__SECRET__")
+@click.option(
+    "-w",
+    "--workers",
+    default=1,
+    type=click.IntRange(min=0),
+    help="threads embedding frames, 0 uses all cpus",
+)
+@click.option(
+    "--frame-step",
+    default=1,
+    type=click.IntRange(1, 65535),
+    help="hide the secret in every n-th frame only",
+)
 @click.argument("filename", nargs=1)
-def reveil_from_jpg(filename: str):
-    print(image_steganogra.extract_message(filename))
+def hide_in_video(
+    out_dir: str, secret: str, workers: int, frame_step: int, filename: str
+):
+    import video_steganogra
+
+    out_path = os.path.join(
+        out_dir, Path(filename).stem + video_steganogra.VIDEO_SUFFIX
+    )
+    print(f"'*****' '{filename}' '{out_path}'")
+    video_steganogra.embed_message(filename, secret, out_path, workers, frame_step)
+
+
+@video.command(name="reveil")
+@click.argument("filename", nargs=1)
+def reveil_from_video(filename: str):
+    import video_steganogra
+
+    print(video_steganogra.extract_message(filename))
+
+
+@cli.command(name="capacity")
+@_engine_option
+@click.argument("filenames", nargs=-1, type=click.Path(exists=True, dir_okay=False))
+def capacity_of_files(engine: str, filenames: tuple[str, ...]):
+    """
+    Print how many bytes can be hidden in every image, mp3, wav, flac or
+    text file as JSON lines, without embedding anything.
+    """
+    import audio_steganogra
+    import image_steganogra
+    import whitespace_steganogra
+
+    failed = 0
+    for filename in filenames:
+        try:
+            if filename.lower().endswith(whitespace_steganogra.TEXT_SUFFIXES):
+                size = whitespace_steganogra.capacity(filename)
+            elif filename.lower().endswith(audio_steganogra.AUDIO_SUFFIXES):
+                size = audio_steganogra.capacity(filename)
+            else:
+                size = image_steganogra.capacity(filename, engine)
+        except (OSError, ValueError) as e:
+            failed += 1
+            click.echo(json.dumps({"file": filename, "error": str(e).strip()}))
+        else:
+            click.echo(json.dumps({"file": filename, "capacity": size}))
+
+    if failed:
+        raise SystemExit(1)
 
 
 @text.command(name="gen-key")
 @click.option("--secret", prompt=True, hide_input=True, envvar="__SECRET__")
 @click.argument("filename", nargs=1)
-def generate_key_from_text(secret: str, filename: str):
-    for key in gen_key_for_pdf(secret, filename):
+@click.pass_obj
+def generate_key_from_text(settings: dict, secret: str, filename: str):
+    from encryption_by_text import gen_key_for_pdf, gen_key_for_text
+
+    if settings["cache"]:
+        corpus = settings["cache"].get(filename, settings["workers"])
+        keys = gen_key_for_text(secret, corpus)
+    else:
+        keys = gen_key_for_pdf(secret, filename, settings["workers"])
+
+    for key in keys:
         print(key)
 
 
+@text.command(name="gen-key-batch")
+@click.option(
+    "-i",
+    "--input",
+    "secrets",
+    default="-",
+    type=click.File("r"),
+    help="file with one secret per line, defaults to stdin",
+)
+@click.argument("filename", nargs=1)
+@click.pass_obj
+def generate_keys_from_text(settings: dict, secrets, filename: str):
+    """Generate keys for many secrets and print them as JSON lines"""
+    from encryption_by_text import gen_key_for_pdf_many, gen_key_for_text_many
+
+    lines = (line.rstrip("\r\n") for line in secrets)
+    if settings["cache"]:
+        corpus = settings["cache"].get(filename, settings["workers"])
+        keys = gen_key_for_text_many(lines, corpus, settings["workers"])
+    else:
+        keys = gen_key_for_pdf_many(lines, filename, settings["workers"])
+
+    for line, (key, error) in enumerate(keys, 1):
+        result = {"line": line, "key": key} if key else {"line": line, "error": error}
+        click.echo(json.dumps(result))
+
+
+@cache.command(name="build")
+@click.argument("filenames", nargs=-1, type=click.Path(exists=True, dir_okay=False))
+@click.pass_obj
+def build_cache(settings: dict, filenames: tuple[str, ...]):
+    corpus_cache = _corpus_cache(settings)
+    for filename in filenames:
+        path = corpus_cache.store(filename, workers=settings["workers"])
+        print(f"{filename} -> {path}")
+
+
+@cache.command(name="clear")
+@click.pass_obj
+def clear_cache(settings: dict):
+    print(f"removed {_corpus_cache(settings).clear()} cached corpora")
+
+
+@text.command(name="hide-whitespace")
+@click.option(
+    "-o", "--out-dir", default="/tmp", type=click.Path(exists=True, file_okay=False)
+)
+@click.option("--secret", hide_input=True, envvar="__SECRET__")
+@click.option("--secret-file", type=click.File("rb"), help="hide the bytes of a file")
+@click.option(
+    "-k", "--key", hide_input=True, help="encrypt the secret with this key first"
+)
+@click.argument("filename", type=click.Path(exists=True, dir_okay=False))
+def hide_in_whitespace(
+    out_dir: str, secret: str | None, secret_file, key: str | None, filename: str
+):
+    """
+    Hide a secret in the trailing spaces and tabs of the lines of a text file,
+    one byte per line. The file is streamed, so it can be of any size
+    """
+    import whitespace_steganogra
+
+    if secret_file:
+        secret = secret_file.read()
+    elif secret is None:
+        secret = click.prompt("Secret", hide_input=True)
+    if key:
+        from encrypt import CipherContext
+
+        secret = CipherContext(key).encrypt(secret)
+
+    out_path = os.path.join(out_dir, os.path.basename(filename))
+    print(f"'*****' '{filename}' '{out_path}'")
+    whitespace_steganogra.embed_message(filename, secret, out_path)
+
+
+@text.command(name="reveil-whitespace")
+@click.option(
+    "-o",
+    "--out-file",
+    type=click.File("wb"),
+    help="write the hidden bytes to a file instead of printing them",
+)
+@click.option("-k", "--key", hide_input=True, help="decrypt the secret with this key")
+@click.argument("filename", type=click.Path(exists=True, dir_okay=False))
+def reveil_from_whitespace(out_file, key: str | None, filename: str):
+    import whitespace_steganogra
+
+    payload = whitespace_steganogra.extract_payload(filename)
+    if key:
+        from encrypt import CipherContext
+
+        payload = CipherContext(key).decrypt(payload)
+
+    if out_file:
+        out_file.write(payload)
+    else:
+        print(payload.decode())
+
+
 @text.command(name="gen-substitution-key")
 @click.option("--secret", prompt=True, hide_input=True, envvar="__SECRET__")
 @click.argument("public-key", nargs=1)
 def generate_key_for_text_substitution(secret: str, public_key: str):
+    from word_substitution import create_key
+
     print(create_key(public_key, secret))
 
 
@@ -185,8 +812,173 @@ def generate_key_for_text_substitution(secret: str, public_key: str):
 @click.option("--key", prompt=True, hide_input=True)
 @click.argument("public-key", nargs=1)
 def reveil_text_substitution(key: str, public_key: str):
+    from word_substitution import recover_word
+
     print(recover_word(public_key, key))
 
 
+@text.command(name="gen-substitution-key-document")
+@click.option(
+    "-o",
+    "--out",
+    default="-",
+    type=click.File("wb"),
+    help="file for the key, defaults to stdout",
+)
+@click.option(
+    "--block-size",
+    type=click.IntRange(1, MAX_SUBSTITUTION_BLOCK_SIZE),
+    help="bytes substituted at once",
+)
+@click.argument("cover", type=click.File("rb"))
+@click.argument("secret", type=click.File("rb"))
+def generate_key_for_document_substitution(out, block_size: int | None, cover, secret):
+    """
+    Stream the files COVER and SECRET of any size and write the key turning
+    the public COVER into the SECRET text
+    """
+    from word_substitution import BLOCK_SIZE, create_document_key
+
+    if block_size is None:
+        block_size = BLOCK_SIZE
+    try:
+        create_document_key(cover, secret, out, block_size)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+
+@text.command(name="reveil-substitution-document")
+@click.option(
+    "-o",
+    "--out",
+    default="-",
+    type=click.File("wb"),
+    help="file for the secret text, defaults to stdout",
+)
+@click.argument("cover", type=click.File("rb"))
+@click.argument("key", type=click.File("rb"))
+def reveil_document_substitution(out, cover, key):
+    """Stream the files COVER and KEY and write the secret text"""
+    from word_substitution import recover_document
+
+    try:
+        recover_document(cover, key, out)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+
+@cli.command()
+@click.option(
+    "--socket",
+    "socket_path",
+    envvar="HIDER_SOCKET",
+    type=click.Path(dir_okay=False),
+    help="unix socket to listen on, $XDG_RUNTIME_DIR/hider-<uid>.sock or a "
+    "private directory in the temp directory by default",
+)
+@click.option(
+    "-w",
+    "--workers",
+    default=4,
+    type=click.IntRange(min=1),
+    help="requests handled concurrently",
+)
+@click.option(
+    "--mp3-workers",
+    default=1,
+    type=click.IntRange(min=0),
+    help="processes kept for mp3 segments, 0 uses all cpus, 1 runs them inline",
+)
+@click.option(
+    "--key-cache",
+    default=0,
+    type=click.IntRange(min=0),
+    help="keep up to this many derived keys in memory, 0 disables the cache",
+)
+@click.option(
+    "--corpora",
+    default=8,
+    type=click.IntRange(min=1),
+    help="pdf corpora kept in memory",
+)
+@click.option(
+    "--cache-dir",
+    envvar="HIDER_CACHE_DIR",
+    type=click.Path(file_okay=False),
+    help="also cache extracted pdf corpora in this directory",
+)
+def serve(
+    socket_path: str | None,
+    workers: int,
+    mp3_workers: int,
+    key_cache: int,
+    corpora: int,
+    cache_dir: str | None,
+):
+    """
+    Answer JSON requests on a unix socket with the subsystems, corpora, keys
+    and workers kept warm between them, see `client`.
+    """
+    import signal
+
+    from server import Server, Service, default_socket_path
+
+    # stop like on ctrl-c, so the socket is removed
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    service = Service(cache_dir, corpora, key_cache=key_cache, mp3_workers=mp3_workers)
+    try:
+        socket_path = socket_path or default_socket_path()
+        server = Server(socket_path, service, workers)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    service.start()
+    try:
+        with server:
+            click.echo(f"listening on {socket_path}", err=True)
+            server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+
+
+@cli.command()
+@click.option(
+    "--socket",
+    "socket_path",
+    envvar="HIDER_SOCKET",
+    type=click.Path(dir_okay=False),
+    help="unix socket of the daemon",
+)
+@click.argument("requests", nargs=-1)
+def client(socket_path: str | None, requests: tuple[str, ...]):
+    """
+    Send JSON REQUESTS, or the JSON lines of stdin, to a running `serve` and
+    print the responses as JSON lines in order. Exits 1 if a request failed.
+
+    \b
+    hider client '{"op": "generate-key", "file": "cat.jpg", "seed": "42"}'
+    """
+    from server import request
+
+    lines = requests or click.open_file("-")
+    items = (json.loads(line) for line in lines if line.strip())
+
+    failed = 0
+    try:
+        for response in request(items, socket_path):
+            failed += "error" in response
+            click.echo(json.dumps(response))
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    if failed:
+        raise SystemExit(1)
+
+
 if __name__ == "__main__":
+    # worker processes of the frozen executable must not run the cli again
+    multiprocessing.freeze_support()
     cli()
@@ -0,0 +1,170 @@
+"""
+Named timing spans around the stages of a command: decoding carriers,
+gathering samples, PBKDF2, pdf extraction, searching, encryption and the
+external binaries.
+
+Recording is off by default. `span()` then returns a shared object doing
+nothing and `timed()` functions only check a global, so the spans stay in the
+code paths. Spans are recorded in the calling process only, work done in
+process pools shows up as the span around the pool.
+"""
+
+import functools
+import json
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+_spans: list[dict] | None = None
+_origin = 0.0
+_local = threading.local()
+
+
+def _peak_rss(who: int | None = None) -> int | None:
+    """Peak resident set size of this process or its children in bytes."""
+    if resource is None:
+        return None
+
+    usage = resource.getrusage(resource.RUSAGE_SELF if who is None else who)
+    # linux reports kilobytes, macOS bytes
+    return usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+class _Span:
+    __slots__ = ("name", "bytes", "_start", "_depth")
+
+    def __init__(self, name: str, size: int):
+        self.name = name
+        self.bytes = size
+
+    def add_bytes(self, size: int):
+        self.bytes += size
+
+    def __enter__(self):
+        self._depth = getattr(_local, "depth", 0)
+        _local.depth = self._depth + 1
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        seconds = time.perf_counter() - self._start
+        _local.depth = self._depth
+        record = {
+            "name": self.name,
+            "start": self._start - _origin,
+            "seconds": seconds,
+            "bytes": self.bytes,
+            "depth": self._depth,
+            "thread": threading.get_ident(),
+            "peak_rss": _peak_rss(),
+        }
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        if _spans is not None:
+            _spans.append(record)
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def add_bytes(self, size: int):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name: str, size: int = 0):
+    """
+    Context manager timing a stage while recording is enabled.
+
+    :param name: Name of the stage, dotted by module like "key.pbkdf2".
+    :param size: Bytes the stage processes, more can be added with
+        `add_bytes` on the returned object.
+    """
+    if _spans is None:
+        return _NO_SPAN
+
+    return _Span(name, size)
+
+
+def timed(name: str):
+    """Decorator recording every call of a function as a span."""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _spans is None:
+                return function(*args, **kwargs)
+
+            with _Span(name, 0):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def enabled() -> bool:
+    return _spans is not None
+
+
+def enable():
+    """Starts recording spans, spans recorded before are dropped."""
+    global _spans, _origin
+    _origin = time.perf_counter()
+    _spans = []
+
+
+def disable() -> list[dict]:
+    """Stops recording and returns the recorded spans in the order they ended."""
+    global _spans
+    spans, _spans = _spans or [], None
+    return spans
+
+
+def trace(spans: list[dict], command: list[str] | None = None) -> dict:
+    """
+    Summarizes recorded spans as a trace with the totals of every stage.
+
+    :param spans: Spans returned by `disable`.
+    :param command: Command line of the traced run.
+    :return: Dict with the wall time since `enable`, the peak rss of this
+        process and of its children, the totals per stage and the spans.
+    """
+    stages: dict[str, dict] = {}
+    for record in spans:
+        stage = stages.setdefault(
+            record["name"], {"count": 0, "seconds": 0.0, "bytes": 0}
+        )
+        stage["count"] += 1
+        stage["seconds"] += record["seconds"]
+        stage["bytes"] += record["bytes"]
+
+    return {
+        "command": command,
+        "seconds": time.perf_counter() - _origin,
+        "peak_rss": _peak_rss(),
+        "children_peak_rss": _peak_rss(resource and resource.RUSAGE_CHILDREN),
+        "stages": stages,
+        "spans": sorted(spans, key=lambda record: record["start"]),
+    }
+
+
+def write_trace(path, command: list[str] | None = None):
+    """Stops recording and writes the trace as JSON to `path`."""
+    with open(path, "w") as f:
+        json.dump(trace(disable(), command), f, indent=2)
+        f.write("\n")
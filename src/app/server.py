@@ -0,0 +1,457 @@
+"""
+Local daemon running the operations of the cli without paying the interpreter
+start, the imports, the pdf extraction and the worker start on every call.
+
+Requests and responses are JSON objects, one per line, over a unix socket. A
+connection can send many requests, they run concurrently and every response
+carries the `id` of its request (the client sets it to the line number):
+
+    {"id": 1, "op": "generate-key", "file": "/abs/cat.jpg", "seed": "42"}
+    {"id": 1, "key": "f203..."}
+    {"id": 2, "error": "No hidden message found"}
+
+Operations and their fields, with the defaults of the cli:
+
+    ping
+    generate-key    file, seed, length, pixel_entropy, partial_decode
+    encrypt         key, message -> base64 message
+    decrypt         key, message (base64) -> message
+    image-hide      file, secret, out, engine -> out
+    image-reveal    file, engine -> message
+    audio-hide      file, secret, out, key, workers -> out
+    audio-reveal    file, key, workers -> message
+    text-gen-key    file, secret -> keys
+
+Paths have to be absolute, the daemon does not know the directory of the
+client. Keys and secrets pass the socket in the clear, it is only accessible
+by the user running the daemon and lives in a directory only they can enter.
+The client refuses daemons run by another user.
+"""
+
+import base64
+import json
+import os
+import socket
+import socketserver
+import stat
+import struct
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator
+
+if not hasattr(socket, "AF_UNIX"):
+    raise ImportError("The daemon needs unix domain sockets")
+
+# request fields holding paths, the client makes them absolute
+PATH_FIELDS = ("file", "out")
+
+
+def default_socket_path() -> str:
+    """
+    Returns the socket in $XDG_RUNTIME_DIR, which only its user can enter.
+    Without it the socket goes to a directory of the user in the shared temp
+    directory, created with mode 0700 and refused when someone else made it.
+    """
+    user = os.getuid()
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime:
+        return os.path.join(runtime, f"hider-{user}.sock")
+
+    directory = os.path.join(tempfile.gettempdir(), f"hider-{user}")
+    try:
+        os.mkdir(directory, 0o700)
+    except FileExistsError:
+        pass
+
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != user or info.st_mode & 0o077:
+        raise ValueError(f"{directory} is not a private directory of the user")
+    return os.path.join(directory, "hider.sock")
+
+
+class _LruCache:
+    """Thread safe LRU of values created on demand."""
+
+    def __init__(self, max_entries: int, create: Callable):
+        self.max_entries = max_entries
+        self._create = create
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, *args):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        # created outside the lock, concurrent misses may create it twice
+        value = self._create(*args)
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class Service:
+    """
+    The operations of the daemon and the state kept warm between requests:
+    the imported subsystems, the jsteg binary, pdf corpora, cipher contexts,
+    the derived keys and the mp3 segment processes.
+
+    :param cache_dir: Also cache pdf corpora in this directory.
+    :param max_corpora: Number of pdf corpora kept in memory.
+    :param max_ciphers: Number of cipher contexts kept in memory.
+    :param key_cache: Number of derived keys kept in memory, 0 disables it.
+    :param mp3_workers: Processes kept for mp3 segments, 1 runs them in the
+        daemon.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str | None = None,
+        max_corpora: int = 8,
+        max_ciphers: int = 128,
+        key_cache: int = 0,
+        mp3_workers: int = 1,
+    ):
+        self.cache_dir = cache_dir
+        self.key_cache = key_cache
+        self.mp3_workers = mp3_workers
+        self._corpora = _LruCache(max_corpora, self._load_corpus)
+        self._ciphers = _LruCache(max_ciphers, self._cipher)
+        # mp3stego redirects stderr while it runs, which threads would mix up
+        self._mp3_lock = threading.Lock()
+        self._operations = {
+            "ping": self.ping,
+            "generate-key": self.generate_key,
+            "encrypt": self.encrypt,
+            "decrypt": self.decrypt,
+            "image-hide": self.image_hide,
+            "image-reveal": self.image_reveal,
+            "audio-hide": self.audio_hide,
+            "audio-reveal": self.audio_reveal,
+            "text-gen-key": self.text_gen_key,
+        }
+
+    def start(self):
+        """Imports the subsystems and starts the caches and pools."""
+        import audio_steganogra
+        import encrypt  # noqa: F401
+        import encryption_by_text  # noqa: F401
+        import image_steganogra  # noqa: F401
+        from key import enable_key_cache
+        from utils import executable_path
+
+        executable_path("jsteg")
+        if self.key_cache:
+            enable_key_cache(self.key_cache)
+        if self.mp3_workers != 1:
+            audio_steganogra.enable_segment_pool(self.mp3_workers)
+
+    def stop(self):
+        import audio_steganogra
+        from key import disable_key_cache
+
+        audio_steganogra.disable_segment_pool()
+        disable_key_cache()
+
+    def handle(self, request: dict) -> dict:
+        """Runs a request and returns its result, raises on errors."""
+        operation = self._operations.get(request.get("op"))
+        if operation is None:
+            raise ValueError(f"Unknown operation {request.get('op')!r}")
+
+        return operation(request)
+
+    def _load_corpus(self, file: str):
+        if self.cache_dir:
+            from corpus_cache import CorpusCache
+
+            return CorpusCache(self.cache_dir).get(file)
+
+        from encryption_by_text import get_corpus
+
+        return get_corpus(file)
+
+    def corpus(self, file: str):
+        """The corpus of a pdf, reloaded when the file changed."""
+        stat = os.stat(file)
+        return self._corpora.get((file, stat.st_mtime_ns, stat.st_size), file)
+
+    @staticmethod
+    def _cipher(key: str):
+        from encrypt import CipherContext
+
+        return CipherContext(key)
+
+    def ping(self, request: dict) -> dict:
+        return {"corpora": len(self._corpora), "ciphers": len(self._ciphers)}
+
+    def generate_key(self, request: dict) -> dict:
+        from key import generate_key_from_file
+
+        key = generate_key_from_file(
+            _path(request, "file"),
+            str(request.get("seed", "42")),
+            int(request.get("pixel_entropy", 100)),
+            int(request.get("length", 32)),
+            bool(request.get("partial_decode", False)),
+        )
+        return {"key": key}
+
+    def encrypt(self, request: dict) -> dict:
+        encrypted = self._ciphers.get(request["key"], request["key"]).encrypt(
+            request["message"]
+        )
+        return {"message": base64.b64encode(encrypted).decode()}
+
+    def decrypt(self, request: dict) -> dict:
+        decrypted = self._ciphers.get(request["key"], request["key"]).decrypt(
+            base64.b64decode(request["message"])
+        )
+        return {"message": decrypted.decode("utf-8")}
+
+    def image_hide(self, request: dict) -> dict:
+        import image_steganogra
+
+        file = _path(request, "file")
+        out = _out_path(request, file)
+        image_steganogra.embed_message(
+            file, request["secret"], out, request.get("engine", "jsteg")
+        )
+        return {"out": out}
+
+    def image_reveal(self, request: dict) -> dict:
+        import image_steganogra
+
+        message = image_steganogra.extract_message(
+            _path(request, "file"), request.get("engine", "jsteg")
+        )
+        return {"message": message}
+
+    def audio_hide(self, request: dict) -> dict:
+        import audio_steganogra
+
+        file = _path(request, "file")
+        out = _out_path(request, file)
+        with self._audio_lock(file):
+            audio_steganogra.embed_message(
+                file,
+                request["secret"],
+                out,
+                request.get("key"),
+                int(request.get("workers", self.mp3_workers)),
+            )
+        return {"out": out}
+
+    def audio_reveal(self, request: dict) -> dict:
+        import audio_steganogra
+
+        file = _path(request, "file")
+        with self._audio_lock(file):
+            message = audio_steganogra.extract_message(
+                file, request.get("key"), int(request.get("workers", self.mp3_workers))
+            )
+        return {"message": message}
+
+    def _audio_lock(self, file: str):
+        from audio_steganogra import PCM_SUFFIXES
+
+        if file.lower().endswith(PCM_SUFFIXES):
+            return _NO_LOCK
+        return self._mp3_lock
+
+    def text_gen_key(self, request: dict) -> dict:
+        from encryption_by_text import gen_key_for_text
+
+        corpus = self.corpus(_path(request, "file"))
+        return {"keys": list(gen_key_for_text(request["secret"], corpus))}
+
+
+class _NoLock:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_LOCK = _NoLock()
+
+
+def _path(request: dict, field: str) -> str:
+    path = request.get(field)
+    if not path or not os.path.isabs(path):
+        raise ValueError(f"{field} has to be an absolute path")
+    return path
+
+
+def _out_path(request: dict, file: str) -> str:
+    if "out" in request:
+        return _path(request, "out")
+    return os.path.join(tempfile.gettempdir(), os.path.basename(file))
+
+
+def _error(e: Exception) -> str:
+    if isinstance(e, KeyError):
+        return f"Missing field {e}"
+    return str(e).strip() or type(e).__name__
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        server: Server = self.server
+        lock = threading.Lock()
+        pending: list[Future] = []
+
+        def answer(line: bytes):
+            # the response is written by the worker, so it is sent before the
+            # handler returns and the connection is closed
+            response = server.respond(line)
+            with lock:
+                try:
+                    self.wfile.write(response)
+                    self.wfile.flush()
+                except OSError:
+                    # the client went away, the other responses are dropped too
+                    pass
+
+        for line in self.rfile:
+            if not line.strip():
+                continue
+
+            # bounds the requests queued by all connections
+            server.slots.acquire()
+            pending.append(server.executor.submit(answer, line))
+
+        for future in pending:
+            future.exception()
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Unix socket server answering the requests of every connection in a
+    shared pool of `workers` threads.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path: str, service: Service, workers: int = 4):
+        self.service = service
+        self.executor = ThreadPoolExecutor(workers)
+        self.slots = threading.BoundedSemaphore(workers * 4)
+        _remove_stale_socket(path)
+        # the socket is created accessible by the user only
+        umask = os.umask(0o177)
+        try:
+            super().__init__(path, _Handler)
+        finally:
+            os.umask(umask)
+
+    def respond(self, line: bytes) -> bytes:
+        response = {"id": None}
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("Requests have to be JSON objects")
+
+            response["id"] = request.get("id")
+            response.update(self.service.handle(request))
+        except Exception as e:
+            response["error"] = _error(e)
+        finally:
+            self.slots.release()
+
+        return json.dumps(response).encode() + b"\n"
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(cancel_futures=True)
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+def _remove_stale_socket(path: str):
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise ValueError(f"{path} exists and is not a socket")
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+        except OSError:
+            os.unlink(path)
+            return
+
+    raise ValueError(f"A daemon is already listening on {path}")
+
+
+def _daemon_user(connection: socket.socket, path: str) -> int:
+    """Returns the user id of the process listening on a connected socket."""
+    if hasattr(socket, "SO_PEERCRED"):
+        size = struct.calcsize("3i")
+        credentials = connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, size)
+        return struct.unpack("3i", credentials)[1]
+    return os.stat(path).st_uid
+
+
+def request(requests: Iterable[dict], path: str | None = None) -> Iterator[dict]:
+    """
+    Sends requests to a running daemon over one connection and yields the
+    responses in the order of the requests. Relative paths are resolved
+    against the current directory.
+
+    :param requests: Requests, the `id` is replaced by the position.
+    :param path: Path of the socket, `default_socket_path()` by default.
+    :return: The responses without the `id`.
+    """
+    path = path or default_socket_path()
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(path)
+    except OSError as e:
+        connection.close()
+        raise ValueError(f"No daemon on {path}: {e}")
+
+    # keys and secrets must not reach a socket another user put there
+    if _daemon_user(connection, path) != os.getuid():
+        connection.close()
+        raise ValueError(f"The daemon on {path} belongs to another user")
+
+    count = 0
+
+    def send():
+        # a thread writes, so responses are read while requests are written
+        nonlocal count
+        with connection.makefile("wb") as stream:
+            for count, item in enumerate(requests, 1):
+                item = dict(item, id=count)
+                for field in PATH_FIELDS:
+                    if isinstance(item.get(field), str):
+                        item[field] = os.path.abspath(item[field])
+                stream.write(json.dumps(item).encode() + b"\n")
+        connection.shutdown(socket.SHUT_WR)
+
+    sender = threading.Thread(target=send, daemon=True)
+    sender.start()
+    with connection, connection.makefile("rb") as stream:
+        received, expected = {}, 1
+        for line in stream:
+            response = json.loads(line)
+            received[response.pop("id")] = response
+            while expected in received:
+                yield received.pop(expected)
+                expected += 1
+
+    sender.join()
+    if expected <= count:
+        raise ValueError("The daemon closed the connection")
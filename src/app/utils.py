@@ -1,9 +1,15 @@
+import functools
 import os
 import platform
 import stat
 import subprocess
 import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Iterable, Iterator
+
+from profiling import span
 
 
 def get_binary_path(binary_name):
@@ -45,22 +51,78 @@ def make_executable(file_path):
     os.chmod(file_path, st.st_mode | stat.S_IEXEC)
 
 
-def run_binary(binary_name, *args):
+@functools.cache
+def executable_path(binary_name):
+    """
+    Get the path of a binary and make it executable, once per process.
+
+    Args:
+        binary_name (str): Name of the binary file.
+
+    Returns:
+        str: Absolute path to the binary file.
+    """
+    binary_path = get_binary_path(binary_name)
+    make_executable(binary_path)
+    return binary_path
+
+
+def run_binary_bytes(binary_name, *args, stdin=None):
+    """
+    Run a binary file and return its raw output.
+
+    Args:
+        binary_name (str): Name of the binary file.
+        args (list): List of arguments to pass to the binary.
+        stdin (bytes): Optional data written to the standard input.
+
+    Returns:
+        tuple[bytes, bytes]: The standard output and error.
+    """
+    with span(f"binary.{binary_name}", len(stdin or b"")):
+        result = subprocess.run(
+            (executable_path(binary_name),) + args,
+            input=stdin,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+
+    return result.stdout, result.stderr
+
+
+def run_binary(binary_name, *args, stdin=None):
     """
     Run a binary file with subprocess after ensuring it is executable.
 
     Args:
         binary_name (str): Name of the binary file.
         args (list): List of arguments to pass to the binary.
+        stdin (bytes): Optional data written to the standard input.
     """
-    binary_path = get_binary_path(binary_name)
+    stdout, stderr = run_binary_bytes(binary_name, *args, stdin=stdin)
+    return stdout.decode(), stderr.decode()
 
-    # Ensure the binary is executable
-    make_executable(binary_path)
 
-    # Run the binary using subprocess
-    result = subprocess.run(
-        (binary_path,) + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-    )
+def map_bounded(
+    function, items: Iterable, workers: int, max_pending: int | None = None
+) -> Iterator:
+    """
+    Maps items in order, in a thread pool if there is more than one worker.
+    Only a bounded number of items is in flight, so large inputs are streamed.
+
+    :param max_pending: Items in flight, 64 per worker by default.
+    """
+    if workers <= 1:
+        yield from map(function, items)
+        return
+
+    max_pending = max_pending or workers * 64
+    pending = deque()
+    with ThreadPoolExecutor(workers) as executor:
+        for item in items:
+            pending.append(executor.submit(function, item))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
 
-    return result.stdout.decode(), result.stderr.decode()
+        while pending:
+            yield pending.popleft().result()
@@ -0,0 +1,230 @@
+import os
+import subprocess
+import tempfile
+from typing import Iterator
+
+import numpy as np
+from profiling import span
+from pydub import AudioSegment
+from pydub.utils import mediainfo_json
+from utils import map_bounded
+
+# the first frame starts with the magic, the payload size (u32) and the
+# frame step (u16), payload bits follow in every step-th frame
+VIDEO_MAGIC = b"HVID"
+VIDEO_HEADER_SIZE = len(VIDEO_MAGIC) + 6
+VIDEO_SUFFIX = ".mkv"
+# frames in flight per worker, memory is bounded by them and not the video
+FRAMES_PER_WORKER = 2
+
+
+def _video_layout(video_path) -> tuple[int, int, str]:
+    """Returns width, height and frame rate of the first video stream."""
+    info = mediainfo_json(str(video_path))
+    streams = [
+        stream
+        for stream in info.get("streams", [])
+        if stream.get("codec_type") == "video"
+    ]
+    if not streams:
+        raise ValueError(f"{video_path} has no video stream")
+
+    stream = streams[0]
+    rate = stream.get("r_frame_rate")
+    if not rate or rate.startswith("0/"):
+        rate = stream.get("avg_frame_rate", "25")
+    return int(stream["width"]), int(stream["height"]), rate
+
+
+def _read_frame(stream, frame: bytearray) -> int:
+    view, size = memoryview(frame), 0
+    while size < len(frame) and (read := stream.readinto(view[size:])):
+        size += read
+    return size
+
+
+def _frames(video_path, frame_size: int) -> Iterator[bytearray]:
+    """
+    Decodes the first video stream through ffmpeg into rgb24 frames. Every
+    frame is a new buffer, so frames can be handed to other threads. Closing
+    the generator early stops the decoder.
+    """
+    command = [
+        AudioSegment.converter,
+        *("-loglevel", "error", "-i", str(video_path), "-map", "0:v:0"),
+        *("-f", "rawvideo", "-pix_fmt", "rgb24", "-"),
+    ]
+
+    with tempfile.TemporaryFile() as stderr:
+        try:
+            # ffmpeg reads keys from stdin, which belongs to the caller
+            process = subprocess.Popen(
+                command,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=stderr,
+                bufsize=0,
+            )
+        except OSError as e:
+            raise ValueError(f"Error opening video file: {e}")
+
+        finished = False
+        with process:
+            try:
+                while True:
+                    frame = bytearray(frame_size)
+                    if _read_frame(process.stdout, frame) < frame_size:
+                        break
+                    yield frame
+                finished = True
+            finally:
+                if not finished:
+                    process.kill()
+
+        if finished and process.returncode != 0:
+            stderr.seek(0)
+            message = stderr.read().decode(errors="ignore")
+            raise ValueError(f"Error opening video file: {message}")
+
+
+def _payload_bits(message, frame_step: int) -> np.ndarray:
+    if isinstance(message, str):
+        message = message.encode("utf-8")
+
+    header = len(message).to_bytes(4, "little") + frame_step.to_bytes(2, "little")
+    data = VIDEO_MAGIC + header + bytes(message)
+    return np.unpackbits(np.frombuffer(data, np.uint8))
+
+
+def embed_message(
+    video_path, message, output_path, workers: int = 1, frame_step: int = 1
+):
+    """
+    Hides a message in the least significant bits of the rgb values of every
+    `frame_step`-th frame of a video. Frames are decoded by ffmpeg, embedded
+    by a pool of threads and piped into a lossless ffv1 encoder, only a few
+    frames per worker are in memory at any time. Audio streams are copied.
+
+    :param video_path: Carrier video in any format ffmpeg reads.
+    :param message: Text or bytes to hide.
+    :param output_path: Path of the stego video, a matroska file.
+    :param workers: Number of threads embedding frames, 0 uses all cpus.
+    :param frame_step: Distance of the frames carrying the payload.
+    """
+    if not 0 < frame_step < 1 << 16:
+        raise ValueError("Frame step must be between 1 and 65535")
+
+    width, height, rate = _video_layout(video_path)
+    frame_size = width * height * 3
+    bits = _payload_bits(message, frame_step)
+    if frame_size < VIDEO_HEADER_SIZE * 8:
+        raise ValueError("video frames are too small to hold the header")
+
+    # index of the last frame carrying payload bits
+    last_frame = (len(bits) - 1) // frame_size * frame_step
+    workers = workers or os.cpu_count() or 1
+
+    def embed(item: tuple[int, bytearray]) -> bytearray:
+        index, frame = item
+        if index % frame_step == 0 and index <= last_frame:
+            start = index // frame_step * frame_size
+            chunk = bits[start : start + frame_size]
+            data = np.frombuffer(frame, np.uint8, count=len(chunk))
+            data &= 0xFE
+            data |= chunk
+        return frame
+
+    directory = os.path.dirname(os.path.abspath(output_path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=VIDEO_SUFFIX)
+    os.close(fd)
+
+    encode = [
+        AudioSegment.converter,
+        *("-loglevel", "error", "-y", "-f", "rawvideo", "-pix_fmt", "rgb24"),
+        *("-s", f"{width}x{height}", "-framerate", rate, "-i", "-"),
+        *("-i", str(video_path), "-map", "0:v", "-map", "1:a?", "-c:a", "copy"),
+        *("-c:v", "ffv1", temp_path),
+    ]
+
+    try:
+        with tempfile.TemporaryFile() as stderr, span("video.hide") as hiding:
+            encoder = subprocess.Popen(encode, stdin=subprocess.PIPE, stderr=stderr)
+            frames = 0
+            try:
+                for frame in map_bounded(
+                    embed,
+                    enumerate(_frames(video_path, frame_size)),
+                    workers,
+                    workers * FRAMES_PER_WORKER,
+                ):
+                    encoder.stdin.write(frame)
+                    hiding.add_bytes(frame_size)
+                    frames += 1
+            except BrokenPipeError:
+                # the encoder failed, its error is reported below
+                pass
+            finally:
+                try:
+                    encoder.stdin.close()
+                except BrokenPipeError:
+                    pass
+                encoder.wait()
+
+            if encoder.returncode != 0:
+                stderr.seek(0)
+                message = stderr.read().decode(errors="ignore")
+                raise ValueError(f"Error writing video file: {message}")
+
+        if frames <= last_frame:
+            raise ValueError("video is too short to hold the requested payload")
+
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+
+
+def extract_payload(stego_video_path) -> bytes:
+    """
+    Reveals the bytes hidden by `embed_message`, decoding stops after the
+    last frame carrying payload bits.
+    """
+    width, height, _ = _video_layout(stego_video_path)
+    frame_size = width * height * 3
+    frames = _frames(stego_video_path, frame_size)
+    try:
+        first = next(frames, None)
+        if first is None or frame_size < VIDEO_HEADER_SIZE * 8:
+            raise ValueError("No hidden message found")
+
+        lsb = np.frombuffer(first, np.uint8, count=VIDEO_HEADER_SIZE * 8) & 1
+        header = np.packbits(lsb).tobytes()
+        if not header.startswith(VIDEO_MAGIC):
+            raise ValueError("No hidden message found")
+
+        size = int.from_bytes(header[len(VIDEO_MAGIC) : len(VIDEO_MAGIC) + 4], "little")
+        frame_step = int.from_bytes(header[len(VIDEO_MAGIC) + 4 :], "little") or 1
+        total = (VIDEO_HEADER_SIZE + size) * 8
+
+        chunks = [np.frombuffer(first, np.uint8, count=min(total, frame_size)) & 1]
+        collected = len(chunks[0])
+        for index, frame in enumerate(frames, 1):
+            if collected >= total:
+                break
+            if index % frame_step:
+                continue
+
+            count = min(total - collected, frame_size)
+            chunks.append(np.frombuffer(frame, np.uint8, count=count) & 1)
+            collected += count
+    finally:
+        frames.close()
+
+    if collected < total:
+        raise ValueError("Hidden message is truncated")
+
+    return np.packbits(np.concatenate(chunks)).tobytes()[VIDEO_HEADER_SIZE:]
+
+
+def extract_message(stego_video_path) -> str:
+    return extract_payload(stego_video_path).decode()
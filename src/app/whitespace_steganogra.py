@@ -0,0 +1,140 @@
+import os
+import shutil
+import tempfile
+from typing import BinaryIO
+
+from profiling import span
+
+# like SNOW the payload hides in trailing whitespace, every line carries one
+# byte as eight spaces (0) and tabs (1), most significant bit first. The
+# payload starts with the magic and its size as u32 little endian
+WHITESPACE_MAGIC = b"HTXT"
+WHITESPACE_HEADER_SIZE = len(WHITESPACE_MAGIC) + 4
+TEXT_SUFFIXES = (".txt", ".log", ".md", ".csv")
+# bytes read at once when counting lines
+BLOCK_SIZE = 1 << 20
+
+_CODES = [
+    bytes(9 if value >> bit & 1 else 32 for bit in range(7, -1, -1))
+    for value in range(256)
+]
+_VALUES = {code: value for value, code in enumerate(_CODES)}
+
+
+def _split(line: bytes) -> tuple[bytes, bytes, bytes]:
+    """Splits a line into its text, its trailing whitespace and its line end."""
+    text = line.rstrip(b"\r\n")
+    stripped = text.rstrip(b" \t")
+    return stripped, text[len(stripped) :], line[len(text) :]
+
+
+def embed(cover: BinaryIO, message, target: BinaryIO) -> int:
+    """
+    Streams a text line by line and writes it with a message hidden in the
+    trailing whitespace of its first lines, the rest is copied unchanged.
+    Trailing whitespace the carrying lines had before is replaced. Memory
+    does not depend on the size of the text.
+
+    :param cover: Readable binary stream of the carrier text.
+    :param message: Text or bytes to hide, like the output of
+        `encrypt_with_key`.
+    :param target: Writable binary stream for the stego text.
+    :return: Number of lines carrying the payload.
+    """
+    if isinstance(message, str):
+        message = message.encode("utf-8")
+
+    payload = WHITESPACE_MAGIC + len(message).to_bytes(4, "little") + bytes(message)
+    with span("text.whitespace.hide", len(payload)):
+        for value in payload:
+            line = cover.readline()
+            if not line:
+                raise ValueError("text has too few lines to hold the requested payload")
+
+            text, _, end = _split(line)
+            target.write(text + _CODES[value] + end)
+
+        shutil.copyfileobj(cover, target)
+
+    return len(payload)
+
+
+def _read_values(stego: BinaryIO, count: int) -> bytearray:
+    data = bytearray()
+    while len(data) < count and (line := stego.readline()):
+        value = _VALUES.get(_split(line)[1])
+        if value is None:
+            break
+        data.append(value)
+
+    return data
+
+
+def extract(stego: BinaryIO) -> bytes:
+    """
+    Reveals the bytes hidden by `embed`, reading stops after the last line
+    carrying the payload.
+    """
+    with span("text.whitespace.reveal") as revealing:
+        header = _read_values(stego, WHITESPACE_HEADER_SIZE)
+        if len(header) < WHITESPACE_HEADER_SIZE or not header.startswith(
+            WHITESPACE_MAGIC
+        ):
+            raise ValueError("No hidden message found")
+
+        size = int.from_bytes(header[len(WHITESPACE_MAGIC) :], "little")
+        payload = _read_values(stego, size)
+        revealing.add_bytes(len(payload))
+
+    if len(payload) < size:
+        raise ValueError("Hidden message is truncated")
+
+    return bytes(payload)
+
+
+def embed_message(text_path, message, output_path) -> int:
+    """
+    Hides a message in the trailing whitespace of a text file, see `embed`.
+    The stego text replaces `output_path` only once it is complete.
+
+    :param text_path: Carrier text with at least one line per payload byte.
+    :param message: Text or bytes to hide.
+    :param output_path: Path of the stego text.
+    :return: Number of lines carrying the payload.
+    """
+    directory = os.path.dirname(os.path.abspath(output_path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with open(text_path, "rb") as cover, os.fdopen(fd, "wb") as target:
+            lines = embed(cover, message, target)
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+
+    return lines
+
+
+def extract_payload(stego_text_path) -> bytes:
+    with open(stego_text_path, "rb") as stego:
+        return extract(stego)
+
+
+def extract_message(stego_text_path) -> str:
+    return extract_payload(stego_text_path).decode()
+
+
+def capacity(text_path) -> int:
+    """
+    Returns how many bytes can be hidden in a text file without embedding,
+    one per line minus the header.
+    """
+    lines, last = 0, b"\n"
+    with open(text_path, "rb") as f:
+        while block := f.read(BLOCK_SIZE):
+            lines += block.count(b"\n")
+            last = block[-1:]
+
+    # a last line without line end carries a byte too
+    lines += last != b"\n"
+    return max(lines - WHITESPACE_HEADER_SIZE, 0)
@@ -1,4 +1,22 @@
 import base64
+from typing import BinaryIO
+
+# documents are substituted in blocks of this size, memory stays bounded by it
+BLOCK_SIZE = 1 << 20
+MAX_BLOCK_SIZE = 64 * 1024 * 1024
+# a document key is the magic followed by frames of a u32 little endian size
+# and the xor of that many bytes, an empty frame ends the key
+KEY_MAGIC = b"HWS1"
+
+
+def _xor(a, b, size: int) -> bytes:
+    """
+    XOR of the first `size` bytes of two byte strings in one big integer
+    operation, missing bytes count as zero.
+    """
+    a, b = memoryview(a)[:size], memoryview(b)[:size]
+    value = int.from_bytes(a, "little") ^ int.from_bytes(b, "little")
+    return value.to_bytes(size, "little")
 
 
 def encrypt_sentence():
@@ -7,10 +25,7 @@ def encrypt_sentence():
 
 def create_key(word1: str, word2: str) -> str:
     b1, b2 = word1.encode(), word2.encode()
-    max_len = max(len(b1), len(b2))
-    b1_padded = b1.ljust(max_len, b"\x00")
-    b2_padded = b2.ljust(max_len, b"\x00")
-    xor_key = bytes(a ^ b for a, b in zip(b1_padded, b2_padded))
+    xor_key = _xor(b1, b2, max(len(b1), len(b2)))
     return f"{len(b2)}:{base64.b64encode(xor_key).decode()}"
 
 
@@ -18,6 +33,77 @@ def recover_word(word1: str, key: str) -> str:
     length_str, b64_xor = key.split(":")
     length = int(length_str)
     xor_key = base64.b64decode(b64_xor)
-    b1_padded = word1.encode().ljust(len(xor_key), b"\x00")
-    b2 = bytes(a ^ b for a, b in zip(b1_padded, xor_key))[:length]
+    b2 = _xor(word1.encode(), xor_key, len(xor_key))[:length]
     return b2.decode()
+
+
+def _read_block(stream: BinaryIO, size: int) -> bytes:
+    # pipes return less than asked for before their end
+    data = stream.read(size)
+    while data and len(data) < size:
+        more = stream.read(size - len(data))
+        if not more:
+            break
+        data += more
+
+    return data
+
+
+def create_document_key(
+    cover: BinaryIO, substitution: BinaryIO, key: BinaryIO, block_size: int = BLOCK_SIZE
+) -> int:
+    """
+    Streams a cover and a substitution text of any size and writes the key
+    turning the cover into the substitution block by block. The key is as
+    long as the substitution plus 4 bytes per block, cover bytes beyond the
+    substitution are not needed. Where the cover is shorter the key holds the
+    substitution itself.
+
+    :param cover: Readable binary stream of the public cover text.
+    :param substitution: Readable binary stream of the secret text.
+    :param key: Writable binary stream for the key.
+    :param block_size: Bytes XORed at once.
+    :return: Size of the substitution in bytes.
+    """
+    if not 0 < block_size <= MAX_BLOCK_SIZE:
+        raise ValueError(f"Block size must be between 1 and {MAX_BLOCK_SIZE}")
+
+    key.write(KEY_MAGIC)
+    size = 0
+    while block := _read_block(substitution, block_size):
+        key.write(len(block).to_bytes(4, "little"))
+        key.write(_xor(_read_block(cover, len(block)), block, len(block)))
+        size += len(block)
+
+    key.write(bytes(4))
+    return size
+
+
+def recover_document(cover: BinaryIO, key: BinaryIO, target: BinaryIO) -> int:
+    """
+    Streams the cover text and a key of `create_document_key` and writes the
+    substitution text.
+
+    :param cover: Readable binary stream of the public cover text.
+    :param key: Readable binary stream of the key.
+    :param target: Writable binary stream for the substitution.
+    :return: Size of the substitution in bytes.
+    """
+    if key.read(len(KEY_MAGIC)) != KEY_MAGIC:
+        raise ValueError("Not a document substitution key")
+
+    size = 0
+    while True:
+        header = _read_block(key, 4)
+        block_size = int.from_bytes(header, "little")
+        if len(header) < 4 or block_size > MAX_BLOCK_SIZE:
+            raise ValueError("Document substitution key is truncated or invalid")
+        if block_size == 0:
+            return size
+
+        block = _read_block(key, block_size)
+        if len(block) < block_size:
+            raise ValueError("Document substitution key is truncated or invalid")
+
+        target.write(_xor(_read_block(cover, block_size), block, block_size))
+        size += block_size
@@ -0,0 +1,500 @@
+"""
+Benchmarks of the hot paths on large synthetic carriers.
+
+    python src/benchmarks/benchmark.py run --scale small -o results.json
+    python src/benchmarks/benchmark.py run --baseline baseline.json
+    python src/benchmarks/benchmark.py compare results.json baseline.json
+
+Carriers are generated into --work-dir, pass the same directory to reuse them.
+"""
+
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+import click
+import generators
+
+sys.path.insert(0, str(Path(__file__).parents[1] / "app"))
+
+SCALES = {
+    "small": {
+        "gif": (20, 160, 120),
+        "jpeg": (1024, 768),
+        "wav": 10,
+        "mp3": 5,
+        "pdf": (20, 300),
+        "text": 2_000,
+        "payloads": (1 << 10, 1 << 20),
+        "hide": 32,
+    },
+    "full": {
+        "gif": (200, 640, 480),
+        "jpeg": (6000, 4000),
+        "wav": 600,
+        "mp3": 180,
+        "pdf": (300, 400),
+        "text": 200_000,
+        "payloads": (1 << 10, 1 << 20, 64 << 20),
+        "hide": 512,
+    },
+}
+KEY = "00112233445566778899aabbccddeeff00112233445566778899aabbccddeeff"
+SEED = "42"
+
+# name, setup run before the timed runs, timed function, bytes it processes
+# and the maximum number of runs
+Benchmark = tuple[str, Callable | None, Callable, int, int]
+
+
+def _size(path) -> int:
+    return os.path.getsize(path)
+
+
+def _carriers(work_dir: Path, scale: str) -> dict:
+    settings = SCALES[scale]
+    vocabulary = generators.words(5_000)
+    texts = generators.pdf_pages(*settings["pdf"], vocabulary)
+    carriers = {
+        "gif": work_dir / f"frames-{scale}.gif",
+        "jpeg": work_dir / f"photo-{scale}.jpg",
+        "wav": work_dir / f"track-{scale}.wav",
+        "mp3": work_dir / f"track-{scale}.mp3",
+        "pdf": work_dir / f"book-{scale}.pdf",
+    }
+    makers = {
+        "gif": lambda path: generators.make_gif(path, *settings["gif"]),
+        "jpeg": lambda path: generators.make_jpeg(path, *settings["jpeg"]),
+        "wav": lambda path: generators.make_wav(path, settings["wav"]),
+        "mp3": lambda path: generators.make_mp3(path, settings["mp3"]),
+        "pdf": lambda path: generators.make_pdf(path, texts),
+    }
+    for name, path in carriers.items():
+        if not path.exists():
+            click.echo(f"generating {path}", err=True)
+            makers[name](path)
+
+    carriers["text"] = generators.make_text(settings["text"], vocabulary)
+    carriers["words"] = texts[0].split()[:200]
+    return carriers
+
+
+def _key_benchmarks(carriers: dict) -> list[Benchmark]:
+    from key import (
+        extract_key_from_gif_deterministic,
+        generate_deterministic_key,
+        generate_key_from_jpeg,
+        generate_key_from_mp3,
+        get_random_string_from_book,
+    )
+
+    gif, jpeg, mp3, text = (carriers[name] for name in ("gif", "jpeg", "mp3", "text"))
+    return [
+        (
+            "key.gif",
+            None,
+            lambda: extract_key_from_gif_deterministic(gif, SEED, 100),
+            _size(gif),
+            5,
+        ),
+        ("key.jpeg", None, lambda: generate_key_from_jpeg(jpeg, SEED), _size(jpeg), 5),
+        (
+            "key.jpeg.partial",
+            None,
+            lambda: generate_key_from_jpeg(jpeg, SEED, partial_decode=True),
+            _size(jpeg),
+            5,
+        ),
+        ("key.mp3", None, lambda: generate_key_from_mp3(mp3, SEED), _size(mp3), 5),
+        (
+            "key.text",
+            None,
+            lambda: generate_deterministic_key(text, SEED),
+            len(text),
+            5,
+        ),
+        (
+            "key.book",
+            None,
+            lambda: list(get_random_string_from_book(42, 300, length=4096)),
+            0,
+            5,
+        ),
+    ]
+
+
+def _text_benchmarks(carriers: dict) -> list[Benchmark]:
+    from encryption_by_text import find_word, gen_key_for_pdf, get_corpus
+
+    pdf, words = carriers["pdf"], carriers["words"]
+    corpus = {}
+
+    def setup():
+        corpus["pdf"] = get_corpus(str(pdf))
+
+    def find_words():
+        for word in words:
+            find_word(word, corpus["pdf"])
+
+    secret = " ".join(words[:5])
+    return [
+        ("text.get_corpus", None, lambda: get_corpus(str(pdf)), _size(pdf), 3),
+        ("text.find_word", setup, find_words, 0, 5),
+        (
+            "text.gen_key_for_pdf",
+            None,
+            lambda: list(gen_key_for_pdf(secret, str(pdf))),
+            _size(pdf),
+            3,
+        ),
+    ]
+
+
+def _crypto_benchmarks(work_dir: Path, payloads: tuple[int, ...]) -> list[Benchmark]:
+    from encrypt import decrypt_file, decrypt_with_key, encrypt_file, encrypt_with_key
+
+    benchmarks: list[Benchmark] = []
+    for size in payloads:
+        plaintext = "a" * size
+        encrypted = encrypt_with_key(plaintext, KEY)
+        label = f"{size >> 20}MiB" if size >= 1 << 20 else f"{size >> 10}KiB"
+        benchmarks += [
+            (
+                f"crypto.encrypt.{label}",
+                None,
+                lambda p=plaintext: encrypt_with_key(p, KEY),
+                size,
+                5,
+            ),
+            (
+                f"crypto.decrypt.{label}",
+                None,
+                lambda e=encrypted: decrypt_with_key(e, KEY),
+                size,
+                5,
+            ),
+        ]
+
+    size = payloads[-1]
+    plain, encrypted, decrypted = (
+        work_dir / f"payload.{suffix}" for suffix in ("bin", "enc", "out")
+    )
+
+    def setup():
+        if not plain.exists() or _size(plain) != size:
+            plain.write_bytes(os.urandom(size))
+        encrypt_file(plain, encrypted, KEY)
+
+    return benchmarks + [
+        (
+            "crypto.encrypt_file",
+            setup,
+            lambda: encrypt_file(plain, encrypted, KEY),
+            size,
+            3,
+        ),
+        (
+            "crypto.decrypt_file",
+            setup,
+            lambda: decrypt_file(encrypted, decrypted, KEY),
+            size,
+            3,
+        ),
+    ]
+
+
+def _stego_benchmarks(work_dir: Path, carriers: dict, hide: int) -> list[Benchmark]:
+    import audio_steganogra
+    import image_steganogra
+
+    secret = generators.make_text(hide, generators.words(100))[:hide]
+    jpeg, wav, mp3 = carriers["jpeg"], carriers["wav"], carriers["mp3"]
+    benchmarks: list[Benchmark] = []
+    for engine in image_steganogra.ENGINES:
+        out = work_dir / f"stego-{engine}.jpg"
+
+        def hide_in_image(engine=engine, out=out):
+            image_steganogra.embed_message(jpeg, secret, out, engine)
+
+        benchmarks += [
+            (f"image.hide.{engine}", None, hide_in_image, _size(jpeg), 3),
+            (
+                f"image.reveal.{engine}",
+                hide_in_image,
+                lambda engine=engine, out=out: image_steganogra.extract_payload(
+                    out, engine
+                ),
+                _size(jpeg),
+                3,
+            ),
+        ]
+
+    stego_wav, stego_mp3 = work_dir / "stego.wav", work_dir / "stego.mp3"
+
+    def hide_in_wav():
+        audio_steganogra.embed_pcm(wav, secret, stego_wav)
+
+    def hide_in_mp3():
+        audio_steganogra.embed_mp3(mp3, secret, stego_mp3, workers=0)
+
+    # a payload of a few segments per cpu, hidden by one worker and by all of
+    # them, their times give the scaling of the segments
+    workers = os.cpu_count() or 1
+    segmented = {}
+
+    def size_segments():
+        # sized in the setup, so a run of other benchmarks does not decode mp3s
+        size = 4 * audio_steganogra.MP3_MIN_SEGMENT_SIZE * workers
+        size = min(size, audio_steganogra.capacity(mp3))
+        segmented["payload"] = (secret.encode() * (size // hide + 1))[:size]
+        audio_steganogra._warm_mp3stego()
+
+    for count in sorted({1, workers}):
+        benchmarks.append(
+            (
+                f"audio.hide.mp3.workers{count}",
+                size_segments,
+                lambda count=count: audio_steganogra.embed_mp3(
+                    mp3, segmented["payload"], stego_mp3, workers=count
+                ),
+                _size(mp3),
+                1,
+            )
+        )
+
+    return benchmarks + [
+        ("audio.hide.wav", None, hide_in_wav, _size(wav), 3),
+        (
+            "audio.reveal.wav",
+            hide_in_wav,
+            lambda: audio_steganogra.extract_pcm(stego_wav),
+            _size(wav),
+            3,
+        ),
+        # mp3stego takes minutes, one run is enough to see a regression
+        ("audio.hide.mp3", None, hide_in_mp3, _size(mp3), 1),
+        (
+            "audio.reveal.mp3",
+            lambda: stego_mp3.exists() or hide_in_mp3(),
+            lambda: audio_steganogra.extract_mp3(stego_mp3, workers=0),
+            _size(mp3),
+            1,
+        ),
+    ]
+
+
+def _measure(benchmark: Benchmark, repeat: int) -> dict:
+    _, setup, function, size, max_runs = benchmark
+    try:
+        if setup:
+            setup()
+
+        runs = []
+        for _ in range(min(repeat, max_runs)):
+            start = time.perf_counter()
+            function()
+            runs.append(time.perf_counter() - start)
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}".strip()}
+
+    result = {
+        "seconds": min(runs),
+        "median": statistics.median(runs),
+        "runs": runs,
+        "bytes": size,
+    }
+    if size:
+        result["mb_per_s"] = size / min(runs) / 1e6
+    return result
+
+
+def scaling(results: dict) -> dict:
+    """
+    Returns the speedup and efficiency of every benchmark timed with one
+    worker and with several, named like "audio.hide.mp3.workers4".
+
+    :param results: The "results" of `run`.
+    """
+    rows = {}
+    for name, result in results.items():
+        base, _, workers = name.rpartition(".workers")
+        serial = results.get(f"{base}.workers1", {})
+        if not workers.isdigit() or int(workers) < 2:
+            continue
+        if "seconds" not in result or "seconds" not in serial:
+            continue
+
+        speedup = serial["seconds"] / result["seconds"]
+        rows[base] = {
+            "workers": int(workers),
+            "speedup": speedup,
+            "efficiency": speedup / int(workers),
+        }
+    return rows
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[dict]:
+    """
+    Compares the best times of two result files.
+
+    :param results: Results of `run`.
+    :param baseline: Results to compare against.
+    :param tolerance: Relative slowdown still accepted, 0.25 is 25% slower.
+    :return: A row per benchmark with the status ok, slower, faster, new,
+        missing or error.
+    """
+    rows = []
+    new, old = results["results"], baseline["results"]
+    for name in sorted(new.keys() | old.keys()):
+        row = {"name": name}
+        if name not in old or "seconds" not in old[name]:
+            row["status"] = "new" if "seconds" in new.get(name, {}) else "error"
+        elif name not in new:
+            row["status"] = "missing"
+        elif "seconds" not in new[name]:
+            row["status"] = "error"
+        else:
+            ratio = new[name]["seconds"] / old[name]["seconds"]
+            row.update(baseline=old[name]["seconds"], ratio=ratio)
+            if ratio > 1 + tolerance:
+                row["status"] = "slower"
+            elif ratio < 1 / (1 + tolerance):
+                row["status"] = "faster"
+            else:
+                row["status"] = "ok"
+        if "seconds" in new.get(name, {}):
+            row["seconds"] = new[name]["seconds"]
+        rows.append(row)
+    return rows
+
+
+def _print_comparison(rows: list[dict]) -> bool:
+    for row in rows:
+        times = ""
+        if "ratio" in row:
+            times = (
+                f"{row['baseline']:.3g}s -> {row['seconds']:.3g}s ({row['ratio']:.2f}x)"
+            )
+        click.echo(f"{row['name']:<28} {row['status']:<8} {times}", err=True)
+    return any(row["status"] in ("slower", "error") for row in rows)
+
+
+@click.group()
+def cli():
+    """Benchmarks of key derivation, text search, encryption and hiding"""
+    pass
+
+
+@cli.command()
+@click.option("--scale", default="small", type=click.Choice(list(SCALES)))
+@click.option("-o", "--out", default="-", type=click.File("w"))
+@click.option(
+    "-k",
+    "--filter",
+    "filters",
+    multiple=True,
+    help="only run benchmarks whose name contains this",
+)
+@click.option("-r", "--repeat", default=3, type=click.IntRange(min=1))
+@click.option(
+    "--work-dir",
+    type=click.Path(file_okay=False),
+    help="keep generated carriers here to reuse them, a temp dir by default",
+)
+@click.option("--baseline", type=click.File("r"), help="compare against results")
+@click.option("--tolerance", default=0.25, type=float)
+@click.option(
+    "--min-efficiency",
+    default=0.6,
+    type=click.FloatRange(0, 1),
+    help="exit 1 if a parallel benchmark scales worse than this per worker",
+)
+def run(
+    scale: str,
+    out,
+    filters: tuple[str, ...],
+    repeat: int,
+    work_dir: str | None,
+    baseline,
+    tolerance: float,
+    min_efficiency: float,
+):
+    """Run the benchmarks and write the results as JSON"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        directory = Path(work_dir or temp_dir)
+        directory.mkdir(parents=True, exist_ok=True)
+        carriers = _carriers(directory, scale)
+        benchmarks = (
+            _key_benchmarks(carriers)
+            + _text_benchmarks(carriers)
+            + _crypto_benchmarks(directory, SCALES[scale]["payloads"])
+            + _stego_benchmarks(directory, carriers, SCALES[scale]["hide"])
+        )
+
+        results = {}
+        for benchmark in benchmarks:
+            name = benchmark[0]
+            if filters and not any(f in name for f in filters):
+                continue
+
+            results[name] = _measure(benchmark, repeat)
+            summary = results[name].get("error") or f"{results[name]['seconds']:.3g}s"
+            click.echo(f"{name:<28} {summary}", err=True)
+
+    output = {
+        "meta": {
+            "scale": scale,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+        "scaling": scaling(results),
+    }
+    json.dump(output, out, indent=2)
+    out.write("\n")
+
+    for name, row in output["scaling"].items():
+        click.echo(
+            f"{name:<28} {row['speedup']:.2f}x on {row['workers']} workers "
+            f"({row['efficiency']:.0%})",
+            err=True,
+        )
+    scales_badly = any(
+        row["efficiency"] < min_efficiency for row in output["scaling"].values()
+    )
+
+    if baseline:
+        base = json.load(baseline)
+        if filters:
+            base["results"] = {
+                name: result
+                for name, result in base["results"].items()
+                if name in results
+            }
+        if _print_comparison(compare(output, base, tolerance)):
+            raise SystemExit(1)
+    if scales_badly:
+        raise SystemExit(1)
+
+
+@cli.command(name="compare")
+@click.argument("results", type=click.File("r"))
+@click.argument("baseline", type=click.File("r"))
+@click.option("--tolerance", default=0.25, type=float)
+def compare_results(results, baseline, tolerance: float):
+    """Compare RESULTS with BASELINE, exits 1 if a benchmark got slower"""
+    rows = compare(json.load(results), json.load(baseline), tolerance)
+    if _print_comparison(rows):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,98 @@
+"""
+Generators of large synthetic carriers for the benchmarks. Every carrier is
+deterministic, so results of different runs are comparable.
+"""
+
+import random
+import string
+import subprocess
+import wave
+
+import fitz
+import numpy as np
+from PIL import Image
+from pydub import AudioSegment
+
+
+def words(count: int, seed: int = 42) -> list[str]:
+    """Returns `count` random lowercase words of 2 to 10 letters."""
+    rng = random.Random(seed)
+    return [
+        "".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 10)))
+        for _ in range(count)
+    ]
+
+
+def _texture(rng: np.random.Generator, width: int, height: int, shift: int = 0):
+    """An RGB gradient with noise, smooth enough to compress like a photo."""
+    x = np.arange(width, dtype=np.float32)[None, :]
+    y = np.arange(height, dtype=np.float32)[:, None]
+    channels = [
+        127 + 100 * np.sin((x + shift) / (37 + 11 * i)) * np.cos(y / (53 + 7 * i))
+        for i in range(3)
+    ]
+    pixels = np.stack(channels, axis=-1) + rng.normal(0, 12, (height, width, 3))
+    return np.clip(pixels, 0, 255).astype(np.uint8)
+
+
+def make_gif(path, frames: int, width: int, height: int):
+    rng = np.random.default_rng(1)
+    images = [
+        Image.fromarray(_texture(rng, width, height, 8 * i)).quantize(64)
+        for i in range(frames)
+    ]
+    images[0].save(path, save_all=True, append_images=images[1:], duration=40)
+
+
+def make_jpeg(path, width: int, height: int, quality: int = 90):
+    pixels = _texture(np.random.default_rng(2), width, height)
+    Image.fromarray(pixels).save(path, "JPEG", quality=quality)
+
+
+def make_wav(path, seconds: float, sample_rate: int = 44100):
+    rng = np.random.default_rng(3)
+    frames = int(seconds * sample_rate)
+    t = np.arange(frames) / sample_rate
+    tone = 6000 * np.sin(2 * np.pi * 440 * t)[:, None]
+    samples = tone + rng.normal(0, 2000, (frames, 2))
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(np.clip(samples, -32768, 32767).astype("<i2").tobytes())
+
+
+def make_mp3(path, seconds: float, bitrate: str = "192k"):
+    wav_path = str(path)[:-4] + ".src.wav"
+    make_wav(wav_path, seconds)
+    subprocess.run(
+        [
+            AudioSegment.converter,
+            "-loglevel",
+            "error",
+            "-y",
+            "-i",
+            wav_path,
+            "-b:a",
+            bitrate,
+            str(path),
+        ],
+        check=True,
+    )
+
+
+def pdf_pages(pages: int, words_per_page: int, vocabulary: list[str]) -> list[str]:
+    rng = random.Random(4)
+    return [" ".join(rng.choices(vocabulary, k=words_per_page)) for _ in range(pages)]
+
+
+def make_pdf(path, texts: list[str]):
+    with fitz.open() as doc:
+        for text in texts:
+            page = doc.new_page()
+            page.insert_textbox(page.rect + (36, 36, -36, -36), text, fontsize=8)
+        doc.save(path)
+
+
+def make_text(words_count: int, vocabulary: list[str]) -> str:
+    return " ".join(random.Random(5).choices(vocabulary, k=words_count))
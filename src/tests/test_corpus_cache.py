@@ -0,0 +1,53 @@
+import tempfile
+
+from corpus_cache import CorpusCache
+from data import DATA_DIR
+from encryption_by_text import get_corpus
+
+FILE = str(DATA_DIR / "lorum-ipsum.pdf")
+
+
+def test_cached_corpus_matches_extracted_corpus():
+    corpus = get_corpus(FILE)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache = CorpusCache(temp_dir)
+        assert cache.load(FILE) is None
+
+        cache.store(FILE, corpus)
+        cached = cache.load(FILE)
+
+        assert cached.text == corpus.text
+        for fragment in ("o", "ipsum", "xyzzy"):
+            assert cached.find(fragment) == corpus.find(fragment)
+
+        assert cache.clear() == 1
+        assert cache.load(FILE) is None
+
+
+def test_cache_evicts_entries_above_max_size():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache = CorpusCache(temp_dir, max_size=0)
+        path = cache.store(FILE)
+
+        # the entry just written is kept even if it exceeds the limit
+        (cache.directory / f"old{path.suffix}").write_bytes(b"x")
+        cache.evict(keep=path)
+        assert cache.entries() == [path]
+
+
+def test_get_hashes_the_pdf_once(monkeypatch):
+    import corpus_cache
+
+    calls = []
+    file_digest = corpus_cache._file_digest
+    monkeypatch.setattr(
+        corpus_cache,
+        "_file_digest",
+        lambda file: calls.append(file) or file_digest(file),
+    )
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache = CorpusCache(temp_dir)
+        assert cache.get(FILE).text == cache.get(FILE).text
+        assert calls == [FILE, FILE]
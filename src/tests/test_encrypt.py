@@ -1,6 +1,14 @@
+import io
 import secrets
 
-from encrypt import decrypt_with_key, encrypt_with_key
+import pytest
+from encrypt import (
+    CipherContext,
+    decrypt_stream,
+    decrypt_with_key,
+    encrypt_stream,
+    encrypt_with_key,
+)
 
 
 def test_encrypt():
@@ -9,3 +17,52 @@ def test_encrypt():
 
     # Encrypt
     assert decrypt_with_key(encrypt_with_key(message, key), key) == message
+
+
+def test_cipher_context():
+    key = secrets.token_bytes(32)
+    context = CipherContext(key.hex())
+    messages = ["Top secret message", b"", b"\x00binary\xff"] * 10
+
+    # compatible with the single message functions
+    assert decrypt_with_key(bytes(context.encrypt(messages[0])), key) == messages[0]
+    assert context.decrypt(encrypt_with_key(messages[0], key)) == messages[0].encode()
+
+    for workers in (1, 4):
+        encrypted = list(context.encrypt_many(messages, workers))
+        decrypted = list(context.decrypt_many(encrypted, workers))
+        assert decrypted == [m.encode() if isinstance(m, str) else m for m in messages]
+
+
+def _encrypt_stream(data: bytes, key: bytes, chunk_size: int) -> bytes:
+    encrypted = io.BytesIO()
+    encrypt_stream(io.BytesIO(data), encrypted, key, chunk_size)
+    return encrypted.getvalue()
+
+
+def _decrypt_stream(data: bytes, key: bytes) -> bytes:
+    decrypted = io.BytesIO()
+    decrypt_stream(io.BytesIO(data), decrypted, key)
+    return decrypted.getvalue()
+
+
+def test_encrypt_stream():
+    key = secrets.token_bytes(32)
+    for size in (0, 1, 15, 16, 17, 48, 100):
+        data = secrets.token_bytes(size)
+        assert _decrypt_stream(_encrypt_stream(data, key, 16), key.hex()) == data
+
+
+def test_encrypted_stream_detects_truncation_and_tampering():
+    key = secrets.token_bytes(32)
+    encrypted = _encrypt_stream(secrets.token_bytes(64), key, 16)
+    header, record = 15, 16 + 16
+
+    # cut off after a complete chunk, which was not the final one
+    with pytest.raises(ValueError):
+        _decrypt_stream(encrypted[: header + 2 * record], key)
+
+    tampered = bytearray(encrypted)
+    tampered[header + record + 3] ^= 1
+    with pytest.raises(ValueError):
+        _decrypt_stream(bytes(tampered), key)
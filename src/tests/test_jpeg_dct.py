@@ -0,0 +1,78 @@
+import io
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+from data import DATA_DIR
+from jpeg_dct import quantization_table, read_jpeg, write_jpeg
+from PIL import Image
+
+
+def _roundtrip(data: bytes):
+    coefficients = read_jpeg(data)
+    written = write_jpeg(coefficients)
+    assert np.array_equal(read_jpeg(written).blocks, coefficients.blocks)
+
+    # unchanged coefficients decode to exactly the same pixels
+    original = np.asarray(Image.open(io.BytesIO(data)))
+    assert np.array_equal(np.asarray(Image.open(io.BytesIO(written))), original)
+
+
+def test_coefficients_roundtrip():
+    data = (DATA_DIR / "cat.jpg").read_bytes()
+    _roundtrip(data)
+
+    img = Image.open(io.BytesIO(data))
+    for mode, options in (
+        ("L", {}),
+        ("RGB", {"subsampling": 0}),
+        ("RGB", {"subsampling": 1}),
+        ("RGB", {"restart_marker_rows": 1}),
+    ):
+        buffer = io.BytesIO()
+        img.convert(mode).resize((333, 211)).save(buffer, "JPEG", **options)
+        _roundtrip(buffer.getvalue())
+
+
+def test_partial_read_decodes_the_first_mcus():
+    data = (DATA_DIR / "cat.jpg").read_bytes()
+    coefficients = read_jpeg(data)
+    partial = read_jpeg(data, 10)
+    size = 10 * coefficients.blocks_per_mcu
+    assert np.array_equal(partial.blocks, coefficients.blocks[:size])
+    assert np.array_equal(
+        partial.block_components, coefficients.block_components[:size]
+    )
+
+
+def test_progressive_jpeg_is_rejected():
+    buffer = io.BytesIO()
+    Image.open(DATA_DIR / "cat.jpg").save(buffer, "JPEG", progressive=True)
+    with pytest.raises(ValueError):
+        read_jpeg(buffer.getvalue())
+
+
+def test_quantization_table():
+    buffer = io.BytesIO()
+    Image.open(DATA_DIR / "cat.jpg").save(buffer, "JPEG", qtables=[[2] * 64, [9] * 64])
+    coefficients = read_jpeg(buffer.getvalue())
+    assert list(quantization_table(coefficients, 0)) == [2] * 64
+    assert list(quantization_table(coefficients, 2)) == [9] * 64
+
+    img = Image.open(DATA_DIR / "cat.jpg")
+    coefficients = read_jpeg((DATA_DIR / "cat.jpg").read_bytes())
+    # Pillow lists the table in natural order, the coefficients are zigzag
+    assert sorted(quantization_table(coefficients, 1)) == sorted(img.quantization[1])
+
+
+def test_frozen_executable_compiles_without_cache():
+    # PyInstaller does not ship the sources numba's cache is located by
+    code = (
+        "import sys; sys.frozen = True; import jpeg_dct; "
+        f"data = open({str(DATA_DIR / 'cat.jpg')!r}, 'rb').read(); "
+        "jpeg_dct.write_jpeg(jpeg_dct.read_jpeg(data))"
+    )
+    app = Path(__file__).parents[1] / "app"
+    subprocess.run([sys.executable, "-c", code], cwd=app, check=True)
@@ -1,10 +1,21 @@
+import asyncio
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import key
 from data import DATA_DIR
 from key import (
+    KeyCache,
+    _split_carriers,
+    derive_keys_bulk,
+    disable_key_cache,
+    enable_key_cache,
     extract_key_from_gif_deterministic,
     generate_deterministic_key,
     generate_key_from_jpeg,
     generate_key_from_mp3,
     get_random_string_from_book,
+    key_fingerprint,
 )
 
 
@@ -19,6 +30,19 @@ def test_deterministic_from_gif():
     ) != extract_key_from_gif_deterministic(DATA_DIR / file, 42.41)
 
 
+def test_gif_key_is_stable():
+    # keys must stay regenerable across implementation changes
+    file = "mrbean.gif"
+    assert (
+        extract_key_from_gif_deterministic(DATA_DIR / file, 12)
+        == "88e2bcdcff3b1bf56b21420c682700ae5e545580fb71974ca874b6ad21afdb52"
+    )
+    assert (
+        extract_key_from_gif_deterministic(DATA_DIR / file, 42.42, 500)
+        == "8e8c675b1453821eda0d41eb78131fdea6a25bad018c1d27474832908caf5fd0"
+    )
+
+
 def test_deterministic_from_jpeg():
     file = "cat.jpg"
     assert len(generate_key_from_jpeg(DATA_DIR / file, 12)) == 64
@@ -30,6 +54,26 @@ def test_deterministic_from_jpeg():
     )
 
 
+def test_jpeg_key_is_stable():
+    file = "cat.jpg"
+    expected = "2194730c7fe30d52990a69bed9fbe9d48644233f4df939d2a77ec675cd54d800"
+    assert generate_key_from_jpeg(DATA_DIR / file, 12) == expected
+    assert generate_key_from_jpeg(DATA_DIR / file, 12, partial_decode=True) == expected
+    assert (
+        generate_key_from_jpeg(DATA_DIR / file, 42.42, 1000, 16)
+        == "9f5820910ec898285921ae197b6821ff"
+    )
+
+
+def test_jpeg_partial_decode_matches_full_decode():
+    file = "cat.jpg"
+    for seed in range(5):
+        # few samples keep the lowest sampled row away from the bottom
+        assert generate_key_from_jpeg(
+            DATA_DIR / file, seed, 2, partial_decode=True
+        ) == generate_key_from_jpeg(DATA_DIR / file, seed, 2)
+
+
 def test_deterministic_from_mp3():
     file = "short.mp3"
     assert len(generate_key_from_mp3(DATA_DIR / file, 12)) == 64
@@ -41,6 +85,17 @@ def test_deterministic_from_mp3():
     )
 
 
+def test_mp3_key_is_stable(monkeypatch):
+    file = "short.mp3"
+    expected = "3fe92b9ea6008ea239b9a36be0776f0db5cc618ab0b2f583b688e4495b762854"
+    assert generate_key_from_mp3(DATA_DIR / file, 12) == expected
+
+    # a wrong or missing length estimate must not change the key
+    for estimate in (1000, None):
+        monkeypatch.setattr(key, "_estimate_mp3_pcm_length", lambda _: estimate)
+        assert generate_key_from_mp3(DATA_DIR / file, 12) == expected
+
+
 def test_deterministic_from_str():
     key = "a8F2zXqL9mNpW7KdR3vT6yJ4bCgQ5xH2sZrY8wMtP"
     assert len(generate_deterministic_key(key, 12)) == 64
@@ -59,3 +114,118 @@ def test_random_source():
     assert list(get_random_string_from_book(42.42, 100)) != list(
         get_random_string_from_book(42.41, 100)
     )
+
+
+def test_key_cache():
+    text = "a8F2zXqL9mNpW7KdR3vT6yJ4bCgQ5xH2sZrY8wMtP"
+    expected = generate_deterministic_key(text, 12)
+
+    cache = enable_key_cache(max_entries=1)
+    try:
+        assert generate_deterministic_key(text, 12) == expected
+        assert generate_deterministic_key(text, 12) == expected
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        # the least recently used key is evicted and overwritten
+        evicted = next(iter(cache._entries.values()))
+        generate_deterministic_key(text, 13)
+        assert len(cache._entries) == 1
+        assert evicted == bytearray(len(evicted))
+    finally:
+        disable_key_cache()
+
+    assert key._key_cache is None
+
+
+def test_key_cache_keys_by_all_parameters():
+    cache = KeyCache()
+    derived = cache.derive(b"material", b"salt", 1000, 32)
+    assert cache.derive(b"material", b"salt", 1000, 16) != derived
+    assert cache.derive(b"material", b"salt!", 1000, 32) != derived
+    assert cache.derive(b"material", b"salt", 1001, 32) != derived
+    assert cache.derive(b"material", b"salt", 1000, 32) == derived
+    assert (cache.hits, cache.misses) == (1, 4)
+
+    cache.clear()
+    assert not cache._entries
+
+
+def test_derive_keys_bulk_matches_single_keys(tmp_path):
+    text = tmp_path / "secret.txt"
+    text.write_text("a8F2zXqL9mNpW7KdR3vT6yJ4bCgQ5xH2sZrY8wMtP\n")
+    items = [
+        (DATA_DIR / "mrbean.gif", "12", 100, 32),
+        (DATA_DIR / "cat.jpg", "12", 100, 32),
+        (DATA_DIR / "short.mp3", "12", 1000, 32),
+        (DATA_DIR / "mrbean.gif", "42.42", 500, 32),
+        (DATA_DIR / "cat.jpg", "42.42", 1000, 16),
+        (DATA_DIR / "short.mp3", "7", 10, 32),
+        (text, "12", 100, 32),
+        (tmp_path / "missing.gif", "12", 100, 32),
+    ]
+    expected = [
+        extract_key_from_gif_deterministic(DATA_DIR / "mrbean.gif", "12"),
+        generate_key_from_jpeg(DATA_DIR / "cat.jpg", "12"),
+        generate_key_from_mp3(DATA_DIR / "short.mp3", "12"),
+        extract_key_from_gif_deterministic(DATA_DIR / "mrbean.gif", "42.42", 500),
+        generate_key_from_jpeg(DATA_DIR / "cat.jpg", "42.42", 1000, 16),
+        generate_key_from_mp3(DATA_DIR / "short.mp3", "7", 10),
+        generate_deterministic_key(text.read_text().strip(), "12"),
+    ]
+
+    for workers in (1, 2):
+        results = derive_keys_bulk(items, workers)
+        assert [r.get("key") for r in results[:-1]] == expected
+        assert "error" in results[-1]
+        assert all(r["seconds"] >= 0 and r["decode_seconds"] >= 0 for r in results)
+
+
+def test_derive_keys_bulk_spreads_seeds_of_one_carrier():
+    assert _split_carriers({"a": [0, 1, 2, 3, 4]}, 2) == [
+        ("a", [0, 1, 2]),
+        ("a", [3, 4]),
+    ]
+    assert _split_carriers({"a": [0, 2], "b": [1]}, 2) == [("a", [0, 2]), ("b", [1])]
+    assert _split_carriers({"a": [0]}, 4) == [("a", [0])]
+
+    items = [(DATA_DIR / "cat.jpg", str(seed), 100, 32) for seed in range(5)]
+    expected = [generate_key_from_jpeg(DATA_DIR / "cat.jpg", str(s)) for s in range(5)]
+    assert [r["key"] for r in derive_keys_bulk(items, 2)] == expected
+
+
+def test_key_fingerprint():
+    derived = generate_deterministic_key("text", 12)
+    assert len(key_fingerprint(derived)) == 16
+    assert key_fingerprint(derived) != key_fingerprint(
+        generate_deterministic_key("text", 13)
+    )
+
+
+def test_concurrent_keys_match_serial_keys():
+    text = "a8F2zXqL9mNpW7KdR3vT6yJ4bCgQ5xH2sZrY8wMtP"
+    calls = []
+    for seed in ("12", "42.42", 7, 3.5):
+        calls += [
+            (extract_key_from_gif_deterministic, DATA_DIR / "mrbean.gif", seed),
+            (generate_key_from_jpeg, DATA_DIR / "cat.jpg", seed),
+            (generate_key_from_mp3, DATA_DIR / "short.mp3", seed),
+            (generate_deterministic_key, text, seed),
+            (lambda *args: list(get_random_string_from_book(*args)), seed, 100),
+        ]
+    calls *= 3
+
+    def call(args):
+        return args[0](*args[1:])
+
+    serial = [call(args) for args in calls]
+
+    # the global generator must neither be used nor disturbed by the derivers
+    random.seed(1)
+    with ThreadPoolExecutor(8) as executor:
+        assert list(executor.map(call, calls)) == serial
+    assert random.random() == random.Random(1).random()
+
+    async def derive_all():
+        return await asyncio.gather(*(asyncio.to_thread(call, a) for a in calls))
+
+    assert asyncio.run(derive_all()) == serial
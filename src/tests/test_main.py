@@ -0,0 +1,203 @@
+import json
+import pstats
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+from data import DATA_DIR
+
+MAIN = Path(__file__).parents[1] / "app" / "main.py"
+
+HEAVY_MODULES = {
+    "cryptography",
+    "fitz",
+    "mp3stego",
+    "numba",
+    "numpy",
+    "PIL",
+    "pydub",
+    "pymupdf",
+    "scipy",
+}
+
+# seconds the imports of a command without heavy modules may take, a few
+# times what they take today so slow runners do not fail
+LIGHT_IMPORT_BUDGET = 0.5
+
+
+def _imports(*args: str) -> tuple[set[str], float]:
+    """Runs the cli cold and returns the top level modules it imported."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", str(MAIN), *args],
+        capture_output=True,
+        text=True,
+    )
+    modules, seconds = set(), 0.0
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and not line.endswith("package"):
+            own, _, name = line[len("import time:") :].split("|")
+            modules.add(name.strip().split(".")[0])
+            seconds += int(own) / 1e6
+    return modules, seconds
+
+
+@pytest.mark.parametrize(
+    "args, allowed",
+    [
+        (["--help"], set()),
+        (["crypto", "generate-seed", "-t", "int"], set()),
+        (["crypto", "encrypt", "--help"], set()),
+        (["image", "hide", "--help"], set()),
+        (["audio", "reveil", "--help"], set()),
+        (["client", "--help"], set()),
+        (["video", "hide", "--help"], set()),
+        (["text", "hide-whitespace", "--help"], set()),
+        (["text", "gen-substitution-key", "--secret", "a", "word"], set()),
+        (
+            ["crypto", "generate-key", str(DATA_DIR / "cat.jpg")],
+            {"cryptography", "numpy", "PIL", "pydub"},
+        ),
+        (
+            ["capacity", "--engine", "native", str(DATA_DIR / "cat.jpg")],
+            {"mp3stego", "numba", "numpy", "PIL", "pydub", "scipy"},
+        ),
+    ],
+)
+def test_commands_import_only_their_subsystem(args, allowed):
+    modules, seconds = _imports(*args)
+    assert "click" in modules
+    assert modules & HEAVY_MODULES <= allowed
+    if not allowed:
+        assert seconds < LIGHT_IMPORT_BUDGET
+
+
+def test_image_engines_match_the_module():
+    # the cli lists the engines without importing image_steganogra
+    import image_steganogra
+    import main
+
+    assert main.IMAGE_ENGINES == image_steganogra.ENGINES
+
+
+def test_profile(tmp_path):
+    trace, stats = tmp_path / "trace.json", tmp_path / "stats.prof"
+    subprocess.run(
+        [
+            *(sys.executable, str(MAIN), "--profile", str(trace)),
+            *("--cprofile", str(stats), "crypto", "generate-key"),
+            str(DATA_DIR / "cat.jpg"),
+        ],
+        check=True,
+        capture_output=True,
+    )
+
+    result = json.loads(trace.read_text())
+    assert result["stages"]["key.pbkdf2"]["bytes"] == 300
+    assert {"key.sample.jpeg", "key.pbkdf2"} <= {s["name"] for s in result["spans"]}
+    assert pstats.Stats(str(stats)).total_calls > 0
+
+
+def test_document_substitution_errors(tmp_path):
+    from word_substitution import MAX_BLOCK_SIZE
+
+    import main
+
+    assert main.MAX_SUBSTITUTION_BLOCK_SIZE == MAX_BLOCK_SIZE
+
+    cover = tmp_path / "cover.txt"
+    cover.write_text("public text")
+    for args in (
+        ["gen-substitution-key-document", "--block-size", "0", cover, cover],
+        ["reveil-substitution-document", cover, cover],
+    ):
+        result = subprocess.run(
+            [sys.executable, str(MAIN), "text", *map(str, args)],
+            capture_output=True,
+            text=True,
+        )
+        assert result.returncode != 0
+        assert "Traceback" not in result.stderr
+        assert "Error:" in result.stderr
+
+
+def test_encrypt_chunk_size_is_checked(tmp_path):
+    from encrypt import MAX_CHUNK_SIZE
+
+    import main
+
+    assert main.MAX_CHUNK_SIZE == MAX_CHUNK_SIZE
+
+    plain = tmp_path / "plain.txt"
+    plain.write_text("secret")
+    for size in (0, MAX_CHUNK_SIZE + 1):
+        result = subprocess.run(
+            [sys.executable, str(MAIN), "crypto", "encrypt", "-k", "00" * 32]
+            + ["--in", str(plain), "--out", str(tmp_path / "enc")]
+            + ["--chunk-size", str(size)],
+            capture_output=True,
+            text=True,
+        )
+        assert result.returncode == 2
+        assert "Traceback" not in result.stderr
+        assert "--chunk-size" in result.stderr
+
+
+def test_verify_keys_reports_bad_manifest_lines(tmp_path):
+    manifest = tmp_path / "keys.csv"
+    cat = DATA_DIR / "cat.jpg"
+    for content, error in (
+        (f"file,seed\n{cat},12\n", "line 2: missing fingerprint"),
+        (f"file,seed,fingerprint\n{cat},12,ab\n{cat},,ab\n", "line 3: missing seed"),
+        (f"file,seed,length,fingerprint\n{cat},12,x,ab\n", "length is not a number"),
+    ):
+        manifest.write_text(content)
+        result = subprocess.run(
+            [sys.executable, str(MAIN), "crypto", "verify-keys", str(manifest)],
+            capture_output=True,
+            text=True,
+        )
+        assert result.returncode == 1
+        assert "Traceback" not in result.stderr
+        assert error in result.stderr
+
+
+def test_hide_batch_rejects_duplicate_outputs(tmp_path):
+    for folder in ("a", "b"):
+        (tmp_path / folder).mkdir()
+        (tmp_path / folder / "cat.jpg").write_bytes((DATA_DIR / "cat.jpg").read_bytes())
+    manifest = tmp_path / "secrets.csv"
+    manifest.write_text("file,secret\na/cat.jpg,one\nb/cat.jpg,two\n")
+
+    result = subprocess.run(
+        [
+            *(sys.executable, str(MAIN), "image", "hide-batch"),
+            *("-o", str(tmp_path), str(manifest)),
+        ],
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 1
+    assert "rows 1 and 2 both write" in result.stderr
+    assert not (tmp_path / "cat.jpg").exists()
+
+
+def test_generate_key_dispatches_on_any_case(tmp_path):
+    from key import extract_key_from_gif_deterministic, generate_key_from_mp3
+
+    gif = tmp_path / "MRBEAN.GIF"
+    gif.write_bytes((DATA_DIR / "mrbean.gif").read_bytes())
+    mp3 = DATA_DIR / "short.mp3"
+    for carrier, key in (
+        (gif, extract_key_from_gif_deterministic(str(gif), "7", 100, 32)),
+        (mp3, generate_key_from_mp3(str(mp3), "7", 100, 32)),
+    ):
+        result = subprocess.run(
+            [sys.executable, str(MAIN), "crypto", "generate-key", "-s", "7"]
+            + [str(carrier)],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        # neither is read as a text file any more
+        assert result.stdout == key + "\n"
@@ -0,0 +1,38 @@
+import pytest
+from profiling import disable, enable, span, timed, trace
+
+
+@timed("test.double")
+def _double(value: int) -> int:
+    return 2 * value
+
+
+def test_disabled_spans_record_nothing():
+    assert span("a") is span("b", 10)
+    with span("a") as s:
+        s.add_bytes(10)
+    assert _double(2) == 4
+    assert disable() == []
+
+
+def test_spans():
+    enable()
+    try:
+        with span("outer", 3) as outer:
+            outer.add_bytes(4)
+            assert _double(2) == 4
+            with pytest.raises(ValueError), span("inner"):
+                raise ValueError()
+    finally:
+        spans = disable()
+
+    assert [s["name"] for s in spans] == ["test.double", "inner", "outer"]
+    assert [s["depth"] for s in spans] == [1, 1, 0]
+    assert spans[1]["error"] == "ValueError"
+    assert spans[2]["bytes"] == 7
+    assert spans[2]["seconds"] >= spans[0]["seconds"] + spans[1]["seconds"]
+
+    summary = trace(spans + spans[:1], ["hider"])
+    assert summary["command"] == ["hider"]
+    assert summary["stages"]["test.double"]["count"] == 2
+    assert [s["name"] for s in summary["spans"]][0] == "outer"
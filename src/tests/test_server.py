@@ -0,0 +1,112 @@
+import os
+import socket
+import tempfile
+import threading
+
+import pytest
+from data import DATA_DIR
+from key import generate_key_from_file
+from server import Server, Service, default_socket_path, request
+
+KEY = "00112233445566778899aabbccddeeff00112233445566778899aabbccddeeff"
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+    path = str(tmp_path / "hider.sock")
+    service = Service(key_cache=0)
+    service.start()
+    server = Server(path, service, workers=3)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield path
+    server.shutdown()
+    server.server_close()
+    service.stop()
+
+
+def test_requests(socket_path, tmp_path):
+    cat = str(DATA_DIR / "cat.jpg")
+    out = str(tmp_path / "stego.jpg")
+    requests = [
+        {"op": "ping"},
+        {"op": "generate-key", "file": cat, "seed": "7"},
+        {"op": "encrypt", "key": KEY, "message": "hello äö"},
+        {
+            "op": "image-hide",
+            "file": cat,
+            "secret": "hi",
+            "out": out,
+            "engine": "native",
+        },
+        {
+            "op": "text-gen-key",
+            "file": str(DATA_DIR / "lorum-ipsum.pdf"),
+            "secret": "a",
+        },
+        {"op": "unknown"},
+        {"op": "encrypt", "key": KEY},
+    ]
+    responses = list(request(requests, socket_path))
+
+    assert len(responses) == len(requests)
+    assert responses[1] == {"key": generate_key_from_file(cat, "7")}
+    assert responses[3] == {"out": out}
+    assert len(responses[4]["keys"]) == 1
+    assert responses[5] == {"error": "Unknown operation 'unknown'"}
+    assert responses[6] == {"error": "Missing field 'message'"}
+
+    # requests of one connection run concurrently, dependent ones go later
+    requests = [
+        {"op": "decrypt", "key": KEY, **responses[2]},
+        {"op": "image-reveal", "file": out, "engine": "native"},
+    ]
+    assert list(request(requests, socket_path)) == [
+        {"message": "hello äö"},
+        {"message": "hi"},
+    ]
+
+
+def test_corpora_stay_loaded(socket_path):
+    pdf = str(DATA_DIR / "lorum-ipsum.pdf")
+    requests = [{"op": "text-gen-key", "file": pdf, "secret": s} for s in "abc"]
+    assert all("keys" in r for r in request(requests, socket_path))
+    assert list(request([{"op": "ping"}], socket_path)) == [
+        {"corpora": 1, "ciphers": 0}
+    ]
+
+
+def test_socket_in_use(socket_path, tmp_path):
+    with pytest.raises(ValueError, match="already listening"):
+        Server(socket_path, Service())
+
+    # a socket file without a daemon is replaced
+    stale = str(tmp_path / "stale.sock")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as left:
+        left.bind(stale)
+    Server(stale, Service()).server_close()
+
+    # anything else is left alone
+    notes = tmp_path / "notes.txt"
+    notes.write_text("keep me")
+    with pytest.raises(ValueError, match="not a socket"):
+        Server(str(notes), Service())
+    assert notes.read_text() == "keep me"
+
+
+def test_default_socket_is_private(tmp_path, monkeypatch):
+    monkeypatch.delenv("XDG_RUNTIME_DIR", raising=False)
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    path = default_socket_path()
+    assert os.stat(os.path.dirname(path)).st_mode & 0o777 == 0o700
+
+    # a directory others can enter may hold a socket of another user
+    os.chmod(os.path.dirname(path), 0o755)
+    with pytest.raises(ValueError, match="private"):
+        default_socket_path()
+
+
+def test_client_refuses_daemons_of_other_users(socket_path, monkeypatch):
+    monkeypatch.setattr(os, "getuid", lambda: os.geteuid() + 1)
+    with pytest.raises(ValueError, match="another user"):
+        list(request([{"op": "ping"}], socket_path))
@@ -1,14 +1,22 @@
 import os
+import subprocess
+import sys
 import tempfile
+import wave
 
 import audio_steganogra
 import image_steganogra
+import numpy as np
+import pytest
+import video_steganogra
 from data import DATA_DIR
+from pydub import AudioSegment
+from pydub.utils import mediainfo_json
 
 
 def test_hide_audio():
     file = str(DATA_DIR / "short.mp3")
-    secret_message = "# embed_message_image(filename[0], hide_me"
+    secret_message = "# embed(hide_me)"
 
     with tempfile.TemporaryDirectory() as temp_dir:
         out_path = os.path.join(temp_dir, "stego_audio.mp3")
@@ -24,3 +32,241 @@ def test_hide_image():
         out_path = os.path.join(temp_dir, "stego_image.jpg")
         image_steganogra.embed_message(file, secret_message, out_path)
         assert secret_message == image_steganogra.extract_message(out_path)
+
+
+def test_hide_many_images():
+    file = str(DATA_DIR / "cat.jpg")
+    secrets = [f"secret number {i} äö" for i in range(6)]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        outs = [os.path.join(temp_dir, f"stego_{i}.jpg") for i in range(6)]
+        items = [(file, secret, out) for secret, out in zip(secrets, outs)]
+        items.append((os.path.join(temp_dir, "missing.jpg"), "x", outs[0] + "x"))
+
+        errors = list(image_steganogra.embed_messages(items, workers=3))
+        assert errors[:-1] == [None] * 6
+        assert errors[-1]
+        assert not os.path.exists(outs[0] + "x")
+
+        revealed = list(image_steganogra.extract_messages(outs, workers=3))
+        assert revealed == [(secret, None) for secret in secrets]
+
+
+def test_native_engine_reads_and_writes_jsteg_format():
+    file = str(DATA_DIR / "cat.jpg")
+    payload = bytes(range(256)) * 4
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        native = os.path.join(temp_dir, "native.jpg")
+        image_steganogra.embed_message(file, payload, native, engine="native")
+        assert image_steganogra.extract_payload(native, engine="native") == payload
+        assert image_steganogra.extract_payload(native, engine="jsteg") == payload
+
+        jsteg = os.path.join(temp_dir, "jsteg.jpg")
+        image_steganogra.embed_message(file, "from jsteg", jsteg, engine="jsteg")
+        assert image_steganogra.extract_message(jsteg, engine="native") == "from jsteg"
+
+
+def _write_wav(path: str, sample_width: int, frames: int = 20000):
+    samples = np.random.default_rng(1).integers(-(2**12), 2**12, frames * 2)
+    samples = samples.astype("<i4").view(np.uint8).reshape(-1, 4)[:, :sample_width]
+    with wave.open(path, "wb") as f:
+        f.setnchannels(2)
+        f.setsampwidth(sample_width)
+        f.setframerate(44100)
+        f.writeframes(samples.tobytes())
+
+
+@pytest.mark.parametrize(
+    "suffix, sample_width", [(".wav", 2), (".wav", 3), (".flac", 2)]
+)
+def test_hide_pcm(suffix, sample_width):
+    payload = bytes(range(256)) * 8
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        file = os.path.join(temp_dir, f"carrier{suffix}")
+        _write_wav(os.path.join(temp_dir, "carrier.wav"), sample_width)
+        if suffix == ".flac":
+            subprocess.run(
+                [
+                    AudioSegment.converter,
+                    "-loglevel",
+                    "error",
+                    "-i",
+                    file[:-5] + ".wav",
+                    file,
+                ],
+                check=True,
+            )
+
+        for key in (None, "key"):
+            out_path = os.path.join(temp_dir, f"stego{suffix}")
+            audio_steganogra.embed_pcm(file, payload, out_path, key)
+            assert audio_steganogra.extract_pcm(out_path, key) == payload
+
+        audio_steganogra.embed_message(file, "message", out_path)
+        assert audio_steganogra.extract_message(out_path) == "message"
+
+        with pytest.raises(ValueError):
+            audio_steganogra.extract_pcm(out_path, "wrong key")
+        with pytest.raises(ValueError):
+            audio_steganogra.embed_pcm(file, bytes(10000), out_path)
+
+
+def test_hide_flac_checks_decoded_samples(tmp_path, monkeypatch):
+    _write_wav(str(tmp_path / "carrier.wav"), 2)
+    file = tmp_path / "carrier.flac"
+    subprocess.run(
+        [
+            AudioSegment.converter,
+            "-loglevel",
+            "error",
+            "-i",
+            file.with_suffix(".wav"),
+            file,
+        ],
+        check=True,
+    )
+
+    # a duration estimate ten times too long spreads the bits past the end
+    flac_layout = audio_steganogra._flac_layout
+
+    def overestimated(path):
+        layout, *options = flac_layout(path)
+        layout.samples *= 10
+        return layout, *options
+
+    monkeypatch.setattr(audio_steganogra, "_flac_layout", overestimated)
+    out = tmp_path / "stego.flac"
+    with pytest.raises(ValueError, match="too small"):
+        audio_steganogra.embed_pcm(file, bytes(range(256)), out, "key")
+    assert not out.exists()
+
+
+def test_hide_mp3_segments():
+    payload = "a secret long enough to be split into two segments"
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        file = os.path.join(temp_dir, "carrier.mp3")
+        _write_wav(file[:-4] + ".wav", 2, 100 * 1152)
+        subprocess.run(
+            [
+                AudioSegment.converter,
+                "-loglevel",
+                "error",
+                "-i",
+                file[:-4] + ".wav",
+                "-b:a",
+                "128k",
+                file,
+            ],
+            check=True,
+        )
+
+        progress = []
+        out_path = os.path.join(temp_dir, "stego.mp3")
+        audio_steganogra.embed_message(
+            file, payload, out_path, workers=2, progress=lambda *p: progress.append(p)
+        )
+        assert [done for done, total, _ in progress] == [1, 2, 3]
+        assert {total for _, total, _ in progress} == {3}
+
+        # only the frames at the end carrying the payload are re-encoded
+        with open(file, "rb") as carrier, open(out_path, "rb") as stego:
+            assert carrier.read(4096) == stego.read(4096)
+
+        assert audio_steganogra.extract_message(out_path, workers=2) == payload
+
+
+def test_hide_mp3_checks_capacity(tmp_path, monkeypatch):
+    file = DATA_DIR / "short.mp3"
+    out = tmp_path / "stego.mp3"
+    # the single pass fallback of mp3stego would cut the message off
+    monkeypatch.setattr(audio_steganogra, "Steganography", None)
+    with pytest.raises(ValueError, match="too small"):
+        audio_steganogra.embed_mp3(
+            file, bytes(audio_steganogra.capacity(file) + 1), out
+        )
+    assert not out.exists()
+
+    # nor may it when a segment holds fewer bits than estimated
+    class Steganography:
+        def __init__(self, quiet):
+            pass
+
+        def hide_message(self, audio_path, output_path, message):
+            out.write_bytes(b"")
+            return True
+
+    monkeypatch.setattr(audio_steganogra, "Steganography", Steganography)
+    monkeypatch.setattr(audio_steganogra, "_embed_mp3_segments", lambda *_: None)
+    with pytest.raises(ValueError, match="too small"):
+        audio_steganogra.embed_mp3(file, b"fits", out)
+    assert not out.exists()
+
+
+def test_warm_mp3stego_in_frozen_executable(monkeypatch):
+    def enable_caching(self):
+        raise RuntimeError("cannot cache function: no locator available")
+
+    # numba locates the cache by the sources, which PyInstaller leaves out
+    monkeypatch.setattr(sys, "frozen", True, raising=False)
+    monkeypatch.setattr(audio_steganogra, "_mp3stego_warm", False)
+    monkeypatch.setattr(audio_steganogra.Dispatcher, "enable_caching", enable_caching)
+    audio_steganogra._warm_mp3stego()
+    assert audio_steganogra._mp3stego_warm
+
+
+def test_capacity():
+    image = str(DATA_DIR / "cat.jpg")
+    size = image_steganogra.capacity(image, "native")
+    assert 0 < image_steganogra.capacity(image) < size
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        out_path = os.path.join(temp_dir, "stego.jpg")
+        image_steganogra.embed_message(image, bytes(size), out_path, "native")
+        # the payload fills the whole scan, reveal decodes it in parts
+        assert image_steganogra.extract_payload(out_path, "native") == bytes(size)
+        with pytest.raises(ValueError):
+            image_steganogra.embed_message(image, bytes(size + 1), out_path, "native")
+
+        wav = os.path.join(temp_dir, "carrier.wav")
+        _write_wav(wav, 2)
+        size = audio_steganogra.capacity(wav)
+        assert size == 40000 // 8 - 8
+        audio_steganogra.embed_pcm(wav, bytes(size), out_path[:-4] + ".wav")
+        with pytest.raises(ValueError):
+            audio_steganogra.embed_pcm(wav, bytes(size + 1), out_path[:-4] + ".wav")
+
+    mp3 = DATA_DIR / "short.mp3"
+    size = audio_steganogra.capacity(mp3)
+    assert size > 0
+    # the largest payload embed_mp3 still finds segments for
+    offsets, _, granules = audio_steganogra._mp3_frames(mp3.read_bytes())
+    assert audio_steganogra._mp3_segments(len(offsets), granules, size, 4)
+    assert audio_steganogra._mp3_segments(len(offsets), granules, size + 1, 4) is None
+
+
+def test_hide_video(tmp_path):
+    video = tmp_path / "video.mp4"
+    subprocess.run(
+        [
+            AudioSegment.converter,
+            *("-loglevel", "error", "-f", "lavfi", "-i", "testsrc=size=64x48:rate=10"),
+            *("-f", "lavfi", "-i", "sine", "-t", "2", "-pix_fmt", "yuv420p"),
+            *("-c:a", "aac", "-shortest", str(video)),
+        ],
+        check=True,
+    )
+    # a frame holds 64 * 48 * 3 bits, the secret needs frames 0, 2 and 4
+    secret = bytes(range(256)) * 12
+    out = tmp_path / "stego.mkv"
+    video_steganogra.embed_message(video, secret, out, workers=2, frame_step=2)
+    assert video_steganogra.extract_payload(out) == secret
+    streams = mediainfo_json(str(out))["streams"]
+    assert [s["codec_type"] for s in streams] == ["video", "audio"]
+
+    with pytest.raises(ValueError, match="too short"):
+        video_steganogra.embed_message(video, secret * 10, out, frame_step=4)
+    with pytest.raises(ValueError, match="No hidden message"):
+        video_steganogra.extract_payload(video)
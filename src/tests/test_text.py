@@ -1,5 +1,17 @@
+from functools import cache
+
+import pytest
+import whitespace_steganogra
 from data import DATA_DIR
-from encryption_by_text import find_word, get_text
+from encrypt import decrypt_with_key, encrypt_with_key
+from encryption_by_text import (
+    Corpus,
+    _Lookup,
+    _segment,
+    find_word,
+    gen_key_for_pdf_many,
+    get_text,
+)
 
 
 def test_words_in_txt():
@@ -22,3 +34,112 @@ def test_words_in_txt():
                 for p, c, l, w, b, e in res
             ]
         )
+
+
+def test_corpus_finds_every_word_containing_fragment():
+    text = get_text(DATA_DIR / "lorum-ipsum.pdf")
+    corpus = Corpus.from_text(text)
+
+    for fragment in ("o", "in", "ipsum", "Lorem", "xyzzy"):
+        expected = [
+            (p + 1, c + 1, n + 1, w + 1, word.index(fragment) + 1, len(fragment))
+            for p, page in enumerate(text)
+            for c, column in enumerate(page)
+            for n, line in enumerate(column)
+            for w, word in enumerate(line)
+            if fragment in word
+        ]
+        assert corpus.find(fragment) == expected
+
+
+def test_parallel_extraction_matches_serial_extraction():
+    file = DATA_DIR / "lorum-ipsum.pdf"
+    assert get_text(file, workers=2) == get_text(file)
+
+
+def test_batch_keys_decode_to_secrets():
+    file = DATA_DIR / "lorum-ipsum.pdf"
+    text = get_text(file)
+    secrets = ["found finger", "aunt belt toe", "xyzzy", "industrial father"]
+
+    for workers in (1, 2):
+        results = list(gen_key_for_pdf_many(secrets, file, workers))
+        assert results[2][0] is None and "could not be found" in results[2][1]
+
+        for secret, (key, error) in zip(secrets, results):
+            if error:
+                continue
+            assert secret == " ".join(
+                "".join(
+                    text[p - 1][c - 1][n - 1][w - 1][b - 1 : b + e - 1]
+                    for p, c, n, w, b, e in word
+                )
+                for word in key
+            )
+
+
+def test_lookup_keeps_recent_fragments():
+    corpus = Corpus.from_text(get_text(DATA_DIR / "lorum-ipsum.pdf"))
+    lookup = _Lookup(max_entries=2)
+    for fragment in ("o", "in", "o", "ipsum"):
+        found = lookup.occurrences(fragment, corpus)
+        assert [list(a) for a in found] == [
+            list(a) for a in corpus.occurrences(fragment)
+        ]
+
+    # "in" was used least recently
+    assert len(lookup) == 2 and list(lookup._entries) == ["o", "ipsum"]
+
+
+def test_segment_uses_fewest_fragments():
+    corpus = Corpus.from_text(get_text(DATA_DIR / "lorum-ipsum.pdf"))
+
+    for word in ("found", "industrial", "consecteturlorem", "quaeratdolorem"):
+
+        @cache
+        def fewest(i):
+            if i == len(word):
+                return 0
+            return min(
+                1 + fewest(j)
+                for j in range(i + 1, len(word) + 1)
+                if corpus.contains(word[i:j])
+            )
+
+        fragments = _segment(word, corpus)
+        assert "".join(fragments) == word
+        assert len(fragments) == fewest(0)
+
+
+def test_hide_whitespace(tmp_path):
+    lines = [f"line {i} \t\r\n" if i % 3 else f"line {i}\n" for i in range(200)]
+    cover = tmp_path / "cover.txt"
+    cover.write_text("".join(lines) + "last line")
+    assert whitespace_steganogra.capacity(cover) == 201 - 8
+
+    key = "ab" * 32
+    secret = encrypt_with_key("Äpfel und Birnen", key)
+    out = tmp_path / "stego.txt"
+    assert whitespace_steganogra.embed_message(cover, secret, out) == len(secret) + 8
+    assert decrypt_with_key(whitespace_steganogra.extract_payload(out), key) == (
+        "Äpfel und Birnen"
+    )
+
+    # the text and line ends stay, lines after the payload are copied as is
+    stego = out.read_bytes().splitlines(keepends=True)
+    assert [line.rstrip(b" \t\r\n") for line in stego] == [
+        line.encode().rstrip(b" \t\r\n") for line in lines
+    ] + [b"last line"]
+    assert [line.endswith(b"\r\n") for line in stego[:-1]] == [
+        line.endswith("\r\n") for line in lines
+    ]
+    assert (
+        b"".join(stego[len(secret) + 8 :])
+        == cover.read_bytes().split(b"\n", len(secret) + 8)[-1]
+    )
+
+    with pytest.raises(ValueError, match="too few lines"):
+        whitespace_steganogra.embed_message(cover, bytes(194), tmp_path / "long.txt")
+    assert not (tmp_path / "long.txt").exists()
+    with pytest.raises(ValueError, match="No hidden message"):
+        whitespace_steganogra.extract_payload(cover)
@@ -1,4 +1,13 @@
-from word_substitution import create_key, recover_word
+import io
+import random
+
+import pytest
+from word_substitution import (
+    create_document_key,
+    create_key,
+    recover_document,
+    recover_word,
+)
 
 
 def test_word_substitute():
@@ -9,3 +18,32 @@ def test_word_substitute():
 
     print(f"\n{recover_word(original_text, key)}\n{substitution}\n{key}\n")
     assert recover_word(original_text, key) == substitution, "Substitution failed"
+
+
+def test_word_key_format():
+    # keys of the former byte by byte implementation
+    assert create_key("hund katze", "Äpfel und Birnen") == "17:q/EeAkUHQQEUASBCaXJuZW4="
+    assert create_key("a long cover", "x") == "1:GSBsb25nIGNvdmVy"
+    assert recover_word("a long cover", "1:GSBsb25nIGNvdmVy") == "x"
+
+
+@pytest.mark.parametrize("cover_size", [0, 1000, 5000, 20000])
+def test_document_substitution(cover_size):
+    cover = random.Random(1).randbytes(cover_size)
+    secret = "Äpfel und Birnen ".encode() * 500
+
+    key = io.BytesIO()
+    assert create_document_key(
+        io.BytesIO(cover), io.BytesIO(secret), key, block_size=1000
+    ) == len(secret)
+    # 4 bytes magic, 4 bytes per block and the empty frame
+    assert len(key.getvalue()) == len(secret) + 4 + 4 * 9 + 4
+
+    recovered = io.BytesIO()
+    key.seek(0)
+    assert recover_document(io.BytesIO(cover), key, recovered) == len(secret)
+    assert recovered.getvalue() == secret
+
+    with pytest.raises(ValueError, match="truncated"):
+        truncated = io.BytesIO(key.getvalue()[:-10])
+        recover_document(io.BytesIO(cover), truncated, io.BytesIO())